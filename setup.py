@@ -8,8 +8,8 @@ import sys
 
 PY_MAJOR_VERSION = sys.version_info[0]
 PY_MINOR_VERSION = sys.version_info[1]
-if PY_MAJOR_VERSION < 3 or PY_MAJOR_VERSION == 3 and PY_MINOR_VERSION < 3:
-    raise Exception("python %d.%d detected; minimum version 3.3 required" %
+if PY_MAJOR_VERSION < 3 or PY_MAJOR_VERSION == 3 and PY_MINOR_VERSION < 5:
+    raise Exception("python %d.%d detected; minimum version 3.5 required" %
                     (PY_MAJOR_VERSION, PY_MINOR_VERSION))
 
 here = os.path.dirname(os.path.realpath(__file__))
@@ -35,8 +35,6 @@ setuptools.setup(
         'Intended Audience :: Developers',
         'License :: Public Domain',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
     ],
@@ -55,9 +53,11 @@ setuptools.setup(
     },
     entry_points={
         'console_scripts': [
+            'filehash=zmwangx.hash:main',
             'humansize=zmwangx.humansize:main',
             'humantime=zmwangx.humantime:main',
             'urlgrep=zmwangx.urlgrep:main',
+            'zmwangx-dedupe=zmwangx.dedupe:main',
         ]
     },
     test_suite='tests',
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+"""Benchmark URLResolver against urllib.parse.urljoin.
+
+Run with ``python tests/benchmark_urljoin.py``.
+
+"""
+
+import timeit
+import urllib.parse
+
+from zmwangx.urlgrep import URLResolver
+
+BASE = "https://example.com/blog/2015/05/post.html"
+
+URLS = [
+    "https://cdn.example.net/js/app.min.js",
+    "//fonts.example.org/css?family=Sans",
+    "/static/style.css",
+    "/tag/python/",
+    "images/figure-1.png",
+    "comments.html#respond",
+    "mailto:author@example.com",
+    "javascript:void(0)",
+    "../archive.html",
+    "?page=2",
+] * 100
+
+
+def resolve_all(base, urls):
+    resolve = URLResolver(base).resolve
+    return [resolve(url) for url in urls]
+
+
+def main():
+    assert resolve_all(BASE, URLS) == [urllib.parse.urljoin(BASE, url) for url in URLS]
+    timings = [
+        ("urljoin", lambda: [urllib.parse.urljoin(BASE, url) for url in URLS]),
+        ("URLResolver", lambda: resolve_all(BASE, URLS)),
+    ]
+    for name, function in timings:
+        best = min(timeit.repeat(function, number=100, repeat=5))
+        print("%-12s %8.2f us/url" % (name, best / 100 / len(URLS) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+import unittest
+import unittest.mock
+
+from zmwangx.asynchash import HashPool
+
+
+class TestHashPool(unittest.TestCase):
+
+    def test_max_concurrency(self):
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+
+        def file_hash(file, algorithm, **kwargs):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return "%s:%s" % (algorithm, file)
+
+        files = ["file%d" % i for i in range(12)]
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+        loop = asyncio.new_event_loop()
+        try:
+            with unittest.mock.patch("zmwangx.hash.file_hash", file_hash):
+                hexdigests = loop.run_until_complete(
+                    HashPool(3, executor=executor).map(files, "md5"))
+        finally:
+            loop.close()
+            executor.shutdown()
+        self.assertEqual(hexdigests, ["md5:%s" % file for file in files])
+        self.assertEqual(peak[0], 3)
+
+    def test_lazy_files(self):
+        lock = threading.Lock()
+        completed = [0]
+        in_flight = []
+
+        def file_hash(file, algorithm, **kwargs):
+            time.sleep(0.01)
+            with lock:
+                completed[0] += 1
+            return file
+
+        def files():
+            for i in range(12):
+                with lock:
+                    in_flight.append(i - completed[0])
+                yield "file%d" % i
+
+        loop = asyncio.new_event_loop()
+        try:
+            with unittest.mock.patch("zmwangx.hash.file_hash", file_hash):
+                hexdigests = loop.run_until_complete(HashPool(3).map(files(), "md5"))
+        finally:
+            loop.close()
+        self.assertEqual(hexdigests, ["file%d" % i for i in range(12)])
+        self.assertLessEqual(max(in_flight), 3)
+
+    def test_error(self):
+        def file_hash(file, algorithm, **kwargs):
+            if file == "file2":
+                raise FileNotFoundError(2, "No such file or directory", file)
+            return file
+
+        consumed = []
+
+        def files():
+            for i in range(100):
+                consumed.append(i)
+                yield "file%d" % i
+
+        loop = asyncio.new_event_loop()
+        try:
+            with unittest.mock.patch("zmwangx.hash.file_hash", file_hash):
+                with self.assertRaises(FileNotFoundError):
+                    loop.run_until_complete(HashPool(2).map(files(), "md5"))
+        finally:
+            loop.close()
+        self.assertLess(len(consumed), 100)
+
+    def test_multiple_loops(self):
+        def file_hash(file, algorithm, **kwargs):
+            time.sleep(0.01)
+            return file
+
+        pool = HashPool(1)
+        files = ["file%d" % i for i in range(3)]
+        with unittest.mock.patch("zmwangx.hash.file_hash", file_hash):
+            for _ in range(2):
+                loop = asyncio.new_event_loop()
+                try:
+                    self.assertEqual(loop.run_until_complete(pool.map(files, "md5")), files)
+                finally:
+                    loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
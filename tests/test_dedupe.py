@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import zmwangx.dedupe
+import zmwangx.hash
+from zmwangx.dedupe import HEAD_TAIL_SIZE, SizeTable, _regroup, find_duplicates
+from zmwangx.infrastructure import capture_stdout
+
+
+class TestRegroup(unittest.TestCase):
+
+    def test_consecutive_keys(self):
+        results = [
+            ((1, ["a"]), "x"), ((1, ["b"]), "y"), ((1, ["c"]), "x"),
+            ((2, ["d"]), "x"), ((2, ["e"]), None), ((2, ["f"]), None),
+            # the same key again, not adjacent to its first run
+            ((1, ["g"]), "x"),
+        ]
+        self.assertEqual(list(_regroup(results)), [(1, "x", [["a"], ["c"]])])
+
+    def test_empty(self):
+        self.assertEqual(list(_regroup([])), [])
+
+
+class TestSizeTable(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        table = SizeTable(bits=4)
+        sizes = list(range(1, 100))
+        for size in sizes + sizes[::7]:
+            table.add(size)
+        for size in sizes[::7]:
+            self.assertTrue(table.maybe_duplicate(size))
+        # 16 buckets for 99 sizes: some unique sizes share a bucket
+        self.assertTrue(any(table.maybe_duplicate(size) for size in sizes
+                            if size not in sizes[::7]))
+
+
+class TestFindDuplicates(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fileobj:
+            fileobj.write(content)
+        return path
+
+    def groups(self, **kwargs):
+        return [(group.size, [os.path.relpath(path, self.tmpdir) for path in group.paths])
+                for group in find_duplicates([self.tmpdir], "md5", workers=2, **kwargs)]
+
+    def test_hard_links(self):
+        original = self.write("a", b"foo")
+        os.link(original, os.path.join(self.tmpdir, "a.link"))
+        # a lone inode is not a duplicate, however many links it has
+        self.assertEqual(self.groups(), [])
+        self.write("sub/c", b"foo")
+        self.assertEqual(self.groups(), [(3, ["a", "a.link", "sub/c"])])
+
+    def test_overlapping_roots(self):
+        self.write("a", b"foo")
+        self.write("sub/b", b"foo")
+        roots = [self.tmpdir, os.path.join(self.tmpdir, "sub"),
+                 os.path.join(self.tmpdir, "a"), os.path.join(self.tmpdir, ".", "a")]
+        for roots in (roots, roots[::-1]):
+            groups = list(find_duplicates(roots, "md5"))
+            self.assertEqual(len(groups), 1)
+            self.assertEqual(sorted(os.path.realpath(path) for path in groups[0].paths),
+                             [os.path.realpath(os.path.join(self.tmpdir, name))
+                              for name in ("a", "sub/b")])
+
+    def test_same_head_and_tail(self):
+        head, tail = b"h" * HEAD_TAIL_SIZE, b"t" * HEAD_TAIL_SIZE
+        paths = [self.write("x", head + b"1" * 100 + tail),
+                 self.write("y", head + b"2" * 100 + tail),
+                 self.write("z", head + b"1" * 100 + tail)]
+        fingerprints = {zmwangx.hash.fast_fingerprint(path, "md5", samples=2,
+                                                      sample_size=HEAD_TAIL_SIZE)
+                        for path in paths}
+        self.assertEqual(len(fingerprints), 1)
+        self.assertEqual(self.groups(), [(2 * HEAD_TAIL_SIZE + 100, ["x", "z"])])
+
+    def test_size_table_false_positives(self):
+        for i in range(20):
+            self.write("unique%d" % i, b"u" * (i + 1))
+        self.write("dup1", b"d" * 50)
+        self.write("dup2", b"d" * 50)
+        self.write("other", b"o" * 50)
+        # with 2 buckets, every size looks like a candidate
+        self.assertEqual(self.groups(table_bits=1), [(50, ["dup1", "dup2"])])
+        self.assertEqual(self.groups(table_bits=1), self.groups())
+
+    def test_read_errors(self):
+        for name in ("a", "b", "c"):
+            self.write(name, b"foo")
+        unreadable = os.path.join(self.tmpdir, "b")
+
+        def fast_fingerprint(path, *args, **kwargs):
+            if path == unreadable:
+                raise PermissionError(13, "Permission denied", path)
+            return real_fast_fingerprint(path, *args, **kwargs)
+
+        real_fast_fingerprint = zmwangx.hash.fast_fingerprint
+        with unittest.mock.patch("zmwangx.hash.fast_fingerprint", fast_fingerprint):
+            with self.assertLogs(level="WARNING") as logs:
+                self.assertEqual(self.groups(), [(3, ["a", "c"])])
+        self.assertIn("cannot read '%s'" % unreadable, logs.output[0])
+
+        def hash_many(files, *args, **kwargs):
+            for result in real_hash_many(files, *args, **kwargs):
+                if result.file == unreadable:
+                    result = result._replace(
+                        hexdigest=None,
+                        error=PermissionError(13, "Permission denied", result.file))
+                yield result
+
+        real_hash_many = zmwangx.hash.hash_many
+        with unittest.mock.patch("zmwangx.hash.hash_many", hash_many):
+            with self.assertLogs(level="WARNING") as logs:
+                self.assertEqual(self.groups(), [(3, ["a", "c"])])
+        self.assertIn("cannot read '%s'" % unreadable, logs.output[0])
+
+    def test_main(self):
+        self.write("a", b"foo")
+        self.write("b", b"foo")
+        self.write("c", b"bar!")
+        self.write("d", b"bar!")
+        self.write("e", b"")
+        self.write("f", b"")
+        argv = ["zmwangx-dedupe", "-a", "md5", "-j", "2", self.tmpdir]
+        with unittest.mock.patch.object(sys, "argv", argv), capture_stdout():
+            returncode = zmwangx.dedupe.main()
+            stdout = sys.stdout.getvalue()
+        self.assertEqual(returncode, 0)
+        groups = [json.loads(line) for line in stdout.splitlines()]
+        self.assertEqual(groups, [
+            {"size": 3, "digest": "acbd18db4cc2f85cedef654fccc4a4d8",
+             "paths": [os.path.join(self.tmpdir, "a"), os.path.join(self.tmpdir, "b")]},
+            {"size": 4, "digest": "bb0d3e2eb8e78f4a10d55415e8e4677f",
+             "paths": [os.path.join(self.tmpdir, "c"), os.path.join(self.tmpdir, "d")]},
+        ])
+
+        argv = ["zmwangx-dedupe", "-a", "nonexistent", self.tmpdir]
+        with unittest.mock.patch.object(sys, "argv", argv), \
+             capture_stdout(), unittest.mock.patch("zmwangx.dedupe.cerror") as cerror:
+            self.assertEqual(zmwangx.dedupe.main(), 1)
+        self.assertEqual(cerror.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
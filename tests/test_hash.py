@@ -0,0 +1,606 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import errno
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import zmwangx.hash
+from zmwangx.hash import (copy_hash, fast_fingerprint, file_hash, hash_many,
+                          piecewise_hash, tree_hash)
+from zmwangx.hashcache import HashCache
+from zmwangx.infrastructure import capture_stderr, capture_stdout, change_home
+
+
+class ShortReader(io.RawIOBase):
+    """Non-seekable stream returning at most `max_read` bytes per read."""
+
+    def __init__(self, data, max_read):
+        self.data = data
+        self.max_read = max_read
+        self.sizes = []
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        self.sizes.append(len(buf))
+        nbytes = min(len(buf), self.max_read, len(self.data))
+        buf[:nbytes] = self.data[:nbytes]
+        self.data = self.data[nbytes:]
+        return nbytes
+
+
+class TestChunks(unittest.TestCase):
+
+    def test_length(self):
+        fileobj = io.BytesIO(b"abcdefghij")
+        self.assertEqual([bytes(view) for view in
+                          zmwangx.hash.chunks_into(fileobj, 3, length=7)],
+                         [b"abc", b"def", b"g"])
+        self.assertEqual(fileobj.tell(), 7)
+        fileobj = io.BytesIO(b"abcdefghij")
+        self.assertEqual(list(zmwangx.hash.chunks(fileobj, 3, length=7)),
+                         [b"abc", b"def", b"g"])
+        self.assertEqual(fileobj.tell(), 7)
+        self.assertEqual(list(zmwangx.hash.chunks_into(io.BytesIO(b"abc"), 3, length=0)),
+                         [])
+        self.assertEqual([bytes(view) for view in
+                          zmwangx.hash.chunks_into(io.BytesIO(b"abc"), 2, length=100)],
+                         [b"ab", b"c"])
+
+    def test_short_reads(self):
+        data = bytes(range(100))
+        fileobj = ShortReader(data, 7)
+        self.assertFalse(fileobj.seekable())
+        views = [bytes(view) for view in zmwangx.hash.chunks_into(fileobj, 16)]
+        self.assertEqual(b"".join(views), data)
+        self.assertTrue(all(len(view) <= 7 for view in views))
+
+        # a short read never makes the last read overshoot the length
+        fileobj = ShortReader(data, 7)
+        views = [bytes(view) for view in zmwangx.hash.chunks_into(fileobj, 16, length=50)]
+        self.assertEqual(b"".join(views), data[:50])
+        self.assertEqual(fileobj.sizes, [16, 16, 16, 16, 16, 15, 8, 1])
+        self.assertEqual(fileobj.data, data[50:])
+
+    def test_buffer_reuse(self):
+        views = list(zmwangx.hash.chunks_into(io.BytesIO(b"abcdef"), 2))
+        self.assertEqual(len(views), 3)
+        self.assertTrue(all(view.obj is views[0].obj for view in views))
+        # every view sees the contents of the last read
+        self.assertEqual([bytes(view) for view in views], [b"ef"] * 3)
+
+
+class TestAutoChunkSize(unittest.TestCase):
+
+    def setUp(self):
+        self.fileobj = tempfile.TemporaryFile()
+        self.blksize = getattr(os.fstat(self.fileobj.fileno()), "st_blksize", 0) or 4096
+
+    def tearDown(self):
+        self.fileobj.close()
+
+    def test_regular_file(self):
+        auto_chunk_size = zmwangx.hash.auto_chunk_size
+        blksize = self.blksize
+        cap = max(blksize, zmwangx.hash.AUTO_CHUNK_SIZE_MAX // blksize * blksize)
+        # empty and small files: a single block
+        self.assertEqual(auto_chunk_size(self.fileobj), blksize)
+        self.fileobj.write(b"x")
+        self.fileobj.flush()
+        self.assertEqual(auto_chunk_size(self.fileobj), blksize)
+        # rounded up to a multiple of the block size
+        self.fileobj.write(b"x" * blksize)
+        self.fileobj.flush()
+        self.assertEqual(auto_chunk_size(self.fileobj), min(2 * blksize, cap))
+        # total_size overrides the size of the file
+        self.assertEqual(auto_chunk_size(self.fileobj, total_size=0), blksize)
+        self.assertEqual(auto_chunk_size(self.fileobj, total_size=10 ** 12), cap)
+        self.assertEqual(auto_chunk_size(self.fileobj, total_size=3 * blksize - 1),
+                         min(3 * blksize, cap))
+
+    def test_large_block_size(self):
+        filestat = os.fstat(self.fileobj.fileno())
+        fields = {name: getattr(filestat, name) for name in dir(filestat)
+                  if name.startswith("st_")}
+        fields["st_blksize"] = 4 * zmwangx.hash.AUTO_CHUNK_SIZE_MAX
+        fakestat = unittest.mock.Mock(**fields)
+        with unittest.mock.patch("os.fstat", return_value=fakestat):
+            self.assertEqual(zmwangx.hash.auto_chunk_size(self.fileobj, 10 ** 12),
+                             4 * zmwangx.hash.AUTO_CHUNK_SIZE_MAX)
+
+    def test_pipe(self):
+        read_fd, write_fd = os.pipe()
+        with open(read_fd, "rb") as reader, open(write_fd, "wb") as writer:
+            for total_size in (None, 0, 10 ** 12):
+                self.assertEqual(zmwangx.hash.auto_chunk_size(reader, total_size),
+                                 zmwangx.hash.DEFAULT_CHUNK_SIZE)
+            writer.write(b"x")
+
+    def test_no_file_descriptor(self):
+        for fileobj in (io.BytesIO(b"x" * 10 ** 6), ShortReader(b"", 1)):
+            for total_size in (None, 10 ** 12):
+                self.assertEqual(zmwangx.hash.auto_chunk_size(fileobj, total_size),
+                                 zmwangx.hash.DEFAULT_CHUNK_SIZE)
+
+
+class TestFileHash(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # deliberately not a multiple of the chunk size or the window size
+        self.content = os.urandom(3 * zmwangx.hash.MMAP_WINDOW_SIZE + 12345)
+        self.path = os.path.join(self.tmpdir, "random.bin")
+        with open(self.path, "wb") as fileobj:
+            fileobj.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_mmap_matches_streaming(self):
+        expected = hashlib.sha256(self.content).hexdigest()
+        self.assertEqual(file_hash(self.path, "sha256", use_mmap=True), expected)
+        self.assertEqual(file_hash(self.path, "sha256", use_mmap=False), expected)
+        with open(self.path, "rb") as fileobj:
+            self.assertEqual(file_hash(fileobj, "sha256"), expected)
+
+    def test_multiple_algorithms(self):
+        algorithms = ["md5", "sha1", "sha256"]
+        expected = {alg: hashlib.new(alg, self.content).hexdigest()
+                    for alg in algorithms}
+        for use_mmap in (True, False):
+            self.assertEqual(file_hash(self.path, algorithms, use_mmap=use_mmap),
+                             expected)
+
+    def test_ranges(self):
+        size = len(self.content)
+        for offset, length in [(0, 1), (12345, zmwangx.hash.MMAP_WINDOW_SIZE),
+                               (size - 10, 100), (size, None), (1, None)]:
+            end = size if length is None else offset + length
+            expected = hashlib.md5(self.content[offset:end]).hexdigest()
+            for use_mmap in (True, False):
+                self.assertEqual(file_hash(self.path, "md5", use_mmap=use_mmap,
+                                           offset=offset, length=length),
+                                 expected)
+
+    def test_piecewise_resume(self):
+        piece_size = zmwangx.hash.MMAP_WINDOW_SIZE
+        expected = [hashlib.sha1(self.content[i:i + piece_size]).hexdigest()
+                    for i in range(0, len(self.content), piece_size)]
+        self.assertEqual(piecewise_hash(self.path, piece_size), expected)
+
+        # pretend an earlier run was interrupted after two pieces; plant
+        # a bogus digest to verify that the first pieces are not reread
+        checkpoint = os.path.join(self.tmpdir, "checkpoint.json")
+        zmwangx.hash._save_checkpoint(checkpoint, {
+            "identity": {
+                "path": os.path.abspath(self.path),
+                "ino": os.stat(self.path).st_ino,
+                "size": len(self.content),
+                "mtime_ns": os.stat(self.path).st_mtime_ns,
+                "algorithm": "sha1",
+                "piece_size": piece_size,
+            },
+            "digests": ["bogus"] + expected[1:2],
+        })
+        self.assertEqual(piecewise_hash(self.path, piece_size, checkpoint=checkpoint),
+                         ["bogus"] + expected[1:])
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_piecewise_resume_whole(self):
+        piece_size = zmwangx.hash.MMAP_WINDOW_SIZE
+        expected = [hashlib.sha1(self.content[i:i + piece_size]).hexdigest()
+                    for i in range(0, len(self.content), piece_size)]
+        checkpoint = os.path.join(self.tmpdir, "checkpoint.json")
+
+        # interrupt a run after two pieces
+        real_save_checkpoint = zmwangx.hash._save_checkpoint
+
+        def save_checkpoint(checkpoint, state):
+            real_save_checkpoint(checkpoint, state)
+            if len(state["digests"]) == 2:
+                raise KeyboardInterrupt
+
+        with unittest.mock.patch("zmwangx.hash._save_checkpoint", save_checkpoint):
+            with self.assertRaises(KeyboardInterrupt):
+                piecewise_hash(self.path, piece_size, checkpoint=checkpoint, whole=True)
+        self.assertTrue(os.path.exists(checkpoint))
+
+        with unittest.mock.patch("zmwangx.hash.hashlib.new",
+                                 wraps=hashlib.new) as mock_new:
+            hexdigests, hexdigest = piecewise_hash(
+                self.path, piece_size, checkpoint=checkpoint, whole=True)
+        self.assertEqual(hexdigests, expected)
+        self.assertEqual(hexdigest, file_hash(self.path))
+        # the whole-file hasher, plus the pieces not covered by the checkpoint
+        self.assertEqual(mock_new.call_count, 2 + len(expected) - 2)
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_copy_hash(self):
+        expected = hashlib.sha256(self.content).hexdigest()
+        dst_paths = [os.path.join(self.tmpdir, "copy%d" % i) for i in range(2)]
+        for use_kernel in (True, False):
+            memory_dst = io.BytesIO()
+            with open(self.path, "rb") as src, \
+                 open(dst_paths[0], "wb") as dst0, open(dst_paths[1], "wb") as dst1:
+                dst0.write(b"prefix")
+                self.assertEqual(copy_hash(src, [dst0, dst1, memory_dst], "sha256",
+                                           use_kernel=use_kernel),
+                                 expected)
+                dst0.write(b"suffix")
+            with open(dst_paths[0], "rb") as fileobj:
+                self.assertEqual(fileobj.read(), b"prefix" + self.content + b"suffix")
+            with open(dst_paths[1], "rb") as fileobj:
+                self.assertEqual(fileobj.read(), self.content)
+            self.assertEqual(memory_dst.getvalue(), self.content)
+
+    def test_copy_hash_kernel_fallback(self):
+        def refuse(*args):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+        dst_path = os.path.join(self.tmpdir, "copy")
+        with unittest.mock.patch("os.copy_file_range", refuse, create=True), \
+             unittest.mock.patch("os.sendfile", refuse, create=True):
+            with open(self.path, "rb") as src, open(dst_path, "wb") as dst:
+                copy_hash(src, dst)
+        with open(dst_path, "rb") as fileobj:
+            self.assertEqual(fileobj.read(), self.content)
+
+    def test_special_file_falls_back_to_streaming(self):
+        self.assertEqual(file_hash(os.devnull, use_mmap=True),
+                         hashlib.sha1().hexdigest())
+
+    def test_hash_many(self):
+        paths = []
+        for i in range(20):
+            path = os.path.join(self.tmpdir, "%d.txt" % i)
+            with open(path, "wb") as fileobj:
+                fileobj.write(str(i).encode("utf-8"))
+            paths.append(path)
+        paths.append(os.path.join(self.tmpdir, "missing.txt"))
+
+        for backend in ("thread", "process"):
+            results = list(hash_many(paths, "md5", workers=3, ordered=False,
+                                     backend=backend, batch_size=4))
+            self.assertEqual(sorted(result.file for result in results),
+                             sorted(paths))
+            self.check_results(results)
+        results = list(hash_many(paths, "md5", workers=3, backend="process",
+                                 batch_size=4))
+        self.assertEqual([result.file for result in results], paths)
+        self.check_results(results)
+
+    def test_hash_many_mmap_opt_in(self):
+        expected = hashlib.sha1(self.content).hexdigest()
+        with unittest.mock.patch("zmwangx.hash.MMAP_THRESHOLD", 0), \
+             unittest.mock.patch("mmap.mmap", wraps=mmap.mmap) as mock_mmap:
+            self.assertEqual([result.hexdigest for result in hash_many([self.path])],
+                             [expected])
+            self.assertEqual(mock_mmap.call_count, 0)
+            self.assertEqual([result.hexdigest
+                              for result in hash_many([self.path], use_mmap=None)],
+                             [expected])
+            self.assertEqual(mock_mmap.call_count, 1)
+
+    def check_results(self, results):
+        for result in results:
+            if result.file.endswith("missing.txt"):
+                self.assertIsNone(result.hexdigest)
+                self.assertIsInstance(result.error, FileNotFoundError)
+            else:
+                i = os.path.basename(result.file).split(".")[0]
+                self.assertEqual(result.hexdigest,
+                                 hashlib.md5(i.encode("utf-8")).hexdigest())
+                self.assertIsNone(result.error)
+
+
+class TestFastFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "file")
+        with open(self.path, "wb") as fileobj:
+            fileobj.write(b"0" * 100000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def fingerprint(self, samples, sample_size=1000):
+        with unittest.mock.patch("zmwangx.hash._pread",
+                                 wraps=zmwangx.hash._pread) as pread:
+            fingerprint = fast_fingerprint(self.path, samples=samples,
+                                           sample_size=sample_size)
+        return fingerprint, [call[0][1:] for call in pread.call_args_list]
+
+    def test_samples(self):
+        # (length, offset) of reads
+        self.assertEqual(self.fingerprint(1)[1], [(1000, 0)])
+        self.assertEqual(self.fingerprint(3)[1], [(1000, 0), (1000, 49500), (1000, 99000)])
+        self.assertEqual(self.fingerprint(100)[1], [(100000, 0)])
+        self.assertEqual(self.fingerprint(1, 100000)[1], [(100000, 0)])
+        for samples, sample_size in [(0, 1000), (-1, 1000), (1, 0)]:
+            with self.assertRaises(ValueError):
+                fast_fingerprint(self.path, samples=samples, sample_size=sample_size)
+
+    def test_single_sample_is_the_head(self):
+        before = self.fingerprint(1)[0]
+        with open(self.path, "r+b") as fileobj:
+            fileobj.seek(1000)
+            fileobj.write(b"1")
+        self.assertEqual(self.fingerprint(1)[0], before)
+        with open(self.path, "r+b") as fileobj:
+            fileobj.write(b"1")
+        self.assertNotEqual(self.fingerprint(1)[0], before)
+
+    def test_executor(self):
+        expected = fast_fingerprint(self.path, samples=3, sample_size=1000)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            self.assertEqual(fast_fingerprint(self.path, samples=3, sample_size=1000,
+                                              executor=executor),
+                             expected)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(TypeError):
+                fast_fingerprint(self.path, executor=executor)
+
+
+class TestHashCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "hello.txt")
+        with open(self.path, "wb") as fileobj:
+            fileobj.write(b"hello, world!\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_default_location(self):
+        with change_home() as home:
+            with HashCache() as cache:
+                self.assertEqual(
+                    cache.path,
+                    os.path.join(home, ".cache", "zmwangx", "hashcache.sqlite"))
+            self.assertTrue(os.path.exists(cache.path))
+
+    def test_hit_skips_reading(self):
+        with HashCache(os.path.join(self.tmpdir, "cache.sqlite")) as cache:
+            # plant a bogus digest; a hit must return it without reading
+            cache.put(os.stat(self.path), "sha1", "bogus")
+            self.assertEqual(file_hash(self.path, cache=cache), "bogus")
+            self.assertEqual(file_hash(self.path, ["sha1", "md5"], cache=cache),
+                             {"sha1": "bogus",
+                              "md5": "910c8bc73110b0cd1bc5d2bcae782511"})
+            self.assertEqual(len(cache), 2)
+
+    def test_modification_invalidates(self):
+        with HashCache(os.path.join(self.tmpdir, "cache.sqlite")) as cache:
+            file_hash(self.path, cache=cache)
+            with open(self.path, "ab") as fileobj:
+                fileobj.write(b"more")
+            self.assertIsNone(cache.get(os.stat(self.path), "sha1"))
+            self.assertEqual(file_hash(self.path, cache=cache),
+                             hashlib.sha1(b"hello, world!\nmore").hexdigest())
+            cache.invalidate(self.path)
+            self.assertEqual(len(cache), 0)
+
+    def test_eviction(self):
+        with HashCache(os.path.join(self.tmpdir, "cache.sqlite"),
+                       max_entries=2) as cache:
+            filestat = os.stat(self.path)
+            for algorithm in ("md5", "sha1", "sha256"):
+                cache.put(filestat, algorithm, algorithm)
+            self.assertIsNotNone(cache.get(filestat, "md5"))  # refresh md5
+            cache.evict()
+            self.assertEqual(len(cache), 2)
+            self.assertIsNone(cache.get(filestat, "sha1"))
+
+
+class TestTreeHash(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for relpath in ["a.txt", "b/c.txt", "b/d/e.txt", "f/g.txt"]:
+            path = os.path.join(self.root, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as fileobj:
+                fileobj.write(relpath.encode("utf-8"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_manifest(self):
+        tree = tree_hash(self.root)
+        self.assertEqual(list(tree.files), ["a.txt", "b/c.txt", "b/d/e.txt", "f/g.txt"])
+        for relpath, digest in tree.files.items():
+            self.assertEqual(digest, hashlib.sha256(relpath.encode("utf-8")).hexdigest())
+        self.assertEqual(tree.manifest().splitlines()[0],
+                         "%s  a.txt" % tree.files["a.txt"])
+        self.assertEqual(set(tree.dirs), {"", "b", "b/d", "f"})
+
+    def test_incremental(self):
+        tree = tree_hash(self.root)
+        with open(os.path.join(self.root, "b", "d", "e.txt"), "ab") as fileobj:
+            fileobj.write(b"changed")
+
+        with unittest.mock.patch("zmwangx.hash.hash_many",
+                                 wraps=zmwangx.hash.hash_many) as mock_hash_many:
+            newtree = tree_hash(self.root, previous=tree)
+            rehashed = list(mock_hash_many.call_args[0][0])
+        self.assertEqual(rehashed, [os.path.join(self.root, "b", "d", "e.txt")])
+        self.assertEqual(newtree.dirs["f"], tree.dirs["f"])
+        for reldir in ("", "b", "b/d"):
+            self.assertNotEqual(newtree.dirs[reldir], tree.dirs[reldir])
+        self.assertEqual(newtree.digest, tree_hash(self.root).digest)
+
+    def test_symlinks(self):
+        os.symlink("b", os.path.join(self.root, "link"))
+        os.symlink(".", os.path.join(self.root, "b", "loop"))
+        skipped = tree_hash(self.root, symlinks="skip")
+        followed = tree_hash(self.root, symlinks="follow")
+        linked = tree_hash(self.root, symlinks="link")
+        self.assertEqual(skipped.digest, tree_hash(self.root).digest)
+        self.assertIn("link/d/e.txt", followed.files)
+        self.assertNotIn("b/loop/c.txt", followed.files)
+        self.assertEqual(list(linked.files), list(skipped.files))
+        self.assertEqual(len({skipped.digest, followed.digest, linked.digest}), 3)
+
+    def test_unreadable_file(self):
+        unreadable = os.path.join(self.root, "b", "c.txt")
+        real_hash_many = zmwangx.hash.hash_many
+
+        def hash_many(files, *args, **kwargs):
+            for result in real_hash_many(files, *args, **kwargs):
+                if result.file == unreadable:
+                    result = result._replace(
+                        hexdigest=None,
+                        error=PermissionError(13, "Permission denied", result.file))
+                yield result
+
+        complete = tree_hash(self.root)
+        with unittest.mock.patch("zmwangx.hash.hash_many", hash_many):
+            tree = tree_hash(self.root)
+        self.assertEqual(list(tree.files), ["a.txt", "b/d/e.txt", "f/g.txt"])
+        self.assertEqual(list(tree.errors), ["b/c.txt"])
+        self.assertIsInstance(tree.errors["b/c.txt"], PermissionError)
+        self.assertNotIn("c.txt", tree.manifest())
+        self.assertEqual(tree.dirs["f"], complete.dirs["f"])
+        self.assertNotEqual(tree.digest, complete.digest)
+        os.remove(unreadable)
+        self.assertNotEqual(tree.digest, tree_hash(self.root).digest)
+
+    def test_signature(self):
+        tree = tree_hash(self.root)
+        filestat = os.stat(os.path.join(self.root, "b", "c.txt"))
+        self.assertEqual(tree.signature("b/c.txt"),
+                         (filestat.st_dev, filestat.st_ino, filestat.st_size,
+                          filestat.st_mtime_ns))
+        self.assertIsNone(tree.signature("b"))
+        self.assertIsNone(tree.signature("missing"))
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.contents = {"plain": b"foo", "back\\slash": b"bar", "new\nline": b"baz"}
+        self.paths = {}
+        for name, content in self.contents.items():
+            self.paths[name] = os.path.join(self.tmpdir, name)
+            with open(self.paths[name], "wb") as fileobj:
+                fileobj.write(content)
+        self.missing = os.path.join(self.tmpdir, "missing")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_main(self, *args):
+        with unittest.mock.patch.object(sys, "argv", ["filehash"] + list(args)):
+            with capture_stdout(), capture_stderr():
+                returncode = zmwangx.hash.main()
+                stdout, stderr = sys.stdout.getvalue(), sys.stderr.getvalue()
+        return returncode, stdout, stderr
+
+    def write_manifest(self, content):
+        manifest = os.path.join(self.tmpdir, "manifest")
+        with open(manifest, "w", encoding="utf-8") as fileobj:
+            fileobj.write(content)
+        return manifest
+
+    def test_print(self):
+        plain = self.paths["plain"]
+        sha256 = hashlib.sha256(b"foo").hexdigest()
+        self.assertEqual(self.run_main(plain), (0, "%s  %s\n" % (sha256, plain), ""))
+        self.assertEqual(self.run_main("--tag", plain),
+                         (0, "SHA256 (%s) = %s\n" % (plain, sha256), ""))
+        self.assertEqual(self.run_main("-a", "md5", "-a", "sha1", plain)[1],
+                         "MD5 (%s) = %s\nSHA1 (%s) = %s\n" %
+                         (plain, hashlib.md5(b"foo").hexdigest(),
+                          plain, hashlib.sha1(b"foo").hexdigest()))
+        # backslashes and newlines are escaped, and the line is marked
+        _, stdout, _ = self.run_main(self.paths["back\\slash"], self.paths["new\nline"])
+        self.assertEqual(stdout.splitlines(), [
+            "\\%s  %s" % (hashlib.sha256(b"bar").hexdigest(),
+                          os.path.join(self.tmpdir, "back\\\\slash")),
+            "\\%s  %s" % (hashlib.sha256(b"baz").hexdigest(),
+                          os.path.join(self.tmpdir, "new\\nline")),
+        ])
+
+        returncode, stdout, stderr = self.run_main(self.missing, plain)
+        self.assertEqual(returncode, 1)
+        self.assertEqual(stdout, "%s  %s\n" % (sha256, plain))
+        self.assertIn("%s: No such file or directory" % self.missing, stderr)
+        self.assertEqual(self.run_main("-a", "nonexistent", plain)[0], 1)
+
+    def test_check_round_trip(self):
+        paths = sorted(self.paths.values())
+        for args in ([], ["--tag"], ["-a", "md5"], ["-a", "sha1", "-a", "sha512"]):
+            _, stdout, _ = self.run_main(*(args + paths))
+            manifest = self.write_manifest(stdout)
+            # the algorithm of untagged lines is inferred from the digest length
+            returncode, stdout, stderr = self.run_main("-c", manifest)
+            self.assertEqual((returncode, stderr), (0, ""))
+            self.assertEqual(len(stdout.splitlines()), len(stdout.splitlines(True)))
+            self.assertEqual(stdout.count(": OK\n"), len(paths) * max(len(args) // 2, 1))
+            self.assertEqual(self.run_main("-c", "-q", manifest)[:2], (0, ""))
+
+        # BSD style in a lowercase algorithm, and GNU style in binary mode
+        plain = self.paths["plain"]
+        manifest = self.write_manifest("md5 (%s) = %s\n%s *%s\n" % (
+            plain, hashlib.md5(b"foo").hexdigest(),
+            hashlib.md5(b"foo").hexdigest(), plain))
+        self.assertEqual(self.run_main("-c", manifest)[0], 0)
+        # an explicit algorithm for untagged lines
+        manifest = self.write_manifest("%s  %s\n" % (
+            hashlib.new("sha3_256", b"foo").hexdigest(), plain))
+        self.assertEqual(self.run_main("-c", manifest)[0], 1)
+        self.assertEqual(self.run_main("-c", "-a", "sha3_256", manifest)[0], 0)
+
+    def test_check_failures(self):
+        plain = self.paths["plain"]
+        md5 = hashlib.md5(b"foo").hexdigest()
+        ok = "%s  %s\n" % (md5, plain)
+        for line, stdout, warning in [
+                ("garbage\n", "", "1 line is improperly formatted"),
+                ("%s  %s\n" % (md5[:-1], plain), "", "1 line is improperly formatted"),
+                # an unsupported algorithm does not prevent checking other lines
+                ("NOSUCHALG (%s) = %s\n" % (plain, md5), "", "1 line is improperly formatted"),
+                ("%s  %s\n" % (md5.replace(md5[0], "0"), plain), "%s: FAILED\n" % plain,
+                 "1 computed checksum did NOT match"),
+                ("%s  %s\n" % (md5, self.missing),
+                 "%s: FAILED open or read\n" % self.missing,
+                 "1 listed file could not be read"),
+        ]:
+            manifest = self.write_manifest(ok + line + ok)
+            returncode, out, err = self.run_main("-c", "-q", manifest)
+            self.assertEqual((returncode, out), (1, stdout))
+            self.assertIn(warning, err)
+
+        returncode, _, stderr = self.run_main("-c", self.missing)
+        self.assertEqual(returncode, 1)
+        self.assertIn("%s: No such file or directory" % self.missing, stderr)
+        returncode, _, stderr = self.run_main("-c", self.write_manifest(""))
+        self.assertEqual(returncode, 1)
+        self.assertIn("no properly formatted checksum lines found", stderr)
+
+    def test_parse_checksum_line(self):
+        parse = zmwangx.hash._parse_checksum_line
+        digest = "0" * 40
+        self.assertEqual(parse("SHA1 (a (b)) = %s" % digest), ("sha1", "a (b)", digest))
+        self.assertEqual(parse("%s  a b" % digest.upper()), ("sha1", "a b", digest))
+        self.assertEqual(parse("%s *a" % digest, "md5"), ("md5", "a", digest))
+        self.assertEqual(parse("\\%s  a\\\\b\\nc" % digest), ("sha1", "a\\b\nc", digest))
+        for line in ("%s a" % digest, "0" * 41 + "  a", "SHA1 (a) = xyz", "",
+                     "NOSUCHALG (a) = %s" % digest, "SHA256 (a) = %s" % digest):
+            self.assertIsNone(parse(line))
+
+
+if __name__ == '__main__':
+    unittest.main()
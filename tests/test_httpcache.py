@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from zmwangx.httpcache import HTTPCache
+from zmwangx.infrastructure import change_home, serve_pages
+from zmwangx.urlgrep import urlgrep
+
+
+class TestHTTPCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.pages = {"/": b'<a href="/old">old</a>', "/other": b"other"}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_default_location(self):
+        with change_home() as home:
+            with HTTPCache() as cache:
+                self.assertEqual(cache.path,
+                                 os.path.join(home, ".cache", "zmwangx", "httpcache"))
+
+    def test_conditional_requests(self):
+        with serve_pages(self.pages) as (base_url, requests_log), \
+             HTTPCache(self.tmpdir) as cache:
+            self.assertEqual(urlgrep(url=base_url + "/", cache=cache),
+                             [base_url + "/old"])
+            self.assertNotIn("If-None-Match", requests_log[-1][1])
+
+            response = cache.fetch(base_url + "/")
+            self.assertTrue(response.from_cache)
+            self.assertIn("If-None-Match", requests_log[-1][1])
+
+            self.pages["/"] = b'<a href="/new">new</a>'
+            self.assertEqual(urlgrep(url=base_url + "/", cache=cache),
+                             [base_url + "/new"])
+            self.assertEqual(len(requests_log), 3)
+
+            # a 404 is not stored
+            cache.fetch(base_url + "/missing")
+            self.assertEqual(len(cache), 1)
+
+    def test_ttl(self):
+        with serve_pages(self.pages) as (base_url, requests_log), \
+             HTTPCache(self.tmpdir, ttl=3600) as cache:
+            cache.fetch(base_url + "/")
+            self.pages["/"] = b"changed"
+            response = cache.fetch(base_url + "/")
+            self.assertEqual(response.content, b'<a href="/old">old</a>')
+            self.assertEqual(len(requests_log), 1)
+
+    def test_eviction(self):
+        with serve_pages(self.pages) as (base_url, _), \
+             HTTPCache(self.tmpdir, max_size=25) as cache:
+            cache.fetch(base_url + "/")
+            cache.fetch(base_url + "/other")
+            self.assertEqual(len(cache), 1)
+            self.assertTrue(cache.fetch(base_url + "/other").from_cache)
+            self.assertEqual(len(os.listdir(os.path.join(self.tmpdir, "bodies"))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import concurrent.futures
+import tempfile
+import unittest
+import unittest.mock
+
+from zmwangx.bloom import BloomFilter
+from zmwangx.infrastructure import serve_pages
+from zmwangx.urlcrawl import crawl
+
+PAGES = {
+    "/": b'<a href="/a">a</a><a href="/b#top">b</a><a href="http://elsewhere.invalid/">x</a>',
+    "/a": b'<a href="/">home</a><a href="/c">c</a><img src="/img.png">',
+    "/b": b'<a href="/a">a</a><a href="/missing">missing</a>',
+    "/c": b'<a href="/d">d</a>',
+    "/d": b'',
+    "/img.png": ("image/png", b"\x89PNG"),
+}
+
+
+class TestCrawl(unittest.TestCase):
+
+    def test_depth_and_scope(self):
+        with serve_pages(PAGES) as (base_url, requests_log):
+            results = list(crawl([base_url + "/"], max_depth=2))
+            crawled = {result.url[len(base_url):]: result for result in results}
+            self.assertEqual(set(crawled), {"/", "/a", "/b", "/c", "/img.png", "/missing"})
+            self.assertEqual(crawled["/c"].depth, 2)
+            self.assertIsNotNone(crawled["/missing"].error)
+            self.assertEqual(crawled["/img.png"].matching_urls, [])
+            self.assertIn("http://elsewhere.invalid/", crawled["/"].matching_urls)
+            # each page is requested once
+            self.assertEqual(len(requests_log), len(crawled))
+
+            results = list(crawl([base_url + "/"], follow=r"/[ab]$", max_depth=5))
+            self.assertEqual(sorted(result.url[len(base_url):] for result in results),
+                             ["/", "/a", "/b"])
+
+    def test_bad_page(self):
+        pages = {
+            "/": b'<a href="/a">a</a><a href="/b">b</a>',
+            "/a": b'<a href="http://[bad/">bad</a>',
+            "/b": b'<a href="/c">c</a>',
+            "/c": b'',
+        }
+        with serve_pages(pages) as (base_url, _):
+            results = {result.url[len(base_url):]: result
+                       for result in crawl([base_url + "/"], max_depth=2, jobs=1)}
+            self.assertEqual(set(results), {"/", "/a", "/b", "/c"})
+            self.assertIsInstance(results["/a"].error, ValueError)
+            self.assertIsNone(results["/a"].matching_urls)
+            self.assertIsNone(results["/c"].error)
+
+    def test_no_busy_wait(self):
+        # all slots busy, while the queued host is under its limit
+        with serve_pages(PAGES, delay=0.2) as (base_url, _), \
+             unittest.mock.patch("concurrent.futures.wait",
+                                 wraps=concurrent.futures.wait) as wait:
+            results = list(crawl([base_url + "/"], max_depth=1, jobs=1, per_host=2))
+            self.assertEqual(len(results), 3)
+            self.assertLessEqual(wait.call_count, len(results))
+
+    def test_resume(self):
+        tmpdir = tempfile.mkdtemp()
+        state = os.path.join(tmpdir, "crawl.json")
+        try:
+            with serve_pages(PAGES) as (base_url, requests_log):
+                for bloom_capacity in (None, 1000):
+                    del requests_log[:]
+                    results = crawl([base_url + "/"], max_depth=3, jobs=1,
+                                    state=state, bloom_capacity=bloom_capacity)
+                    first = next(results)
+                    results.close()  # interrupt
+                    self.assertTrue(os.path.exists(state))
+                    self.assertEqual(os.path.exists(state + ".bloom"),
+                                     bloom_capacity is not None)
+                    self.assertEqual(os.path.exists(state + ".seen"),
+                                     bloom_capacity is None)
+                    if bloom_capacity is not None:
+                        bloom = BloomFilter.load(state + ".bloom")
+                        self.assertIn(base_url + "/", bloom)
+
+                    rest = list(crawl([], max_depth=3, jobs=1, state=state,
+                                      bloom_capacity=bloom_capacity))
+                    self.assertEqual(first.url, base_url + "/")
+                    self.assertEqual(len(rest), 6)
+                    self.assertNotIn(base_url + "/", [result.url for result in rest])
+                    self.assertFalse(os.path.exists(state))
+                    self.assertFalse(os.path.exists(state + ".bloom"))
+                    self.assertFalse(os.path.exists(state + ".seen"))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_incremental_checkpoints(self):
+        tmpdir = tempfile.mkdtemp()
+        state = os.path.join(tmpdir, "crawl.json")
+        try:
+            with serve_pages(PAGES) as (base_url, _):
+                results = crawl([base_url + "/"], max_depth=3, jobs=1, state=state,
+                                checkpoint_interval=1)
+                crawled = [next(results).url for _ in range(3)]
+                with open(state + ".seen", encoding="utf-8") as fileobj:
+                    seen = [json.loads(line) for line in fileobj]
+                # each URL is only written once, and the state file has none
+                self.assertEqual(len(seen), len(set(seen)))
+                self.assertTrue(set(crawled) <= set(seen))
+                with open(state, encoding="utf-8") as fileobj:
+                    self.assertNotIn("seen", json.load(fileobj))
+                results.close()
+
+                # an incomplete last line is ignored
+                with open(state + ".seen", "a", encoding="utf-8") as fileobj:
+                    fileobj.write('"%s/trunc' % base_url)
+                rest = [result.url for result in crawl([], max_depth=3, jobs=1, state=state)]
+                self.assertEqual(sorted(crawled + rest),
+                                 sorted(base_url + path for path in
+                                        ["/", "/a", "/b", "/c", "/d", "/img.png",
+                                         "/missing"]))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_resume_requires_bloom(self):
+        tmpdir = tempfile.mkdtemp()
+        state = os.path.join(tmpdir, "crawl.json")
+        try:
+            with serve_pages(PAGES) as (base_url, _):
+                results = crawl([base_url + "/"], max_depth=3, jobs=1, state=state,
+                                bloom_capacity=1000)
+                next(results)
+                results.close()
+                with self.assertRaisesRegex(ValueError, "Bloom filter"):
+                    crawl([], max_depth=3, state=state)
+                os.remove(state + ".bloom")
+                with self.assertRaisesRegex(ValueError, "Bloom filter"):
+                    crawl([], max_depth=3, state=state, bloom_capacity=1000)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_preserve_duplicates(self):
+        pages = {"/": b'<a href="/a">a</a><a href="/a">a</a>', "/a": b''}
+        with serve_pages(pages) as (base_url, requests_log):
+            for deduplicate, expected in [(True, ["/a"]), (False, ["/a", "/a"])]:
+                del requests_log[:]
+                results = list(crawl([base_url + "/"], deduplicate=deduplicate))
+                self.assertEqual(results[0].matching_urls,
+                                 [base_url + path for path in expected])
+                self.assertEqual(len(results), 2)
+                self.assertEqual(len(requests_log), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+import urllib.parse
+
+import zmwangx.urlgrep
+from zmwangx.infrastructure import capture_stderr, capture_stdout, serve_pages
+from zmwangx.urlgrep import (DocumentIndex, DocumentIndexCache, Extractor,
+                             ExtractorSet, PatternSet, URLResolver, iter_urlgrep,
+                             make_session, urlgrep)
+
+DOCUMENTS = [
+    # plain document with a relative <base>
+    b"""<!DOCTYPE html>
+<html manifest="cache.appcache">
+<head profile="http://example.org/profile">
+<meta charset="utf-8">
+<base href="http://example.com/dir/">
+<link rel="stylesheet" href="style.css">
+<script src="/js/app.js"></script>
+</head>
+<body background="bg.png">
+<a href="page.html">page</a>
+<a href="../up.html#frag">up</a>
+<a href="javascript:void(0)">js</a>
+<a href="page.html">duplicate</a>
+<img src="a.png" longdesc="a.txt">
+<form action="?q=1"><button formaction="submit"></button></form>
+<p>see <q cite="//other.org/quote">this</q></p>
+</body>
+</html>
+""",
+    # no <base>, no <head>; entities, duplicate and valueless attributes
+    """<a href="x?a=1&amp;b=2">x</a><a href>empty</a>
+<a href="first" href="second">dup</a><A HREF="UPPER">upper</A>
+<iframe src="frame.html"></iframe>
+<video src="v.mp4"><source src="v.webm"></video>
+""",
+    # <base> outside of <head> is ignored; only the first <base> counts
+    """<html><head><title>t</title>
+<base target="_blank"><base href="http://ignored.org/">
+</head><body><base href="http://ignored.net/"><a href="rel">rel</a>
+</body></html>""",
+    # URLs in script and style content are not tags
+    """<head><script>var s = '<a href="no">';</script>
+<style>a { background: url(no.png); }</style></head>
+<body><a href="yes">yes</a></body>""",
+    # non-ASCII, in bytes with a declared encoding
+    '<head><meta charset="latin-1"></head><a href="caf\xe9.html">caf\xe9</a>'
+    .encode("latin-1"),
+    # truncated document
+    """<html><head><base href="https://example.com/a/b/"></head>
+<body><a href="c">c</a><img src="d" """,
+    # misnested <head>: an end tag closes the most recent open tag of
+    # the same name, and everything opened after it
+    "<head><head></head><img src=i.png><base href=http://c.com/y/>",
+    "<a><head></a><base href=http://c.com/y/><img src=i.png>",
+]
+
+
+class TestParsers(unittest.TestCase):
+
+    def test_stream_agrees_with_html_parser(self):
+        for document in DOCUMENTS:
+            for base in (None, "example.org/base/"):
+                for pattern in (None, ""):
+                    for deduplicate in (True, False):
+                        kwargs = dict(content=document, base=base, pattern=pattern,
+                                      deduplicate=deduplicate)
+                        self.assertEqual(urlgrep(parser="stream", **kwargs),
+                                         urlgrep(parser="html.parser", **kwargs))
+
+    def test_auto(self):
+        self.assertEqual(urlgrep(content=DOCUMENTS[0]),
+                         urlgrep(content=DOCUMENTS[0], parser="html.parser"))
+        # with a selector, html.parser whether or not lxml is installed
+        with unittest.mock.patch("zmwangx.urlgrep._make_soup",
+                                 wraps=zmwangx.urlgrep._make_soup) as make_soup:
+            urlgrep(content=DOCUMENTS[0], selector="body")
+            self.assertEqual(make_soup.call_args[0][2], "html.parser")
+        # the selected tags themselves are not searched
+        self.assertEqual(urlgrep(content=DOCUMENTS[0], selector="form"),
+                         ["http://example.com/dir/submit"])
+
+    def test_stream_rejects_selector(self):
+        with self.assertRaises(ValueError):
+            urlgrep(content=DOCUMENTS[0], selector="a", parser="stream")
+
+
+class TestExtractors(unittest.TestCase):
+
+    DOCUMENT = """<html><head>
+<meta http-equiv="Refresh" content="5; URL='next.html'">
+<meta name="description" content="not a url">
+<style>@import "print.css"; body { background: url( 'bg.png' ) }
+.a { background-image: URL(/img/a.png) }</style>
+<base href="http://example.com/dir/"></head>
+<body style="background:url(&quot;body.png&quot;)">
+<img src="a.png" srcset="a-2x.png 2x, a,3x.png 3x,a-4x.png">
+<picture><source srcset="b.webp 100w,c.webp 200w" type="image/webp"></picture>
+<img data-src="lazy.png" data-srcset="lazy-1.png 1x, lazy-2.png 2x">
+<div data-original="orig.jpg" srcset="not-an-image.png"></div>
+</body></html>"""
+
+    def test_all(self):
+        self.assertEqual(
+            urlgrep(content=self.DOCUMENT, pattern=r"^http://example\.com/(?!dir/$)",
+                    extractors="all"),
+            ["http://example.com/" + path for path in (
+                "dir/next.html", "dir/print.css", "dir/bg.png", "img/a.png",
+                "dir/body.png", "dir/a.png", "dir/a-2x.png", "dir/a,3x.png",
+                "dir/a-4x.png", "dir/b.webp", "dir/c.webp", "dir/lazy.png",
+                "dir/lazy-1.png", "dir/lazy-2.png", "dir/orig.jpg")])
+        self.assertEqual(urlgrep(content=self.DOCUMENT, extractors=["srcset"],
+                                 selector="picture"),
+                         ["http://example.com/dir/b.webp", "http://example.com/dir/c.webp"])
+
+    def test_stream_agrees_with_html_parser(self):
+        extractors = ExtractorSet()
+        for document in DOCUMENTS + [self.DOCUMENT]:
+            for chunk_size in (7, 65536):
+                stream = (io.BytesIO(document) if isinstance(document, bytes)
+                          else io.StringIO(document))
+                expected = urlgrep(content=document, parser="html.parser",
+                                   extractors=extractors)
+                self.assertEqual(urlgrep(content=document, extractors=extractors),
+                                 expected)
+                self.assertEqual(list(iter_urlgrep(fileobj=stream, chunk_size=chunk_size,
+                                                   extractors=extractors)),
+                                 expected)
+
+    def test_registry(self):
+        with self.assertRaises(ValueError):
+            ExtractorSet("srcset,missing")
+        extractor = Extractor(text_tags=["script"],
+                              extract_text=lambda tag, text: re.findall(r"'(/[^']*)'", text))
+        with unittest.mock.patch.dict(zmwangx.urlgrep.EXTRACTORS, script=extractor):
+            self.assertEqual(urlgrep(content="<script>load('/a.js')</script>",
+                                     extractors=["script"]),
+                             ["http://localhost/a.js"])
+
+
+class TestIterUrlgrep(unittest.TestCase):
+
+    def test_agrees_with_urlgrep(self):
+        for document in DOCUMENTS:
+            for chunk_size in (1, 7, 65536):
+                stream = (io.BytesIO(document) if isinstance(document, bytes)
+                          else io.StringIO(document))
+                self.assertEqual(list(iter_urlgrep(fileobj=stream, base="example.org",
+                                                   chunk_size=chunk_size)),
+                                 urlgrep(content=document, base="example.org",
+                                         parser="html.parser"))
+
+    def test_lazy(self):
+        reads = []
+
+        class Endless(object):
+            def read(self, size):
+                reads.append(size)
+                return '<body><a href="%d">' % len(reads)
+
+        urls = iter_urlgrep(fileobj=Endless())
+        self.assertEqual([next(urls) for _ in range(3)],
+                         ["http://localhost/1", "http://localhost/2",
+                          "http://localhost/3"])
+        self.assertEqual(len(reads), 3)
+
+
+class TestURLResolver(unittest.TestCase):
+
+    BASES = [
+        "http://example.com/dir/page.html", "http://example.com", "http://example.com/",
+        "https://user:pw@Example.COM:8443/a/b/?q=1#f", "HTTP://example.com/a",
+        "http://example.com/a//b/c", "http://example.com/a/./b/../c", "http://[::1]/x",
+        "http://example.com/a;p?q", "ftp://example.com/pub/", "file:///tmp/x.html",
+        "mailto:someone@example.com", "example.com/dir/", "", "//example.com/a",
+    ]
+
+    URLS = [
+        "", "page.html", "sub/page.html", "sub/", "./page", "../up", "a/../b", ".",
+        "..", "/", "/abs", "/abs/", "/a/./b", "/a/../b", "/a//b", "//", "///x",
+        "//other.org", "//other.org/x?y#z", "?q", "?", "#frag", "#", "a?", "a?#f",
+        "a#", "a?b#c", "a:b", "a/b:c", "http:rel", "http:/abs", "http://", "http:///x",
+        "http://other.org", "http://other.org/x/../y", "HTTP://other.org",
+        "https://other.org/", "mailto:x@y", "javascript:void(0)", "data:,x", "1a:b",
+        "host:80", "a;b", "/a;b", "caf\xe9", " a", "a b", "a\tb", "a\\b", "[x]",
+        "http://[::1]/", "http://[bad/",
+    ]
+
+    def assert_equivalent(self, base, url):
+        try:
+            expected = urllib.parse.urljoin(base, url)
+        except ValueError:
+            with self.assertRaises(ValueError):
+                URLResolver(base).resolve(url)
+        else:
+            self.assertEqual(URLResolver(base).resolve(url), expected,
+                             "base=%r, url=%r" % (base, url))
+
+    def test_corpus(self):
+        for base in self.BASES:
+            for url in self.URLS:
+                self.assert_equivalent(base, url)
+
+    def test_random(self):
+        rng = random.Random(0)
+        alphabet = "ab:/.?#;%[]\\"
+        for _ in range(20000):
+            base = rng.choice(self.BASES[:12])
+            url = "".join(rng.choice(alphabet) for _ in range(rng.randrange(8)))
+            self.assert_equivalent(base, url)
+
+
+class TestDocumentIndex(unittest.TestCase):
+
+    def test_queries_agree_with_urlgrep(self):
+        queries = [(None, None), ("", None), (r"\.html$", None), (None, "body"),
+                   ("example", "form, q")]
+        with unittest.mock.patch("zmwangx.urlgrep._make_soup",
+                                 wraps=zmwangx.urlgrep._make_soup) as make_soup:
+            index = DocumentIndex(DOCUMENTS[0], base="example.org")
+            for pattern, selector in queries:
+                self.assertEqual(index.query(pattern, selector),
+                                 urlgrep(pattern, DOCUMENTS[0], selector=selector,
+                                         base="example.org"))
+            # one tree for the index, plus one for each urlgrep call with a selector
+            self.assertEqual(make_soup.call_count, 3)
+
+    def test_cache(self):
+        cache = DocumentIndexCache(maxsize=2)
+        index = cache.get(DOCUMENTS[0])
+        self.assertIs(cache.get(bytes(DOCUMENTS[0])), index)
+        self.assertIsNot(cache.get(DOCUMENTS[0], base="example.org"), index)
+        cache.get(DOCUMENTS[1])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNot(cache.get(DOCUMENTS[0]), index)
+
+
+class TestPatternSet(unittest.TestCase):
+
+    RULES = [
+        ("css", r"\.css$"),
+        ("dir", r"/dir/"),
+        ("doubled", r"(\w)\1"),  # backreference
+        ("insensitive", r"(?i)UP"),  # global flag
+        ("named", r"(?P<word>quote)"),
+        ("named again", r"(?P<word>page)"),
+    ]
+
+    def test_agrees_with_regexes(self):
+        urls = urlgrep("", DOCUMENTS[0], deduplicate=False) + ["http://localhost/"]
+        for rules in (self.RULES, self.RULES[:4], dict(self.RULES[:2])):
+            patternset = PatternSet(rules)
+            regexes = [(name, re.compile(pattern))
+                       for name, pattern in (rules.items() if isinstance(rules, dict)
+                                             else rules)]
+            for url in urls:
+                expected = [name for name, regex in regexes if regex.search(url)]
+                self.assertEqual(patternset.match(url), expected)
+                self.assertEqual(patternset.search(url), bool(expected))
+            self.assertEqual(urlgrep(patternset, DOCUMENTS[0]),
+                             [url for url in urlgrep("", DOCUMENTS[0])
+                              if patternset.search(url)])
+
+    def test_from_file(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, "w") as fileobj:
+                fileobj.write("# comment\n\ncss\t\\.css$\n/dir/\n")
+            patternset = PatternSet.from_file(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(patternset.names, ["css", "/dir/"])
+        self.assertEqual(patternset.match("http://example.com/dir/style.css"),
+                         ["css", "/dir/"])
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepaths = []
+        for i, document in enumerate(DOCUMENTS * 3):
+            filepath = os.path.join(self.tmpdir, "%d.html" % i)
+            with open(filepath, "wb") as fileobj:
+                fileobj.write(document if isinstance(document, bytes)
+                              else document.encode("utf-8"))
+            self.filepaths.append(filepath)
+        self.filepaths.insert(5, os.path.join(self.tmpdir, "missing.html"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_main(self, *args):
+        with unittest.mock.patch.object(sys, "argv", ["urlgrep"] + list(args)):
+            with capture_stdout(), capture_stderr():
+                returncode = zmwangx.urlgrep.main()
+                stdout, stderr = sys.stdout.getvalue(), sys.stderr.getvalue()
+        return returncode, stdout, stderr
+
+    def test_processes(self):
+        for extra_args in ([], ["-s", "body"]):
+            sequential = self.run_main("-v", *(extra_args + self.filepaths))
+            self.assertEqual(sequential[0], 1)
+            self.assertIn("# from '%s':" % self.filepaths[0], sequential[2])
+            self.assertEqual(self.run_main("-v", "-j", "3", *(extra_args + self.filepaths)),
+                             sequential)
+
+    def test_urls(self):
+        pages = {"/%d" % i: b'<a href="/link-%d">link</a>' % i for i in range(4)}
+        # the first page is the last one to complete
+        with serve_pages(pages, delay={"/0": 0.5}) as (base_url, _):
+            urls = [base_url + path for path in sorted(pages)]
+            url_args = [arg for url in urls for arg in ("-u", url)]
+            expected = "".join("%s/link-%d\n" % (base_url, i) for i in range(4))
+            self.assertEqual(self.run_main(*url_args), (0, expected, ""))
+            self.assertEqual(self.run_main("-j", "4", *url_args), (0, expected, ""))
+            returncode, stdout, _ = self.run_main("-j", "4", "--order", "completion",
+                                                  *url_args)
+            self.assertEqual(returncode, 0)
+            self.assertEqual(sorted(stdout.splitlines()), expected.splitlines())
+            self.assertEqual(stdout.splitlines()[-1], "%s/link-0" % base_url)
+
+            # nothing listens on port 1
+            returncode, stdout, stderr = self.run_main(
+                "-j", "2", "-u", urls[0], "-u", "http://127.0.0.1:1/", "-u", urls[1])
+            self.assertEqual(returncode, 1)
+            self.assertEqual(stdout, "%s/link-0\n%s/link-1\n" % (base_url, base_url))
+            self.assertIn("error: failed to get 'http://127.0.0.1:1/'", stderr)
+
+    def test_cache_closed(self):
+        for error in (KeyboardInterrupt, RuntimeError):
+            with unittest.mock.patch("zmwangx.httpcache.HTTPCache") as cache_class, \
+                 unittest.mock.patch("zmwangx.urlgrep._urlgrep_url", side_effect=error):
+                with self.assertRaises(error):
+                    self.run_main("--cache", "-u", "http://127.0.0.1:1/")
+            cache_class.return_value.close.assert_called_once_with()
+
+    def test_make_session(self):
+        session = make_session(7)
+        for url in ("http://example.com/", "https://example.com/"):
+            adapter = session.get_adapter(url)
+            self.assertEqual(adapter._pool_connections, 7)
+            self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(session.headers["User-Agent"],
+                         zmwangx.urlgrep.REQUEST_HEADERS["User-Agent"])
+
+    def test_global_dedupe(self):
+        _, stdout, _ = self.run_main(*self.filepaths)
+        urls = [url for url in stdout.splitlines() if url]
+        unique_urls = sorted(set(urls))
+        self.assertLess(len(unique_urls), len(urls))
+        for mode in ("exact", "approx"):
+            for jobs in ("1", "3"):
+                returncode, stdout, _ = self.run_main("--global-dedupe", mode, "-j", jobs,
+                                                      *self.filepaths)
+                self.assertEqual(returncode, 1)
+                deduplicated = [url for url in stdout.splitlines() if url]
+                self.assertEqual(sorted(deduplicated), unique_urls)
+
+        # a document yielding only duplicates prints nothing, not even an empty line
+        first = self.run_main(self.filepaths[0])
+        self.assertTrue(first[1])
+        for mode in ("exact", "approx"):
+            self.assertEqual(self.run_main("--global-dedupe", mode, self.filepaths[0],
+                                           self.filepaths[0]),
+                             first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+"""Hash streams and files from asyncio code.
+
+Async byte streams (``asyncio.StreamReader``, aiohttp response bodies,
+async iterators of chunks, etc.) are hashed on the event loop as the
+chunks arrive, see `stream_hash` and `StreamHasher`. Local files are
+hashed with `zmwangx.hash.file_hash` in a shared thread pool, with
+bounded concurrency, see `HashPool`.
+
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import multiprocessing
+import threading
+import weakref
+
+import zmwangx.hash
+from zmwangx.hash import DEFAULT_CHUNK_SIZE
+
+_shared_executor = None
+_shared_executor_lock = threading.Lock()
+
+def shared_executor():
+    """Thread pool shared by all `HashPool` instances without an executor.
+
+    The pool is created on first use, with as many workers as CPUs.
+
+    Returns
+    -------
+    executor : concurrent.futures.ThreadPoolExecutor
+
+    """
+    global _shared_executor  # pylint: disable=global-statement
+    with _shared_executor_lock:
+        if _shared_executor is None:
+            _shared_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=multiprocessing.cpu_count())
+        return _shared_executor
+
+
+class StreamHasher(object):
+
+    """Incremental hasher for one or more algorithms.
+
+    Feed chunks with `update`, or pass an async iterable of chunks
+    through `tee`, which hashes the chunks as they are consumed by
+    someone else -- e.g., an HTTP client uploading them.
+
+    Parameters
+    ----------
+    algorithm : str or list of str, optional
+        See `zmwangx.hash.file_hash`. Default is ``"sha1"``.
+
+    Attributes
+    ----------
+    processed : int
+        Number of bytes hashed so far.
+
+    Examples
+    --------
+    >>> import asyncio
+    >>> class Chunks(object):
+    ...     def __init__(self, chunks):
+    ...         self._chunks = iter(chunks)
+    ...     def __aiter__(self):
+    ...         return self
+    ...     async def __anext__(self):
+    ...         try:
+    ...             return next(self._chunks)
+    ...         except StopIteration:
+    ...             raise StopAsyncIteration
+    >>> async def consume(hasher):
+    ...     chunks = []
+    ...     async for chunk in hasher.tee(Chunks([b"hello, ", b"world!\\n"])):
+    ...         chunks.append(chunk)
+    ...     return b"".join(chunks)
+    >>> hasher = StreamHasher("md5")
+    >>> loop = asyncio.new_event_loop()
+    >>> loop.run_until_complete(consume(hasher))
+    b'hello, world!\\n'
+    >>> loop.close()
+    >>> hasher.hexdigest()
+    '910c8bc73110b0cd1bc5d2bcae782511'
+
+    """
+
+    def __init__(self, algorithm="sha1"):
+        """Init."""
+        self._algorithm = algorithm
+        self._hashers = zmwangx.hash._new_hashers(algorithm)  # pylint: disable=protected-access
+        self.processed = 0
+
+    def update(self, chunk):
+        """Hash a chunk."""
+        for hasher in self._hashers.values():
+            hasher.update(chunk)
+        self.processed += len(chunk)
+
+    def tee(self, aiterable):
+        """Hash chunks of an async iterable while passing them on.
+
+        Parameters
+        ----------
+        aiterable : async iterable of bytes
+
+        Returns
+        -------
+        chunks : async iterator of bytes
+            Same chunks as ``aiterable``.
+
+        """
+        return _TeeIterator(self, aiterable)
+
+    def hexdigest(self):
+        """Digest(s) of what has been hashed so far.
+
+        Returns
+        -------
+        hexdigest : str or dict
+            Same as the return value of `zmwangx.hash.file_hash`.
+
+        """
+        return zmwangx.hash._hexdigests(self._algorithm, self._hashers)  # pylint: disable=protected-access
+
+
+class _TeeIterator(object):
+    """Async iterator returned by `StreamHasher.tee`."""
+
+    # plain async iterator rather than an async generator, which would
+    # require Python 3.6
+
+    def __init__(self, hasher, aiterable):
+        self._hasher = hasher
+        self._aiterator = aiterable.__aiter__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self._aiterator.__anext__()
+        self._hasher.update(chunk)
+        return chunk
+
+async def stream_hash(stream, algorithm="sha1", chunk_size=DEFAULT_CHUNK_SIZE):
+    """Calculate the hash of an async byte stream.
+
+    Parameters
+    ----------
+    stream : stream or async iterable
+        Either an object with a coroutine method ``read(n)`` returning
+        ``b""`` at EOF (e.g., ``asyncio.StreamReader`` or
+        ``aiohttp.StreamReader``), or an async iterable of ``bytes``.
+    algorithm : str or list of str, optional
+        See `zmwangx.hash.file_hash`. Default is ``"sha1"``.
+    chunk_size : int, optional
+        Size of reads from a stream with ``read``. Default is
+        ``DEFAULT_CHUNK_SIZE``.
+
+    Returns
+    -------
+    hexdigest : str or dict
+        Same as the return value of `zmwangx.hash.file_hash`.
+
+    Examples
+    --------
+    >>> import asyncio
+    >>> async def hash_bytes(data):
+    ...     reader = asyncio.StreamReader()
+    ...     reader.feed_data(data)
+    ...     reader.feed_eof()
+    ...     return await stream_hash(reader, ["md5", "sha1"])
+    >>> loop = asyncio.new_event_loop()
+    >>> digests = loop.run_until_complete(hash_bytes(b"hello, world!\\n"))
+    >>> loop.close()
+    >>> digests["md5"], digests["sha1"]
+    ('910c8bc73110b0cd1bc5d2bcae782511', 'e91ba0972b9055187fa2efa8b5c156f487a8293a')
+
+    """
+    hasher = StreamHasher(algorithm)
+    if hasattr(stream, "read"):
+        while True:
+            chunk = await stream.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    else:
+        async for chunk in stream:
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class HashPool(object):
+
+    """Hash local files off the event loop with bounded concurrency.
+
+    At most ``max_concurrency`` files are hashed at any time; further
+    calls wait (without blocking the event loop) until a slot is free,
+    which provides backpressure to producers of paths.
+
+    Parameters
+    ----------
+    max_concurrency : int, optional
+        Default is the number of CPUs.
+    executor : concurrent.futures.Executor, optional
+        Executor to run `zmwangx.hash.file_hash` in. Default is
+        ``None``, in which case `shared_executor` is used.
+
+    Examples
+    --------
+    >>> import asyncio, os, tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     path = os.path.join(tmpdir, "hello.txt")
+    ...     with open(path, "wb") as fileobj:
+    ...         written = fileobj.write(b"hello, world!\\n")
+    ...     loop = asyncio.new_event_loop()
+    ...     loop.run_until_complete(HashPool(2).map([path, path], "md5"))
+    ...     loop.close()
+    ['910c8bc73110b0cd1bc5d2bcae782511', '910c8bc73110b0cd1bc5d2bcae782511']
+
+    """
+
+    def __init__(self, max_concurrency=None, executor=None):
+        """Init."""
+        self.max_concurrency = (multiprocessing.cpu_count()
+                                if max_concurrency is None else max_concurrency)
+        self._executor = executor
+        # one semaphore per event loop, since a semaphore is bound to the
+        # loop it is first used on
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self):
+        """Semaphore of the current event loop."""
+        loop = asyncio.get_event_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def file_hash(self, file, algorithm="sha1", **kwargs):
+        """Calculate the hash of a local file.
+
+        Parameters
+        ----------
+        file : str
+            Path to the file on disk.
+        algorithm : str or list of str, optional
+            Default is ``"sha1"``.
+        **kwargs
+            Other keyword arguments to `zmwangx.hash.file_hash` (e.g.,
+            ``chunk_size``, ``use_mmap``, or ``cache``).
+
+        Returns
+        -------
+        hexdigest : str or dict
+            Same as the return value of `zmwangx.hash.file_hash`.
+
+        """
+        executor = (shared_executor() if self._executor is None
+                    else self._executor)
+        async with self._semaphore():
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                executor, functools.partial(zmwangx.hash.file_hash, file,
+                                            algorithm, **kwargs))
+
+    async def map(self, files, algorithm="sha1", **kwargs):
+        """Calculate the hashes of many local files.
+
+        ``files`` is consumed lazily: at most ``max_concurrency`` files
+        are scheduled at any time. See `file_hash` for parameters. The
+        first error is raised after cancelling the files still pending.
+
+        Parameters
+        ----------
+        files : iterable of str
+
+        Returns
+        -------
+        hexdigests : list
+            Digests in the order of ``files``.
+
+        """
+        hexdigests = []
+        pending = set()
+        try:
+            for index, file in enumerate(files):
+                if len(pending) >= self.max_concurrency:
+                    pending = await _collect(pending, hexdigests)
+                hexdigests.append(None)
+                pending.add(asyncio.ensure_future(
+                    self._indexed_file_hash(index, file, algorithm, kwargs)))
+            while pending:
+                pending = await _collect(pending, hexdigests)
+        finally:
+            for task in pending:
+                task.cancel()
+        return hexdigests
+
+    async def _indexed_file_hash(self, index, file, algorithm, kwargs):
+        return index, await self.file_hash(file, algorithm, **kwargs)
+
+async def _collect(pending, hexdigests):
+    """Wait for at least one of the pending tasks of `HashPool.map`.
+
+    Results are stored in ``hexdigests`` by index, and the tasks still
+    pending are returned.
+
+    """
+    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    for task in done:
+        # exception() also marks errors as retrieved
+        if task.exception() is None:
+            index, hexdigest = task.result()
+            hexdigests[index] = hexdigest
+    for task in done:
+        task.result()
+    return pending
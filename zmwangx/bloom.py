@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""Space-efficient approximate set membership."""
+
+import hashlib
+import math
+import os
+import struct
+
+_MAGIC = b"ZMBF"
+_HEADER = struct.Struct("<4sBQdQIQ")
+_VERSION = 1
+
+
+class BloomFilter(object):
+
+    """Bloom filter of strings or bytes.
+
+    A Bloom filter answers "have I seen this before?" in constant
+    memory: it never forgets an item that was added, but with a small
+    probability (`error_rate`, as long as no more than `capacity` items
+    are added) claims to have seen an item that was never added.
+
+    The size of the bit array and the number of hash functions are
+    chosen to minimize the memory usage for the given capacity and false
+    positive rate: about ``1.44 * log2(1 / error_rate)`` bits per item,
+    i.e., 1.8 bytes per item for an error rate of 0.001.
+
+    Parameters
+    ----------
+    capacity : int
+        Expected number of items.
+    error_rate : float, optional
+        False positive rate at capacity. Default is 0.001.
+
+    Attributes
+    ----------
+    capacity : int
+    error_rate : float
+    num_bits : int
+        Size of the bit array.
+    num_hashes : int
+        Number of bits set for each item.
+
+    Raises
+    ------
+    ValueError
+        If `capacity` is not positive, or if `error_rate` is not
+        strictly between 0 and 1.
+
+    Examples
+    --------
+    >>> bloom = BloomFilter(1000, 0.01)
+    >>> bloom.add("http://example.com/")
+    False
+    >>> bloom.add("http://example.com/")
+    True
+    >>> "http://example.com/" in bloom, "http://example.org/" in bloom
+    (True, False)
+    >>> len(bloom)
+    1
+
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        """Init."""
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("error rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(int(math.ceil(-capacity * math.log(error_rate) /
+                                          math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+
+    def _indexes(self, item):
+        """Bit indexes of an item (double hashing)."""
+        if isinstance(item, str):
+            item = item.encode("utf-8")
+        digest = hashlib.md5(item).digest()
+        hash1 = int.from_bytes(digest[:8], "little")
+        hash2 = int.from_bytes(digest[8:], "little") | 1
+        num_bits = self.num_bits
+        return [(hash1 + i * hash2) % num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        """Add an item.
+
+        Parameters
+        ----------
+        item : str or bytes
+
+        Returns
+        -------
+        present : bool
+            Whether the item was (probably) already present.
+
+        """
+        bits = self._bits
+        present = True
+        for index in self._indexes(item):
+            mask = 1 << (index & 7)
+            if not bits[index >> 3] & mask:
+                present = False
+                bits[index >> 3] |= mask
+        if not present:
+            self._count += 1
+        return present
+
+    def __contains__(self, item):
+        """Whether an item was (probably) added."""
+        bits = self._bits
+        return all(bits[index >> 3] & (1 << (index & 7))
+                   for index in self._indexes(item))
+
+    def __len__(self):
+        """Number of distinct items added (barring false positives)."""
+        return self._count
+
+    def save(self, path):
+        """Atomically save the filter to a file.
+
+        Parameters
+        ----------
+        path : str
+
+        """
+        tmpfile = path + ".tmp"
+        with open(tmpfile, "wb") as fileobj:
+            fileobj.write(_HEADER.pack(_MAGIC, _VERSION, self.capacity,
+                                       self.error_rate, self.num_bits,
+                                       self.num_hashes, self._count))
+            fileobj.write(self._bits)
+        os.replace(tmpfile, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a filter saved with `save`.
+
+        Parameters
+        ----------
+        path : str
+
+        Returns
+        -------
+        bloom : BloomFilter
+
+        Raises
+        ------
+        OSError
+            If the file cannot be read.
+        ValueError
+            If the file is not a saved Bloom filter.
+
+        """
+        with open(path, "rb") as fileobj:
+            header = fileobj.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise ValueError("'%s' is not a saved Bloom filter" % path)
+            (magic, version, capacity, error_rate, num_bits, num_hashes,
+             count) = _HEADER.unpack(header)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("'%s' is not a saved Bloom filter" % path)
+            bits = bytearray(fileobj.read())
+        if len(bits) != (num_bits + 7) // 8:
+            raise ValueError("'%s' is truncated" % path)
+        bloom = cls.__new__(cls)
+        bloom.capacity = capacity
+        bloom.error_rate = error_rate
+        bloom.num_bits = num_bits
+        bloom.num_hashes = num_hashes
+        bloom._bits = bits  # pylint: disable=protected-access
+        bloom._count = count  # pylint: disable=protected-access
+        return bloom
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+"""Find duplicate files.
+
+Duplicates are found in stages, each stage only considering the
+survivors of the previous one:
+
+1. Files are grouped by size. To keep memory bounded on trees with
+   millions of files, the first walk only records sizes in a fixed-size
+   table of hashed size buckets (`SizeTable`), and the second walk only
+   collects paths of files whose size bucket was seen more than once.
+2. Files of the same size are compared by a cheap head/tail fingerprint
+   (see `zmwangx.hash.fast_fingerprint`).
+3. Files with matching fingerprints are compared by full digest (see
+   `zmwangx.hash.hash_many`).
+
+Hard links to the same inode are hashed only once, and are only reported
+alongside at least one distinct duplicate inode.
+
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import stat
+import sys
+
+import zmwangx.hash
+import zmwangx.hashcache
+from zmwangx.colorout import cerror
+
+DEFAULT_TABLE_BITS = 27
+"""Default log2 of the number of buckets of a `SizeTable` (32 MiB total)."""
+
+HEAD_TAIL_SIZE = 4096
+"""Size in bytes of the head and tail samples of the fingerprint stage."""
+
+DuplicateGroup = collections.namedtuple("DuplicateGroup",
+                                        ["size", "hexdigest", "paths"])
+DuplicateGroup.__doc__ = """A group of files with identical content.
+
+Attributes
+----------
+size : int
+    Size of each file, in bytes.
+hexdigest : str
+    The full digest shared by the files.
+paths : list
+    Sorted paths to the files.
+
+"""
+
+
+class SizeTable(object):
+
+    """Fixed-size table recording which file sizes occur more than once.
+
+    Sizes are hashed into ``2 ** bits`` buckets, each with a "seen" and
+    a "seen again" bit, so memory usage is independent of the number of
+    files. `maybe_duplicate` never returns a false negative; a false
+    positive (due to two sizes sharing a bucket) merely makes a unique
+    file a candidate for the later, exact stages.
+
+    Parameters
+    ----------
+    bits : int, optional
+        Default is ``DEFAULT_TABLE_BITS``.
+
+    Examples
+    --------
+    >>> table = SizeTable(bits=10)
+    >>> for size in (1, 2, 2):
+    ...     table.add(size)
+    >>> table.maybe_duplicate(1), table.maybe_duplicate(2)
+    (False, True)
+
+    """
+
+    def __init__(self, bits=DEFAULT_TABLE_BITS):
+        """Init."""
+        self._shift = 64 - bits
+        self._seen = bytearray(1 << max(bits - 3, 0))
+        self._seen_again = bytearray(1 << max(bits - 3, 0))
+
+    def _bucket(self, size):
+        """Bucket index of a size (Fibonacci hashing)."""
+        return ((size * 0x9e3779b97f4a7c15) & 0xffffffffffffffff) >> self._shift
+
+    def add(self, size):
+        """Record a file size."""
+        bucket = self._bucket(size)
+        index, mask = bucket >> 3, 1 << (bucket & 7)
+        if self._seen[index] & mask:
+            self._seen_again[index] |= mask
+        else:
+            self._seen[index] |= mask
+
+    def maybe_duplicate(self, size):
+        """Check if a size might have been recorded more than once."""
+        bucket = self._bucket(size)
+        return bool(self._seen_again[bucket >> 3] & (1 << (bucket & 7)))
+
+def _walk_files(roots, follow_symlinks=False):
+    """Walk directory trees, yielding ``(path, stat_result)`` of files.
+
+    Unreadable directories are logged and skipped.
+
+    """
+    visited = set()
+    stack = list(reversed(roots))
+    while stack:
+        path = stack.pop()
+        try:
+            pathstat = os.stat(path) if follow_symlinks else os.lstat(path)
+        except OSError as err:
+            logging.warning("cannot stat '%s': %s", path, err.strerror)
+            continue
+        if stat.S_ISREG(pathstat.st_mode):
+            yield path, pathstat
+            continue
+        if not stat.S_ISDIR(pathstat.st_mode):
+            continue
+        inode = (pathstat.st_dev, pathstat.st_ino)
+        if inode in visited:
+            continue
+        visited.add(inode)
+        try:
+            entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+        except OSError as err:
+            logging.warning("cannot list '%s': %s", path, err.strerror)
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=follow_symlinks):
+                    yield entry.path, entry.stat(follow_symlinks=follow_symlinks)
+                elif entry.is_dir(follow_symlinks=follow_symlinks):
+                    subdirs.append(entry.path)
+            except OSError as err:
+                logging.warning("cannot stat '%s': %s", entry.path, err.strerror)
+        stack.extend(reversed(subdirs))
+
+def _size_buckets(roots, min_size, follow_symlinks, table_bits):
+    """Stage 1: group candidate files by size.
+
+    Returns
+    -------
+    buckets : dict
+        Mapping of sizes to ``{(dev, ino): [paths]}`` dicts, only for
+        sizes shared by at least two distinct inodes.
+
+    """
+    table = SizeTable(table_bits)
+    for _, filestat in _walk_files(roots, follow_symlinks):
+        if filestat.st_size >= min_size:
+            table.add(filestat.st_size)
+
+    buckets = collections.defaultdict(
+        lambda: collections.defaultdict(collections.OrderedDict))
+    for path, filestat in _walk_files(roots, follow_symlinks):
+        size = filestat.st_size
+        if size >= min_size and table.maybe_duplicate(size):
+            # a file reached more than once (e.g., through overlapping
+            # roots) is recorded once; hard links have distinct real paths
+            paths = buckets[size][(filestat.st_dev, filestat.st_ino)]
+            paths.setdefault(os.path.realpath(path), path)
+    # drop false positives of the size table, and lone (hard linked) inodes
+    return {size: {inode: list(paths.values()) for inode, paths in inodes.items()}
+            for size, inodes in buckets.items() if len(inodes) >= 2}
+
+def _ordered_map(executor, func, items, window):
+    """Like ``executor.map``, but only submits `window` items ahead."""
+    pending = collections.deque()
+    for item in items:
+        pending.append((item, executor.submit(func, item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+def _regroup(results):
+    """Group ``((key, paths), value)`` pairs into lists of paths lists.
+
+    Consecutive results sharing ``key`` are grouped by ``value``, and
+    each group with at least two members (i.e., distinct inodes) is
+    yielded as ``(key, value, [paths, ...])``. Results with a value of
+    ``None`` (errors) are dropped.
+
+    """
+    current_key = object()
+    groups = {}
+    for (key, paths), value in results:
+        if key != current_key:
+            for group_value, members in groups.items():
+                if len(members) >= 2:
+                    yield current_key, group_value, members
+            current_key = key
+            groups = {}
+        if value is not None:
+            groups.setdefault(value, []).append(paths)
+    for group_value, members in groups.items():
+        if len(members) >= 2:
+            yield current_key, group_value, members
+
+def find_duplicates(roots, algorithm="sha256", min_size=1, workers=None,
+                    follow_symlinks=False, cache=None,
+                    table_bits=DEFAULT_TABLE_BITS):
+    """Find groups of files with identical content.
+
+    See the module docstring for how this works. Files that cannot be
+    read are logged and skipped.
+
+    Parameters
+    ----------
+    roots : list of str
+        Files and directories to search (recursively).
+    algorithm : str, optional
+        Hash algorithm of the fingerprint and full digest stages.
+        Default is ``"sha256"``.
+    min_size : int, optional
+        Ignore files smaller than this many bytes. Default is 1, i.e.,
+        ignore empty files.
+    workers : int, optional
+        Number of worker threads. Default is the number of CPUs.
+    follow_symlinks : bool, optional
+        Whether to follow symlinks. Default is ``False``.
+    cache : zmwangx.hashcache.HashCache, optional
+        Persistent digest cache for the full digest stage.
+    table_bits : int, optional
+        See `SizeTable`. Default is ``DEFAULT_TABLE_BITS``.
+
+    Returns
+    -------
+    groups : generator
+        Generator of `DuplicateGroup` named tuples.
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     for name, content in [("a", b"foo"), ("b", b"bar"), ("c", b"foo")]:
+    ...         with open(os.path.join(tmpdir, name), "wb") as fileobj:
+    ...             written = fileobj.write(content)
+    ...     for group in find_duplicates([tmpdir], "md5"):
+    ...         print(group.size, group.hexdigest,
+    ...               [os.path.basename(path) for path in group.paths])
+    3 acbd18db4cc2f85cedef654fccc4a4d8 ['a', 'c']
+
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    hashlib.new(algorithm)  # fail early on unrecognized algorithm
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    buckets = _size_buckets(roots, min_size, follow_symlinks, table_bits)
+
+    def fingerprint(unit):
+        """Head/tail fingerprint of the first path of a unit."""
+        _, paths = unit
+        try:
+            return zmwangx.hash.fast_fingerprint(
+                paths[0], algorithm, samples=2, sample_size=HEAD_TAIL_SIZE)
+        except OSError as err:
+            logging.warning("cannot read '%s': %s", paths[0], err.strerror)
+            return None
+
+    # stage 2: head/tail fingerprints, bucket by bucket
+    units = ((size, paths) for size, inodes in sorted(buckets.items())
+             for paths in inodes.values())
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    survivors = (((size, fp), paths)
+                 for size, fp, members in _regroup(_ordered_map(
+                     executor, fingerprint, units, workers * 4))
+                 for paths in members)
+
+    # stage 3: full digests
+    fed = collections.deque()
+
+    def feed():
+        """Feed first paths to hash_many, remembering the units."""
+        for unit in survivors:
+            fed.append(unit)
+            yield unit[1][0]
+
+    def full_digests():
+        """Pair units with their full digests."""
+        for result in zmwangx.hash.hash_many(feed(), algorithm, workers=workers,
+                                             cache=cache):
+            unit = fed.popleft()
+            if result.error is not None:
+                logging.warning("cannot read '%s': %s",
+                                result.file, result.error.strerror)
+            yield unit, result.hexdigest
+
+    with executor:
+        for (size, _), hexdigest, members in _regroup(full_digests()):
+            yield DuplicateGroup(size, hexdigest,
+                                 sorted(path for paths in members for path in paths))
+
+def main():
+    """CLI interface."""
+    description = """Find duplicate files in the given files and
+    directories (searched recursively). Each group of duplicates is
+    printed as a line of JSON with keys "size", "digest", and
+    "paths"."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-a", "--algorithm", default="sha256",
+                        help="""Hash algorithm; default is sha256.""")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="""Number of files to read in parallel;
+                        default is the number of CPUs.""")
+    parser.add_argument("-m", "--min-size", type=int, default=1,
+                        help="""Ignore files smaller than this many
+                        bytes; default is 1, i.e., ignore empty
+                        files.""")
+    parser.add_argument("-L", "--follow-symlinks", action="store_true",
+                        help="""Follow symbolic links.""")
+    parser.add_argument("-c", "--cache", action="store_true",
+                        help="""Use the persistent digest cache (see
+                        zmwangx.hashcache).""")
+    parser.add_argument("roots", metavar="PATH", nargs="+",
+                        help="""Files or directories to search.""")
+    args = parser.parse_args()
+
+    cache = zmwangx.hashcache.HashCache() if args.cache else None
+    try:
+        for group in find_duplicates(args.roots, args.algorithm,
+                                     min_size=args.min_size, workers=args.jobs,
+                                     follow_symlinks=args.follow_symlinks,
+                                     cache=cache):
+            print(json.dumps({"size": group.size, "digest": group.hexdigest,
+                              "paths": group.paths}))
+            sys.stdout.flush()
+    except ValueError as err:
+        cerror(str(err))
+        return 1
+    finally:
+        if cache is not None:
+            cache.close()
+    return 0
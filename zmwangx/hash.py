@@ -1,15 +1,55 @@
 #!/usr/bin/env python3
 
+import argparse
+import collections
+import concurrent.futures
+import errno
 import hashlib
 import io
+import json
 import logging
+import mmap
+import multiprocessing
 import os
+import re
+import stat
+import sys
 
 import zmwangx.pbar
+from zmwangx.colorout import cerror, cwarning
 
 DEFAULT_CHUNK_SIZE = 65536
 
-def chunks(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+AUTO_CHUNK_SIZE_MAX = 1024 * 1024
+"""Upper bound of chunk sizes picked by `auto_chunk_size` for regular files
+(unless the filesystem's preferred block size is even larger)."""
+
+DEFAULT_PROCESS_BATCH_SIZE = 16
+"""Default number of files sent to a worker process at a time by `hash_many`."""
+
+MMAP_THRESHOLD = 64 * 1024 * 1024
+"""Minimum file size for `file_hash` to memory-map files by default."""
+
+MMAP_WINDOW_SIZE = 8 * 1024 * 1024
+"""Size of each window of a memory-mapped file passed to the hasher."""
+
+HashResult = collections.namedtuple("HashResult", ["file", "hexdigest", "error"])
+HashResult.__doc__ = """Result of hashing a single file in a batch.
+
+Attributes
+----------
+file : str
+    The file as passed in.
+hexdigest : str or dict or None
+    The hexadecimal digest of the file (or a dict of digests when
+    multiple algorithms are requested), or ``None`` if an error
+    occurred.
+error : OSError or None
+    The error encountered when reading the file, or ``None`` on success.
+
+"""
+
+def chunks(fileobj, chunk_size=DEFAULT_CHUNK_SIZE, length=None):
     """Read file in chunks.
 
     Parameters
@@ -17,6 +57,10 @@ def chunks(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
     fileobj : file-like object
     chunk_size : int, optional
         Default is ``DEFAULT_CHUNK_SIZE`` bytes.
+    length : int, optional
+        Maximum total length to read (in the unit of ``fileobj.read``,
+        i.e., characters for text files). Default is ``None``, i.e.,
+        read until EOF.
 
     Returns
     -------
@@ -25,14 +69,126 @@ def chunks(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
         object of length ``chunk_size``.
 
     """
-    while True:
-        chunk = fileobj.read(chunk_size)
+    remaining = length
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        chunk = fileobj.read(size)
         if not chunk:
             break
+        if remaining is not None:
+            remaining -= len(chunk)
         if isinstance(chunk, str):
             chunk = chunk.encode("utf-8")
         yield chunk
 
+def chunks_into(fileobj, chunk_size=DEFAULT_CHUNK_SIZE, length=None):
+    """Read binary file in chunks into a reused buffer.
+
+    Unlike `chunks`, no new ``bytes`` object is allocated per chunk:
+    data is read with ``fileobj.readinto`` into a single preallocated
+    ``bytearray``, and views into that buffer are yielded.
+
+    Each yielded view is only valid until the next chunk is requested,
+    since the underlying buffer is overwritten; copy it (e.g., with
+    ``bytes(view)``) if you need to keep the data.
+
+    Parameters
+    ----------
+    fileobj : file-like object
+        Binary file-like object supporting ``readinto``.
+    chunk_size : int, optional
+        Default is ``DEFAULT_CHUNK_SIZE`` bytes.
+    length : int, optional
+        Maximum number of bytes to read. Default is ``None``, i.e., read
+        until EOF.
+
+    Returns
+    -------
+    chunks : generator
+        Generator of ``memoryview`` objects of length at most
+        ``chunk_size``.
+
+    Examples
+    --------
+    >>> import io
+    >>> [bytes(view) for view in chunks_into(io.BytesIO(b"abcde"), 2)]
+    [b'ab', b'cd', b'e']
+
+    """
+    remaining = length
+    buf = bytearray(chunk_size if length is None else min(chunk_size, length))
+    with memoryview(buf) as view:
+        while remaining is None or remaining > 0:
+            if remaining is None or remaining >= len(buf):
+                nbytes = fileobj.readinto(buf)
+            else:
+                with view[:remaining] as partial:
+                    nbytes = fileobj.readinto(partial)
+            if not nbytes:
+                break
+            if remaining is not None:
+                remaining -= nbytes
+            yield view[:nbytes]
+
+def _supports_readinto(fileobj):
+    """Check if a file object can be read with `chunks_into`."""
+    if not hasattr(fileobj, "readinto"):
+        return False
+    try:
+        return fileobj.readable()
+    except (AttributeError, ValueError):
+        # not an io object, or closed; let the read itself sort it out
+        return True
+
+def auto_chunk_size(fileobj, total_size=None):
+    """Pick a chunk size suitable for reading a file object.
+
+    The choice is based on the kind of file behind the file object:
+
+    * For a regular file, the chunk size is a multiple of the
+      filesystem's preferred I/O block size (``st_blksize``), large
+      enough to read small files in one go, and capped at
+      ``AUTO_CHUNK_SIZE_MAX`` for large files (so that sequential reads
+      are large without hogging memory). Network filesystems commonly
+      report large block sizes, which are always respected.
+    * For a block device, ``AUTO_CHUNK_SIZE_MAX`` is used.
+    * For pipes, sockets, character devices and file-like objects not
+      backed by a file descriptor, ``DEFAULT_CHUNK_SIZE`` is used, which
+      matches the default pipe buffer size on Linux.
+
+    Parameters
+    ----------
+    fileobj : file-like object
+    total_size : int, optional
+        Number of bytes expected to be read, if known. Default is
+        ``None``, in which case the size of the file is used.
+
+    Returns
+    -------
+    chunk_size : int
+
+    Examples
+    --------
+    >>> import io
+    >>> auto_chunk_size(io.BytesIO(b"hello, world!\\n"))
+    65536
+
+    """
+    try:
+        filestat = os.fstat(fileobj.fileno())
+    except (AttributeError, OSError, ValueError):
+        # io.UnsupportedOperation is a subclass of both OSError and ValueError
+        return DEFAULT_CHUNK_SIZE
+    if stat.S_ISBLK(filestat.st_mode):
+        return AUTO_CHUNK_SIZE_MAX
+    if not stat.S_ISREG(filestat.st_mode):
+        return DEFAULT_CHUNK_SIZE
+    blksize = getattr(filestat, "st_blksize", 0) or 4096
+    size = filestat.st_size if total_size is None else total_size
+    # round up to a multiple of the block size
+    size = max((size + blksize - 1) // blksize * blksize, blksize)
+    return max(blksize, min(size, AUTO_CHUNK_SIZE_MAX // blksize * blksize))
+
 def _fileobj_size(fileobj):
     """
     Try to determine the size of a file object.
@@ -59,35 +215,196 @@ def _fileobj_size(fileobj):
     except AttributeError:
         return None
 
+def _new_hashers(algorithm):
+    """Create fresh hash objects for one or more algorithms.
+
+    Parameters
+    ----------
+    algorithm : str or list of str
+
+    Returns
+    -------
+    hashers : collections.OrderedDict
+        Mapping of algorithm names to hash objects, in the order given.
+
+    Raises
+    ------
+    ValueError
+        If no algorithm is given, or an algorithm is unrecognized.
+
+    """
+    algorithms = [algorithm] if isinstance(algorithm, str) else list(algorithm)
+    if not algorithms:
+        raise ValueError("no hash algorithm specified")
+    return collections.OrderedDict((alg, hashlib.new(alg)) for alg in algorithms)
+
+def _hexdigests(algorithm, hashers):
+    """Collect the hexdigests of `hashers` in the shape of `algorithm`.
+
+    A single hexdigest is returned if `algorithm` is a string, and a
+    dict mapping algorithm names to hexdigests otherwise.
+
+    """
+    if isinstance(algorithm, str):
+        return hashers[algorithm].hexdigest()
+    return {alg: hasher.hexdigest() for alg, hasher in hashers.items()}
+
 def _fileobj_hash(fileobj, algorithm="sha1", chunk_size=DEFAULT_CHUNK_SIZE,
-                  show_progress=False, total_size=None):
+                  show_progress=False, total_size=None, length=None):
     """Calculate the hash of a file object.
 
     See documentation of `file_hash` for details. The only difference is
-    that the ``fileobj`` parameter can only be a file-like object.
+    that the ``fileobj`` parameter can only be a file-like object, and
+    hashing always starts from the current position.
 
     """
+    # pylint: disable=too-many-arguments,too-many-branches
     if show_progress and total_size is None:
         total_size = _fileobj_size(fileobj)
-        if total_size is None:
-            logging.warn("cannot determine the size of the file object; "
-                         "progress bar not shown")
-            show_progress = False
+    if length is not None:
+        total_size = length if total_size is None else min(total_size, length)
+    if show_progress and total_size is None:
+        logging.warning("cannot determine the size of the file object; "
+                        "progress bar not shown")
+        show_progress = False
+    if show_progress and total_size == 0:
+        # nothing to show, and ProgressBar requires a positive size
+        show_progress = False
 
+    if chunk_size == "auto":
+        chunk_size = auto_chunk_size(fileobj, total_size)
+
+    hashers = _new_hashers(algorithm)
     if show_progress:
         pbar = zmwangx.pbar.ProgressBar(total_size)
-    hashalg = hashlib.new(algorithm)
-    for chunk in chunks(fileobj, chunk_size=chunk_size):
-        hashalg.update(chunk)
+    if _supports_readinto(fileobj):
+        chunk_iter = chunks_into(fileobj, chunk_size=chunk_size, length=length)
+    else:
+        chunk_iter = chunks(fileobj, chunk_size=chunk_size, length=length)
+    for chunk in chunk_iter:
+        for hasher in hashers.values():
+            hasher.update(chunk)
         if show_progress:
-            pbar.update(chunk_size)
+            pbar.update(len(chunk))
+    if show_progress:
+        pbar.finish()
+
+    return _hexdigests(algorithm, hashers)
+
+def _mmap_file(fileobj, filestat, use_mmap):
+    """Try to memory-map an opened file for reading.
+
+    Parameters
+    ----------
+    fileobj : file object
+        File opened in binary mode.
+    filestat : os.stat_result
+        Result of ``os.fstat`` on the file.
+    use_mmap : bool or None
+        See `file_hash`.
+
+    Returns
+    -------
+    mapped : mmap.mmap or None
+        None is returned if memory-mapping is not requested, not
+        applicable (e.g., special files or empty files), or failed.
+
+    """
+    if use_mmap is False:
+        return None
+    if not stat.S_ISREG(filestat.st_mode) or filestat.st_size == 0:
+        return None
+    if use_mmap is None and filestat.st_size < MMAP_THRESHOLD:
+        return None
+    try:
+        mapped = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as err:
+        logging.debug("failed to mmap '%s', falling back to streaming: %s",
+                      fileobj.name, err)
+        return None
+    if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return mapped
+
+def _mmap_hash(mapped, algorithm="sha1", show_progress=False,
+               offset=0, length=None):
+    """Calculate the hash of (a range of) a memory-mapped file.
+
+    The mapping is passed to the hasher in windows of
+    ``MMAP_WINDOW_SIZE`` bytes, without copying into user-space buffers.
+
+    """
+    hashers = _new_hashers(algorithm)
+    end = len(mapped) if length is None else min(len(mapped), offset + length)
+    if show_progress and end > offset:
+        pbar = zmwangx.pbar.ProgressBar(end - offset)
+    else:
+        show_progress = False
+    with memoryview(mapped) as view:
+        for start in range(offset, end, MMAP_WINDOW_SIZE):
+            with view[start:min(start + MMAP_WINDOW_SIZE, end)] as window:
+                for hasher in hashers.values():
+                    hasher.update(window)
+                if show_progress:
+                    pbar.update(len(window))
     if show_progress:
         pbar.finish()
 
-    return hashalg.hexdigest()
+    return _hexdigests(algorithm, hashers)
+
+def _path_hash(path, algorithm, chunk_size, show_progress, use_mmap,
+               offset=None, length=None):
+    """Calculate the hash of a file on disk; see `file_hash`."""
+    # pylint: disable=too-many-arguments
+    offset = 0 if offset is None else offset
+    with open(path, "rb") as fileobj:
+        filestat = os.fstat(fileobj.fileno())
+        mapped = _mmap_file(fileobj, filestat, use_mmap)
+        if mapped is not None:
+            with mapped:
+                return _mmap_hash(mapped, algorithm, show_progress,
+                                  offset, length)
+        # special files do not have a meaningful st_size
+        total_size = (max(filestat.st_size - offset, 0)
+                      if stat.S_ISREG(filestat.st_mode) else None)
+        if offset:
+            fileobj.seek(offset)
+        return _fileobj_hash(fileobj, algorithm, chunk_size,
+                             show_progress, total_size, length)
+
+def _cached_path_hash(path, algorithm, chunk_size, show_progress, use_mmap,
+                      cache):
+    """Calculate the hash of a file on disk, consulting a digest cache.
+
+    On a cache hit for every requested algorithm, the file is not even
+    opened. Otherwise, only the missing digests are calculated, and they
+    are stored in the cache unless the file changed while being read.
+
+    """
+    algorithms = [algorithm] if isinstance(algorithm, str) else list(algorithm)
+    filestat = os.stat(path)
+    cacheable = stat.S_ISREG(filestat.st_mode)
+    digests = {}
+    if cacheable:
+        for alg in algorithms:
+            hexdigest = cache.get(filestat, alg)
+            if hexdigest is not None:
+                digests[alg] = hexdigest
+    missing = [alg for alg in algorithms if alg not in digests]
+    if missing:
+        digests.update(_path_hash(path, missing, chunk_size,
+                                  show_progress, use_mmap))
+        if cacheable:
+            newstat = os.stat(path)
+            if ((newstat.st_ino, newstat.st_size, newstat.st_mtime_ns) ==
+                    (filestat.st_ino, filestat.st_size, filestat.st_mtime_ns)):
+                for alg in missing:
+                    cache.put(filestat, alg, digests[alg])
+    return digests[algorithm] if isinstance(algorithm, str) else digests
 
 def file_hash(file, algorithm="sha1", chunk_size=DEFAULT_CHUNK_SIZE,
-              show_progress=False, total_size=None):
+              show_progress=False, total_size=None, use_mmap=None,
+              cache=None, offset=None, length=None):
     r"""Calculate the hash of a file.
 
     The file object is read into memory in small chunks so as to not to
@@ -98,11 +415,14 @@ def file_hash(file, algorithm="sha1", chunk_size=DEFAULT_CHUNK_SIZE,
     file : str or file-like object
         Path to the file on disk, or an opened file-like
         object. File-like object should be opened in binary mode.
-    algorithm : str, optional
+    algorithm : str or list of str, optional
         The hash algorithm to use; should be one of
-        ``hashlib.algorithms_available``. Default is ``"sha1"``.
-    chunk_size : int, optional
-        Default is ``DEFAULT_CHUNK_SIZE``.
+        ``hashlib.algorithms_available``. Default is ``"sha1"``. A list
+        of algorithms may be given instead, in which case all digests
+        are calculated in a single pass over the file.
+    chunk_size : int or "auto", optional
+        Default is ``DEFAULT_CHUNK_SIZE``. If ``"auto"``, the chunk size
+        is chosen by `auto_chunk_size` based on the file being read.
     show_progress : bool, optional
         Whether to print progress bar. Default is ``False``.
     total_size : int, optional
@@ -110,11 +430,38 @@ def file_hash(file, algorithm="sha1", chunk_size=DEFAULT_CHUNK_SIZE,
         ``show_progress`` is ``True``, and ``file`` is a file-like
         object. Default is ``None``, in which case the program will try
         to infer the total size.
+    use_mmap : bool or None, optional
+        Whether to memory-map ``file`` instead of streaming it through
+        reads, which saves syscalls and copies. Only applicable when
+        ``file`` is a path to a regular file; other files, and files
+        that cannot be mapped, are always streamed. ``True`` means
+        always map if applicable, ``False`` means never map, and
+        ``None`` (default) means map if the file is at least
+        ``MMAP_THRESHOLD`` bytes. Note that if a mapped file is
+        truncated (by another process) while being hashed, the process
+        is killed by ``SIGBUS`` rather than getting an ``OSError``; do
+        not map files that may shrink under you.
+    cache : zmwangx.hashcache.HashCache, optional
+        Persistent digest cache. Only used when ``file`` is a path to a
+        regular file. If the digest of the file (as identified by its
+        device, inode, size and modification time) is cached, the file
+        is not read at all; otherwise, the newly calculated digest is
+        stored in the cache. Default is ``None`` (no caching). Not
+        used when hashing a range (see ``offset`` and ``length``).
+    offset : int, optional
+        Position in bytes to start hashing from. Default is ``None``,
+        meaning the current position for a file-like object, and the
+        beginning for a path.
+    length : int, optional
+        Maximum number of bytes to hash. Default is ``None``, i.e., hash
+        until EOF.
 
     Returns
     -------
-    hexdigest : str
-       The hexadecimal digest of the file.
+    hexdigest : str or dict
+       The hexadecimal digest of the file. If ``algorithm`` is a list, a
+       dict mapping each algorithm to the corresponding hexadecimal
+       digest is returned instead.
 
     Raises
     ------
@@ -143,13 +490,1182 @@ def file_hash(file, algorithm="sha1", chunk_size=DEFAULT_CHUNK_SIZE,
     MD5 digest: 910c8bc73110b0cd1bc5d2bcae782511
     SHA-1 digest: e91ba0972b9055187fa2efa8b5c156f487a8293a
     SHA-256 digest: 4dca0fd5f424a31b03ab807cbae77eb32bf2d089eed1cee154b3afed458de0dc
+    >>> with tempfile.TemporaryFile() as fileobj:
+    ...     written = fileobj.write(b"hello, world!\n")
+    ...     pos = fileobj.seek(0)
+    ...     digests = file_hash(fileobj, ["md5", "sha1"])
+    >>> digests["md5"]
+    '910c8bc73110b0cd1bc5d2bcae782511'
+    >>> digests["sha1"]
+    'e91ba0972b9055187fa2efa8b5c156f487a8293a'
+    >>> with tempfile.TemporaryFile() as fileobj:
+    ...     written = fileobj.write(b"hello, world!\n")
+    ...     file_hash(fileobj, "md5", offset=0, length=5)  # b"hello"
+    '5d41402abc4b2a76b9719d911017c592'
 
     """
+    # pylint: disable=too-many-arguments
     if hasattr(file, "read"):
+        if offset is not None:
+            file.seek(offset)
         return _fileobj_hash(file, algorithm, chunk_size,
-                             show_progress, total_size)
+                             show_progress, total_size, length)
+    elif cache is not None and offset is None and length is None:
+        return _cached_path_hash(file, algorithm, chunk_size,
+                                 show_progress, use_mmap, cache)
+    else:
+        return _path_hash(file, algorithm, chunk_size, show_progress, use_mmap,
+                          offset, length)
+
+def _file_hash_result(file, algorithm, chunk_size, cache=None, use_mmap=False):
+    """Hash a single file, capturing read errors in a `HashResult`."""
+    try:
+        return HashResult(file, file_hash(file, algorithm, chunk_size,
+                                          use_mmap=use_mmap, cache=cache), None)
+    except OSError as err:
+        return HashResult(file, None, err)
+
+def _hash_batch(files, algorithm, chunk_size, cache=None, use_mmap=False):
+    """Hash a batch of files; the unit of work of `hash_many`."""
+    return [_file_hash_result(file, algorithm, chunk_size, cache, use_mmap)
+            for file in files]
+
+def _batches(iterable, size):
+    """Split an iterable into lists of at most `size` items, lazily."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _hash_many(files, algorithm, chunk_size, workers, ordered, cache,
+               backend, batch_size, use_mmap):
+    """Generator doing the actual work of `hash_many`."""
+    # pylint: disable=too-many-arguments
+    if backend == "process":
+        executor_class = concurrent.futures.ProcessPoolExecutor
+    else:
+        executor_class = concurrent.futures.ThreadPoolExecutor
+    # bound the number of pending futures so that we don't materialize
+    # a huge iterable of files all at once
+    max_pending = workers * 4
+
+    with executor_class(max_workers=workers) as executor:
+        pending = collections.deque()
+        for batch in _batches(files, batch_size):
+            pending.append(executor.submit(_hash_batch, batch, algorithm,
+                                           chunk_size, cache, use_mmap))
+            if len(pending) < max_pending:
+                continue
+            if ordered:
+                for result in pending.popleft().result():
+                    yield result
+            else:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    for result in future.result():
+                        yield result
+
+        if ordered:
+            while pending:
+                for result in pending.popleft().result():
+                    yield result
+        else:
+            for future in concurrent.futures.as_completed(pending):
+                for result in future.result():
+                    yield result
+
+def _with_progress(results, sizes):
+    """Pass through `HashResult`s, updating a ProgressBar per file."""
+    total_size = sum(sizes.values())
+    pbar = zmwangx.pbar.ProgressBar(total_size) if total_size > 0 else None
+    for result in results:
+        if pbar is not None:
+            pbar.update(sizes.get(result.file, 0))
+        yield result
+    if pbar is not None:
+        pbar.finish()
+
+def hash_many(files, algorithm="sha1", chunk_size=DEFAULT_CHUNK_SIZE,
+              workers=None, ordered=True, cache=None, backend="thread",
+              batch_size=None, show_progress=False, use_mmap=False):
+    """Calculate the hashes of many files concurrently.
+
+    By default, files are hashed in a thread pool. Since ``hashlib``
+    releases the GIL when digesting large chunks, throughput scales with
+    the number of workers until the storage is saturated. For
+    algorithms (or workloads with many small files) where the GIL is
+    held for too long for threads to scale, use the process backend
+    instead: paths (not data) are shipped to worker processes in batches
+    of ``batch_size`` files, to amortize the IPC overhead.
+
+    An error reading one file does not abort the batch; instead, the
+    error is reported in the result for that file.
+
+    Parameters
+    ----------
+    files : iterable
+        Paths to the files on disk. The iterable is consumed lazily
+        (unless ``show_progress`` is ``True``), so a generator over a
+        huge number of files is fine.
+    algorithm : str or list of str, optional
+        The hash algorithm(s) to use. See `file_hash`. Default is
+        ``"sha1"``.
+    chunk_size : int or "auto", optional
+        Default is ``DEFAULT_CHUNK_SIZE``.
+    workers : int, optional
+        Number of worker threads or processes. Default is ``None``, in
+        which case the number of CPUs is used.
+    ordered : bool, optional
+        If ``True`` (default), results are yielded in the order of
+        ``files``; otherwise, results are yielded as soon as they are
+        available.
+    cache : zmwangx.hashcache.HashCache, optional
+        Persistent digest cache; see `file_hash`. Default is
+        ``None``. Not supported by the process backend.
+    backend : {"thread", "process"}, optional
+        Default is ``"thread"``.
+    batch_size : int, optional
+        Number of files per unit of work. Default is ``None``, meaning
+        1 for the thread backend and ``DEFAULT_PROCESS_BATCH_SIZE`` for
+        the process backend.
+    show_progress : bool, optional
+        Whether to print a progress bar, advanced as each file is
+        done. The sizes of all files are determined upfront, which
+        consumes ``files``. Default is ``False``.
+    use_mmap : bool or None, optional
+        See `file_hash`. Default is ``False``, unlike `file_hash`: when
+        walking many files, some may well be truncated while being
+        read, which would kill the process if they were mapped.
+
+    Returns
+    -------
+    results : generator
+        Generator of `HashResult` named tuples ``(file, hexdigest,
+        error)``.
+
+    Raises
+    ------
+    ValueError
+        If the algorithm or backend is unrecognized, or a cache is
+        passed to the process backend.
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     path = os.path.join(tmpdir, "hello.txt")
+    ...     with open(path, "wb") as fileobj:
+    ...         written = fileobj.write(b"hello, world!\\n")
+    ...     missing = os.path.join(tmpdir, "missing.txt")
+    ...     for result in hash_many([path, missing], "md5"):
+    ...         print(os.path.basename(result.file), result.hexdigest,
+    ...               type(result.error).__name__)
+    hello.txt 910c8bc73110b0cd1bc5d2bcae782511 NoneType
+    missing.txt None FileNotFoundError
+
+    """
+    # pylint: disable=too-many-arguments
+    _new_hashers(algorithm)  # fail early on unrecognized algorithm
+    if backend not in {"thread", "process"}:
+        raise ValueError("expected thread or process; %s received" % backend)
+    if backend == "process" and cache is not None:
+        raise ValueError("cache is not supported by the process backend")
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if batch_size is None:
+        batch_size = DEFAULT_PROCESS_BATCH_SIZE if backend == "process" else 1
+
+    if not show_progress:
+        return _hash_many(files, algorithm, chunk_size, workers, ordered,
+                          cache, backend, batch_size, use_mmap)
+    files = list(files)
+    sizes = {}
+    for file in files:
+        try:
+            sizes[file] = os.path.getsize(file)
+        except OSError:
+            sizes[file] = 0
+    return _with_progress(_hash_many(files, algorithm, chunk_size, workers,
+                                     ordered, cache, backend, batch_size,
+                                     use_mmap),
+                          sizes)
+
+_KERNEL_COPY_FALLBACK_ERRNOS = {
+    errno.EBADF, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EXDEV,
+    errno.ENOTSUP, errno.ESPIPE, errno.EPERM,
+}
+
+def _resync_position(fileobj):
+    """Sync a file object's position with its descriptor's offset."""
+    if fileobj.seekable():
+        fileobj.seek(os.lseek(fileobj.fileno(), 0, os.SEEK_CUR))
+
+def _kernel_copy(method, src_fd, dst_fd, offset, count):
+    """Copy `count` bytes at `offset` of `src_fd` to `dst_fd` in the kernel.
+
+    `method` is ``"copy_file_range"`` or ``"sendfile"``. Data is written
+    at the current offset of `dst_fd`; the offset of `src_fd` is not
+    changed.
+
+    """
+    while count > 0:
+        if method == "copy_file_range":
+            copied = os.copy_file_range(src_fd, dst_fd, count, offset)
+        else:
+            copied = os.sendfile(dst_fd, src_fd, offset, count)
+        if copied == 0:
+            raise OSError(errno.EIO, "unexpected end of file")
+        offset += copied
+        count -= copied
+
+def _kernel_copy_methods():
+    """Available in-kernel copy methods, in order of preference."""
+    return [method for method in ("copy_file_range", "sendfile")
+            if hasattr(os, method)]
+
+def _fileno(fileobj):
+    """File descriptor of a file object, or None if there isn't one."""
+    try:
+        return fileobj.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+def copy_hash(src, dsts, algorithm="sha1", chunk_size=DEFAULT_CHUNK_SIZE,
+              show_progress=False, total_size=None, use_kernel=True):
+    """Copy a file object to one or more sinks while hashing it.
+
+    The data is read once: each chunk read from ``src`` is digested and
+    then written to every sink, so there is no need to hash the copies
+    afterwards.
+
+    When ``src`` is a regular file and a sink is backed by a file
+    descriptor, the data is copied in the kernel -- with
+    ``os.copy_file_range`` (which also allows filesystems to clone or
+    copy server side) or ``os.sendfile`` -- instead of being written
+    from user space; the chunk read for hashing is then still in the
+    page cache. Sinks for which the kernel refuses (e.g., across
+    filesystems on older kernels) transparently fall back to regular
+    writes from the shared buffer.
+
+    Parameters
+    ----------
+    src : file-like object
+        Binary file-like object to copy from, starting at its current
+        position.
+    dsts : file-like object or list of file-like objects
+        Binary file-like object(s) to copy to, at their current
+        positions.
+    algorithm : str or list of str, optional
+        See `file_hash`. Default is ``"sha1"``.
+    chunk_size : int or "auto", optional
+        See `file_hash`. Default is ``DEFAULT_CHUNK_SIZE``.
+    show_progress : bool, optional
+        Whether to print progress bar. Default is ``False``.
+    total_size : int, optional
+        Total size in bytes, used for the progress bar. See
+        `file_hash`.
+    use_kernel : bool, optional
+        Whether to attempt in-kernel copying. Default is ``True``.
+
+    Returns
+    -------
+    hexdigest : str or dict
+        The hexadecimal digest(s) of the copied data; see `file_hash`.
+
+    Raises
+    ------
+    ValueError
+        If the algorithm is unrecognized.
+    OSError
+        If there is error reading or writing.
+
+    Examples
+    --------
+    >>> import io
+    >>> src = io.BytesIO(b"hello, world!\\n")
+    >>> dsts = [io.BytesIO(), io.BytesIO()]
+    >>> copy_hash(src, dsts, "md5")
+    '910c8bc73110b0cd1bc5d2bcae782511'
+    >>> [dst.getvalue() for dst in dsts]
+    [b'hello, world!\\n', b'hello, world!\\n']
+
+    """
+    # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+    if not isinstance(dsts, (list, tuple)):
+        dsts = [dsts]
+    hashers = _new_hashers(algorithm)
+
+    if show_progress and total_size is None:
+        total_size = _fileobj_size(src)
+        if total_size is None:
+            logging.warning("cannot determine the size of the file object; "
+                            "progress bar not shown")
+    show_progress = show_progress and bool(total_size)
+    if chunk_size == "auto":
+        chunk_size = auto_chunk_size(src, total_size)
+
+    # kernel copy methods to try for each sink; an empty list means
+    # writing from the buffer
+    src_fd = _fileno(src) if use_kernel else None
+    if src_fd is not None and stat.S_ISREG(os.fstat(src_fd).st_mode):
+        offset = src.tell()
+        methods = [_kernel_copy_methods() if _fileno(dst) is not None else []
+                   for dst in dsts]
+        for dst, dst_methods in zip(dsts, methods):
+            if dst_methods:
+                dst.flush()
     else:
-        total_size = os.path.getsize(file)
-        with open(file, "rb") as fileobj:
-            return _fileobj_hash(fileobj, algorithm, chunk_size,
-                                 show_progress, total_size)
+        offset = None
+        methods = [[] for _ in dsts]
+
+    if show_progress:
+        pbar = zmwangx.pbar.ProgressBar(total_size)
+    if _supports_readinto(src):
+        chunk_iter = chunks_into(src, chunk_size=chunk_size)
+    else:
+        chunk_iter = chunks(src, chunk_size=chunk_size)
+    for chunk in chunk_iter:
+        for hasher in hashers.values():
+            hasher.update(chunk)
+        for dst, dst_methods in zip(dsts, methods):
+            while dst_methods:
+                try:
+                    _kernel_copy(dst_methods[0], src_fd, dst.fileno(),
+                                 offset, len(chunk))
+                    break
+                except OSError as err:
+                    if err.errno not in _KERNEL_COPY_FALLBACK_ERRNOS:
+                        raise
+                    dst_methods.pop(0)
+                    if not dst_methods:
+                        _resync_position(dst)
+            else:
+                dst.write(chunk)
+        if offset is not None:
+            offset += len(chunk)
+        if show_progress:
+            pbar.update(len(chunk))
+    for dst, dst_methods in zip(dsts, methods):
+        if dst_methods:
+            _resync_position(dst)
+    if show_progress:
+        pbar.finish()
+
+    return _hexdigests(algorithm, hashers)
+
+def _escape_checksum_path(path):
+    """Escape a path for a checksum line.
+
+    As in GNU coreutils, a path containing a backslash or a newline is
+    escaped, and the line should be prefixed with a backslash.
+
+    Returns
+    -------
+    prefix, path : str, str
+
+    """
+    if "\\" in path or "\n" in path:
+        return "\\", path.replace("\\", "\\\\").replace("\n", "\\n")
+    return "", path
+
+def _checksum_line(hexdigest, path):
+    """Format a ``sha256sum``-compatible checksum line (without newline)."""
+    prefix, path = _escape_checksum_path(path)
+    return "%s%s  %s" % (prefix, hexdigest, path)
+
+
+class TreeHash(object):
+
+    """Digests of a directory tree, as returned by `tree_hash`.
+
+    The Merkle digest of a directory is the digest of the concatenation
+    of ``"<type> <digest> <name>\\0"`` for each of its entries in order,
+    where ``<type>`` is ``f`` (file), ``d`` (directory), ``l``
+    (symlink, whose digest is that of the link target string) or ``e``
+    (file that could not be read, whose digest is empty), and
+    ``<name>`` is UTF-8 encoded (with surrogate escapes).
+
+    Attributes
+    ----------
+    root : str
+        The root directory.
+    algorithm : str
+    digest : str
+        The Merkle root, i.e., the digest of the root directory.
+    files : collections.OrderedDict
+        Mapping of file paths (relative to `root`) to digests, in
+        traversal order.
+    dirs : dict
+        Mapping of directory paths (relative to `root`; the root itself
+        is ``""``) to subtree digests.
+    errors : collections.OrderedDict
+        Mapping of paths (relative to `root`) of files that could not be
+        read to the ``OSError`` raised, in traversal order. These files
+        are not in `files`.
+
+    """
+
+    # pylint: disable=too-many-arguments
+
+    def __init__(self, root, algorithm, files, dirs, nodes, signatures,
+                 errors):
+        """Init. Use `tree_hash` rather than instantiating directly."""
+        self.root = root
+        self.algorithm = algorithm
+        self.files = files
+        self.dirs = dirs
+        self.errors = errors
+        self.digest = dirs[""]
+        # reldir -> list of (type, name, relpath) entries
+        self._nodes = nodes
+        # relpath -> (dev, ino, size, mtime_ns), for incremental runs
+        self._signatures = signatures
+
+    def manifest(self):
+        """Per-file manifest, compatible with ``sha256sum --check``.
+
+        Paths are relative to `root`, so the manifest should be checked
+        from within `root`. Only regular files (including those reached
+        through followed symlinks) are listed.
+
+        Returns
+        -------
+        manifest : str
+
+        """
+        return "".join(_checksum_line(digest, path) + "\n"
+                       for path, digest in self.files.items())
+
+    def signature(self, path):
+        """Stat signature of a file, for detecting changes between runs.
+
+        Parameters
+        ----------
+        path : str
+            Path relative to `root`.
+
+        Returns
+        -------
+        signature : tuple or None
+            ``(st_dev, st_ino, st_size, st_mtime_ns)`` as of the run, or
+            ``None`` if ``path`` is not a file in the tree.
+
+        """
+        return self._signatures.get(path)
+
+def _stat_signature(filestat):
+    """Signature of a file for detecting changes between runs."""
+    return (filestat.st_dev, filestat.st_ino, filestat.st_size,
+            filestat.st_mtime_ns)
+
+def tree_hash(root, algorithm="sha256", workers=None, symlinks="skip",
+              sort_key=None, previous=None, cache=None):
+    """Calculate the digests of all files in a directory tree.
+
+    Files are hashed in parallel (see `hash_many`). The result includes
+    a per-file manifest, as well as a deterministic Merkle digest of
+    every directory, the root one being the fingerprint of the whole
+    tree (see `TreeHash` for details).
+
+    For incremental runs, pass the result of a previous run on the same
+    tree as ``previous``: files whose device, inode, size and
+    modification time are unchanged are not read again.
+
+    A file that cannot be read does not abort the run; it is recorded in
+    `TreeHash.errors` instead (compare `hash_many`).
+
+    Parameters
+    ----------
+    root : str
+        Path to the root directory.
+    algorithm : str, optional
+        The hash algorithm to use. Default is ``"sha256"``.
+    workers : int, optional
+        Number of worker threads. See `hash_many`.
+    symlinks : {"skip", "follow", "link"}, optional
+        How to treat symbolic links. ``"skip"`` (default) ignores them;
+        ``"follow"`` treats them as what they point to (symlinks forming
+        loops and dangling symlinks are ignored); ``"link"`` records the
+        links themselves, digesting the link targets rather than the
+        files pointed to.
+    sort_key : callable, optional
+        Key function applied to entry names to order the entries of each
+        directory. Default is ``None``, i.e., ordering by name. Note that
+        the Merkle digests depend on the ordering.
+    previous : TreeHash, optional
+        Result of a previous run, for incremental hashing.
+    cache : zmwangx.hashcache.HashCache, optional
+        Persistent digest cache; see `file_hash`.
+
+    Returns
+    -------
+    tree : TreeHash
+
+    Raises
+    ------
+    ValueError
+        If the algorithm or symlink policy is unrecognized.
+    OSError
+        If a directory cannot be listed.
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     os.mkdir(os.path.join(tmpdir, "sub"))
+    ...     for path in ("hello.txt", os.path.join("sub", "hello.txt")):
+    ...         with open(os.path.join(tmpdir, path), "wb") as fileobj:
+    ...             written = fileobj.write(b"hello, world!\\n")
+    ...     tree = tree_hash(tmpdir, "md5")
+    >>> print(tree.manifest(), end="")
+    910c8bc73110b0cd1bc5d2bcae782511  hello.txt
+    910c8bc73110b0cd1bc5d2bcae782511  sub/hello.txt
+    >>> tree.digest
+    'e2bfc641a3750999ba782daae04caa5d'
+
+    """
+    # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+    if not isinstance(algorithm, str):
+        raise ValueError("tree_hash takes a single algorithm")
+    _new_hashers(algorithm)
+    if symlinks not in {"skip", "follow", "link"}:
+        raise ValueError("expected skip, follow, or link; %s received" % symlinks)
+    if previous is not None and previous.algorithm != algorithm:
+        previous = None
+    follow = symlinks == "follow"
+    key = (lambda entry: entry.name) if sort_key is None else (
+        lambda entry: sort_key(entry.name))
+
+    nodes = {}
+    signatures = collections.OrderedDict()
+    link_targets = {}
+    # preorder traversal; a parent directory always precedes its children
+    dir_order = []
+    rootstat = os.stat(root)
+    stack = [("", frozenset([(rootstat.st_dev, rootstat.st_ino)]))]
+    while stack:
+        reldir, ancestors = stack.pop()
+        dir_order.append(reldir)
+        entries = []
+        for entry in sorted(os.scandir(os.path.join(root, reldir)), key=key):
+            relpath = os.path.join(reldir, entry.name)
+            if entry.is_symlink() and not follow:
+                if symlinks == "link":
+                    link_targets[relpath] = os.readlink(entry.path)
+                    entries.append(("l", entry.name, relpath))
+                continue
+            if entry.is_dir(follow_symlinks=follow):
+                entrystat = entry.stat(follow_symlinks=follow)
+                inode = (entrystat.st_dev, entrystat.st_ino)
+                if inode in ancestors:
+                    continue  # symlink loop
+                stack.append((relpath, ancestors | {inode}))
+                entries.append(("d", entry.name, relpath))
+            elif entry.is_file(follow_symlinks=follow):
+                signatures[relpath] = _stat_signature(
+                    entry.stat(follow_symlinks=follow))
+                entries.append(("f", entry.name, relpath))
+            # dangling symlinks and special files are ignored
+        nodes[reldir] = entries
+
+    file_digests = {}
+    file_errors = {}
+    changed = []
+    for relpath, signature in signatures.items():
+        if (previous is not None and relpath in previous.files and
+                previous.signature(relpath) == signature):
+            file_digests[relpath] = previous.files[relpath]
+        else:
+            changed.append(relpath)
+    paths = [os.path.join(root, relpath) for relpath in changed]
+    for relpath, result in zip(changed, hash_many(paths, algorithm,
+                                                  workers=workers, cache=cache)):
+        if result.error is not None:
+            file_errors[relpath] = result.error
+        else:
+            file_digests[relpath] = result.hexdigest
+
+    dir_digests = {}
+    for reldir in reversed(dir_order):
+        hasher = hashlib.new(algorithm)
+        for kind, name, relpath in nodes[reldir]:
+            if kind == "f" and relpath in file_errors:
+                kind, digest = "e", ""
+            elif kind == "f":
+                digest = file_digests[relpath]
+            elif kind == "d":
+                digest = dir_digests[relpath]
+            else:
+                digest = hashlib.new(algorithm, link_targets[relpath].encode(
+                    "utf-8", "surrogateescape")).hexdigest()
+            hasher.update(("%s %s %s\0" % (kind, digest, name)).encode(
+                "utf-8", "surrogateescape"))
+        dir_digests[reldir] = hasher.hexdigest()
+
+    # files in depth-first order, with the files of a directory listed
+    # before the contents of its subdirectories
+    files = collections.OrderedDict()
+    errors = collections.OrderedDict()
+    stack = [""]
+    while stack:
+        reldir = stack.pop()
+        subdirs = []
+        for kind, _, relpath in nodes[reldir]:
+            if kind == "f" and relpath in file_errors:
+                errors[relpath] = file_errors[relpath]
+            elif kind == "f":
+                files[relpath] = file_digests[relpath]
+            elif kind == "d":
+                subdirs.append(relpath)
+        stack.extend(reversed(subdirs))
+
+    return TreeHash(root, algorithm, files, dir_digests, nodes, signatures,
+                    errors)
+
+FINGERPRINT_SAMPLES = 8
+"""Default number of samples taken by `fast_fingerprint`."""
+
+FINGERPRINT_SAMPLE_SIZE = 65536
+"""Default size in bytes of each sample taken by `fast_fingerprint`."""
+
+def _pread(fd, size, offset):
+    """Read exactly `size` bytes at `offset` (fewer only at EOF)."""
+    pieces = []
+    while size > 0:
+        if hasattr(os, "pread"):
+            piece = os.pread(fd, size, offset)
+        else:
+            # no positional reads (e.g., on Windows); not thread-safe
+            os.lseek(fd, offset, os.SEEK_SET)
+            piece = os.read(fd, size)
+        if not piece:
+            break
+        pieces.append(piece)
+        size -= len(piece)
+        offset += len(piece)
+    return b"".join(pieces)
+
+def _sample_ranges(size, samples, sample_size):
+    """Deterministic samples: head, tail, and evenly spaced between.
+
+    Returns
+    -------
+    offsets, length : list, int
+        Offsets of the samples, and the length of each.
+
+    """
+    if size <= samples * sample_size:
+        # samples would cover (or overlap) the whole file anyway
+        return [0], size
+    if samples == 1:
+        return [0], sample_size
+    span = size - sample_size
+    return [span * i // (samples - 1) for i in range(samples)], sample_size
+
+def fast_fingerprint(path, algorithm="sha1", samples=FINGERPRINT_SAMPLES,
+                     sample_size=FINGERPRINT_SAMPLE_SIZE, executor=None):
+    """Calculate a fast, sampled fingerprint of a file.
+
+    Only the size of the file and ``samples`` samples of ``sample_size``
+    bytes each -- at the head, at the tail, and evenly spaced in between
+    -- are digested, so the cost is independent of the size of the
+    file; a single sample is taken at the head. Files no larger than
+    ``samples * sample_size`` bytes are read in full, and only those.
+
+    .. warning::
+
+       The fingerprint is meant for quick change detection and for
+       ruling out equality, *not* for establishing it: two files that
+       differ only outside the sampled ranges have the same
+       fingerprint, no matter how strong ``algorithm`` is. Use
+       `fingerprint_equal` with ``escalate=True``, or `file_hash`,
+       when equality matters.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file on disk.
+    algorithm : str, optional
+        The hash algorithm to use. Default is ``"sha1"``.
+    samples : int, optional
+        Number of samples. Default is ``FINGERPRINT_SAMPLES``.
+    sample_size : int, optional
+        Size of each sample, in bytes. Default is
+        ``FINGERPRINT_SAMPLE_SIZE``.
+    executor : concurrent.futures.ThreadPoolExecutor, optional
+        If specified, samples are read concurrently (with ``os.pread``)
+        in this thread pool, which helps on high-latency storage. The
+        threads share one file descriptor, so other executors (e.g., a
+        ``ProcessPoolExecutor``) are not supported. Samples are read
+        sequentially regardless on platforms without ``os.pread``.
+        Default is ``None``, i.e., samples are read sequentially.
+
+    Returns
+    -------
+    fingerprint : str
+        Hexadecimal digest of the size and the samples.
+
+    Raises
+    ------
+    ValueError
+        If `samples` or `sample_size` is not positive.
+    TypeError
+        If `executor` is not a ``ThreadPoolExecutor``.
+    OSError
+        If there is error reading the file.
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     paths = [os.path.join(tmpdir, name) for name in ("a", "b")]
+    ...     for path, middle in zip(paths, (b"a", b"b")):
+    ...         with open(path, "wb") as fileobj:
+    ...             written = fileobj.write(b"0" * 500000 + middle + b"0" * 500000)
+    ...     fast_fingerprint(paths[0]) == fast_fingerprint(paths[1])
+    ...     fingerprint_equal(paths[0], paths[1])
+    True
+    False
+
+    """
+    if samples < 1 or sample_size < 1:
+        raise ValueError("samples and sample_size must be positive")
+    if (executor is not None and
+            not isinstance(executor, concurrent.futures.ThreadPoolExecutor)):
+        raise TypeError("expected a ThreadPoolExecutor; %s received" %
+                        type(executor).__name__)
+    hasher = hashlib.new(algorithm)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        offsets, length = _sample_ranges(size, samples, sample_size)
+        if executor is not None and len(offsets) > 1 and hasattr(os, "pread"):
+            data = list(executor.map(lambda offset: _pread(fd, length, offset),
+                                     offsets))
+        else:
+            data = [_pread(fd, length, offset) for offset in offsets]
+    finally:
+        os.close(fd)
+    hasher.update(("%d\n" % size).encode("ascii"))
+    for offset, sample in zip(offsets, data):
+        hasher.update(("%d:%d\n" % (offset, len(sample))).encode("ascii"))
+        hasher.update(sample)
+    return hasher.hexdigest()
+
+def fingerprint_equal(path1, path2, algorithm="sha1", escalate=True,
+                      samples=FINGERPRINT_SAMPLES,
+                      sample_size=FINGERPRINT_SAMPLE_SIZE):
+    """Compare two files by fast fingerprint, optionally escalating.
+
+    Files of different sizes, or with different fast fingerprints (see
+    `fast_fingerprint`), are definitely different. When the fingerprints
+    match and ``escalate`` is ``True``, full digests are compared to
+    settle the question.
+
+    Parameters
+    ----------
+    path1, path2 : str
+        Paths to the files on disk.
+    algorithm : str, optional
+        Hash algorithm used for both the fingerprints and the full
+        digests. Default is ``"sha1"``.
+    escalate : bool, optional
+        Whether to compare full digests when the fingerprints
+        match. Default is ``True``. If ``False``, a return value of
+        ``True`` only means the files are *probably* equal.
+    samples, sample_size : int, optional
+        See `fast_fingerprint`.
+
+    Returns
+    -------
+    bool
+
+    """
+    # pylint: disable=too-many-arguments
+    if os.path.getsize(path1) != os.path.getsize(path2):
+        return False
+    if (fast_fingerprint(path1, algorithm, samples, sample_size) !=
+            fast_fingerprint(path2, algorithm, samples, sample_size)):
+        return False
+    if not escalate:
+        return True
+    return file_hash(path1, algorithm) == file_hash(path2, algorithm)
+
+def _load_checkpoint(checkpoint):
+    """Load a `piecewise_hash` checkpoint; None if missing or corrupt."""
+    try:
+        with open(checkpoint, encoding="utf-8") as fileobj:
+            state = json.load(fileobj)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or not isinstance(state.get("digests"), list):
+        return None
+    return state
+
+def _save_checkpoint(checkpoint, state):
+    """Atomically save a `piecewise_hash` checkpoint."""
+    tmpfile = checkpoint + ".tmp"
+    with open(tmpfile, "w", encoding="utf-8") as fileobj:
+        json.dump(state, fileobj)
+    os.replace(tmpfile, checkpoint)
+
+def piecewise_hash(path, piece_size, algorithm="sha1",
+                   chunk_size=DEFAULT_CHUNK_SIZE, checkpoint=None,
+                   show_progress=False, whole=False):
+    """Calculate the digests of consecutive pieces of a file, resumably.
+
+    The file is divided into pieces of ``piece_size`` bytes (the last
+    one possibly shorter), and each piece is digested independently.
+
+    The state of ``hashlib`` hash objects cannot be saved, so hashing a
+    whole file cannot be resumed without re-reading what has already
+    been read. Digesting pieces instead allows an interrupted run to
+    resume after the last completed piece when a ``checkpoint`` file is
+    given: the checkpoint is updated after each piece, and removed once
+    all pieces are done. A checkpoint is only honored if the file (as
+    identified by its path, inode, size and modification time), the
+    algorithm and the piece size match; otherwise, hashing starts
+    over. Resumed runs show the already hashed portion as preprocessed
+    in the progress bar.
+
+    With ``whole=True``, the digest of the whole file is calculated in
+    the same pass, e.g., to check the file against a published
+    checksum. On a resumed run, the prefix covered by the checkpoint is
+    then re-read (but its pieces are not digested again), since the
+    state of the whole-file hash object could not be saved.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file on disk.
+    piece_size : int
+        Size of each piece, in bytes.
+    algorithm : str, optional
+        The hash algorithm to use. Default is ``"sha1"``.
+    chunk_size : int or "auto", optional
+        See `file_hash`. Default is ``DEFAULT_CHUNK_SIZE``.
+    checkpoint : str, optional
+        Path to the checkpoint file. Default is ``None``, i.e., not
+        resumable.
+    show_progress : bool, optional
+        Whether to print progress bar. Default is ``False``.
+    whole : bool, optional
+        Whether to also calculate the digest of the whole file. Default
+        is ``False``.
+
+    Returns
+    -------
+    hexdigests : list
+        Hexadecimal digests of the pieces, in order. The list is empty
+        for an empty file.
+    hexdigest : str
+        Hexadecimal digest of the whole file, equal to that returned by
+        `file_hash`. Only returned (as the second item of a tuple) if
+        ``whole`` is ``True``.
+
+    Raises
+    ------
+    ValueError
+        If the algorithm is unrecognized, or ``piece_size`` is not
+        positive.
+    OSError
+        If there is error reading the file or writing the checkpoint.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile() as fileobj:
+    ...     written = fileobj.write(b"hello, world!\\n")
+    ...     fileobj.flush()
+    ...     piecewise_hash(fileobj.name, 7, "md5") == [
+    ...         file_hash(fileobj.name, "md5", offset=0, length=7),
+    ...         file_hash(fileobj.name, "md5", offset=7, length=7),
+    ...     ]
+    True
+    >>> with tempfile.NamedTemporaryFile() as fileobj:
+    ...     written = fileobj.write(b"hello, world!\\n")
+    ...     fileobj.flush()
+    ...     _, hexdigest = piecewise_hash(fileobj.name, 7, "md5", whole=True)
+    >>> hexdigest
+    '910c8bc73110b0cd1bc5d2bcae782511'
+
+    """
+    # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+    if piece_size <= 0:
+        raise ValueError("piece size must be positive; got %d" % piece_size)
+    hashlib.new(algorithm)
+    with open(path, "rb") as fileobj:
+        filestat = os.fstat(fileobj.fileno())
+        size = filestat.st_size
+        identity = {
+            "path": os.path.abspath(path),
+            "ino": filestat.st_ino,
+            "size": size,
+            "mtime_ns": filestat.st_mtime_ns,
+            "algorithm": algorithm,
+            "piece_size": piece_size,
+        }
+        hexdigests = []
+        if checkpoint is not None:
+            state = _load_checkpoint(checkpoint)
+            if state is not None and state.get("identity") == identity:
+                hexdigests = state["digests"]
+        done = min(len(hexdigests) * piece_size, size)
+
+        if chunk_size == "auto":
+            chunk_size = auto_chunk_size(fileobj, size)
+        show_progress = show_progress and size > 0
+        if show_progress:
+            pbar = zmwangx.pbar.ProgressBar(size, preprocessed=0 if whole else done)
+        if whole:
+            whole_hasher = hashlib.new(algorithm)
+            for chunk in chunks_into(fileobj, chunk_size, length=done):
+                whole_hasher.update(chunk)
+                if show_progress:
+                    pbar.update(len(chunk))
+        fileobj.seek(done)
+        while done < size:
+            hasher = hashlib.new(algorithm)
+            nbytes = 0
+            for chunk in chunks_into(fileobj, chunk_size, length=piece_size):
+                hasher.update(chunk)
+                if whole:
+                    whole_hasher.update(chunk)
+                nbytes += len(chunk)
+                if show_progress:
+                    pbar.update(len(chunk))
+            if nbytes == 0:
+                break  # truncated while reading
+            hexdigests.append(hasher.hexdigest())
+            done += nbytes
+            if checkpoint is not None:
+                _save_checkpoint(checkpoint, {"identity": identity,
+                                              "digests": hexdigests})
+        if show_progress:
+            pbar.finish()
+
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    if whole:
+        return hexdigests, whole_hasher.hexdigest()
+    return hexdigests
+
+# hexdigest length -> algorithm, for manifests without algorithm tags
+_DIGEST_LENGTH_ALGORITHMS = {
+    32: "md5",
+    40: "sha1",
+    56: "sha224",
+    64: "sha256",
+    96: "sha384",
+    128: "sha512",
+}
+
+_BSD_CHECKSUM_LINE = re.compile(
+    r"^(?P<alg>[A-Za-z][\w-]*) \((?P<path>.*)\) = (?P<digest>[0-9a-fA-F]+)$")
+_GNU_CHECKSUM_LINE = re.compile(
+    r"^(?P<digest>[0-9a-fA-F]+) [ *](?P<path>.*)$")
+
+def _tagged_checksum_line(algorithm, hexdigest, path):
+    """Format a BSD-style (``sha256sum --tag``) checksum line."""
+    prefix, path = _escape_checksum_path(path)
+    return "%s%s (%s) = %s" % (prefix, algorithm.upper(), path, hexdigest)
+
+def _parse_checksum_line(line, algorithm=None):
+    """Parse a GNU or BSD style checksum line.
+
+    Parameters
+    ----------
+    line : str
+        Line without the trailing newline.
+    algorithm : str, optional
+        Algorithm of GNU style lines. If ``None``, the algorithm is
+        inferred from the length of the digest.
+
+    Returns
+    -------
+    entry : tuple or None
+        ``(algorithm, path, hexdigest)``, or ``None`` if the line is
+        malformed. As in GNU coreutils, a BSD style line whose algorithm
+        is not supported (or whose digest does not have the length of
+        that algorithm) is considered malformed.
+
+    """
+    escaped = line.startswith("\\")
+    if escaped:
+        line = line[1:]
+    match = _BSD_CHECKSUM_LINE.match(line)
+    if match:
+        alg = match.group("alg").lower()
+        try:
+            digest_size = hashlib.new(alg).digest_size
+        except ValueError:
+            return None
+        if len(match.group("digest")) != 2 * digest_size:
+            return None
+    else:
+        match = _GNU_CHECKSUM_LINE.match(line)
+        if not match:
+            return None
+        alg = algorithm or _DIGEST_LENGTH_ALGORITHMS.get(len(match.group("digest")))
+        if alg is None:
+            return None
+    path = match.group("path")
+    if escaped:
+        path = re.sub(r"\\(.)", lambda m: "\n" if m.group(1) == "n" else m.group(1),
+                      path)
+    return alg, path, match.group("digest").lower()
+
+def _check_manifests(manifests, algorithm, jobs, quiet, backend="thread"):
+    """Check files against manifests. Returns the exit status."""
+    # pylint: disable=too-many-branches,too-many-locals
+    entries = []
+    returncode = 0
+    for manifest in manifests:
+        try:
+            if manifest == "-":
+                lines = sys.stdin.read().splitlines()
+            else:
+                with open(manifest, encoding="utf-8",
+                          errors="surrogateescape") as fileobj:
+                    lines = fileobj.read().splitlines()
+        except OSError as err:
+            cerror("%s: %s" % (manifest, err.strerror))
+            returncode = 1
+            continue
+        nmalformed = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            entry = _parse_checksum_line(line, algorithm)
+            if entry is None:
+                nmalformed += 1
+            else:
+                entries.append(entry)
+        if nmalformed:
+            cwarning("%s: %d line%s improperly formatted" %
+                     (manifest, nmalformed, "s are" if nmalformed > 1 else " is"))
+            returncode = 1
+
+    if not entries:
+        if not returncode:
+            cerror("no properly formatted checksum lines found")
+        return 1
+
+    algorithms = sorted({alg for alg, _, _ in entries})
+    try:
+        _new_hashers(algorithms)
+    except ValueError as err:
+        cerror(str(err))
+        return 1
+
+    nfailed = nunreadable = 0
+    results = hash_many((path for _, path, _ in entries), algorithms,
+                        chunk_size="auto", workers=jobs, backend=backend)
+    for (alg, path, expected), result in zip(entries, results):
+        shown_path = "".join(_escape_checksum_path(path))
+        if result.error is not None:
+            cerror("%s: %s" % (path, result.error.strerror))
+            print("%s: FAILED open or read" % shown_path)
+            nunreadable += 1
+        elif result.hexdigest[alg] != expected:
+            print("%s: FAILED" % shown_path)
+            nfailed += 1
+        elif not quiet:
+            print("%s: OK" % shown_path)
+        sys.stdout.flush()
+
+    if nunreadable:
+        cwarning("%d listed file%s could not be read" %
+                 (nunreadable, "s" if nunreadable > 1 else ""))
+    if nfailed:
+        cwarning("%d computed checksum%s did NOT match" %
+                 (nfailed, "s" if nfailed > 1 else ""))
+    return 1 if returncode or nfailed or nunreadable else 0
+
+def _print_checksums(algorithms, digests, path, tag):
+    """Print checksum lines of a file."""
+    if tag:
+        for alg in algorithms:
+            print(_tagged_checksum_line(alg, digests[alg], path))
+    else:
+        print(_checksum_line(digests[algorithms[0]], path))
+    sys.stdout.flush()
+
+def main():
+    """CLI interface."""
+    description = """Print or check checksums of files, hashing multiple
+    files in parallel. When invoked with no files, or when FILE is -,
+    read standard input."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-a", "--algorithm", action="append",
+                        help="""Hash algorithm, e.g., md5, sha1, or sha256
+                        (default). This option can be specified multiple
+                        times, in which case all digests are calculated in
+                        a single pass, and BSD-style lines are printed (see
+                        --tag). In check mode, this specifies the algorithm
+                        of untagged lines, which is otherwise inferred from
+                        the length of the digest.""")
+    parser.add_argument("-c", "--check", action="store_true",
+                        help="""Read checksums from the FILEs and check
+                        them.""")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="""Number of files to hash in parallel;
+                        default is the number of CPUs.""")
+    parser.add_argument("-P", "--processes", action="store_true",
+                        help="""Hash in worker processes instead of
+                        threads. Useful for algorithms that don't release
+                        the GIL, or for many small files.""")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="""In check mode, don't print OK for each
+                        successfully verified file.""")
+    parser.add_argument("--tag", action="store_true",
+                        help="""Print BSD-style checksum lines, e.g.,
+                        "SHA256 (FILE) = DIGEST".""")
+    parser.add_argument("files", metavar="FILE", nargs="*",
+                        help="""Files to be hashed, or manifests to be
+                        checked.""")
+    args = parser.parse_args()
+    files = args.files if args.files else ["-"]
+    backend = "process" if args.processes else "thread"
+
+    if args.check:
+        algorithm = args.algorithm[0] if args.algorithm else None
+        return _check_manifests(files, algorithm, args.jobs, args.quiet,
+                                backend)
+
+    algorithms = args.algorithm if args.algorithm else ["sha256"]
+    try:
+        _new_hashers(algorithms)
+    except ValueError as err:
+        cerror(str(err))
+        return 1
+    tag = args.tag or len(algorithms) > 1
+
+    returncode = 0
+    # hash regular files in parallel; stdin is hashed in the main
+    # thread, with a progress bar if possible
+    paths = [path for path in files if path != "-"]
+    results = hash_many(paths, algorithms, chunk_size="auto", workers=args.jobs,
+                        backend=backend)
+    for path in files:
+        if path == "-":
+            stdin = sys.stdin.buffer
+            total_size = _fileobj_size(stdin)
+            show_progress = bool(total_size) and zmwangx.pbar.autopbar()
+            digests = _fileobj_hash(stdin, algorithms, "auto",
+                                    show_progress, total_size)
+        else:
+            result = next(results)
+            if result.error is not None:
+                cerror("%s: %s" % (path, result.error.strerror))
+                returncode = 1
+                continue
+            digests = result.hexdigest
+        _print_checksums(algorithms, digests, path, tag)
+    return returncode
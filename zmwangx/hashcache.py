@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+"""Persistent on-disk cache of file digests.
+
+Digests are keyed on the device, inode, size and modification time (in
+nanoseconds) of the file, as well as the hash algorithm, so an entry is
+automatically ignored once the file is replaced or modified. Pass a
+`HashCache` instance to `zmwangx.hash.file_hash` (or
+`zmwangx.hash.hash_many`) to skip reading unchanged files entirely.
+
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 1000000
+"""Default maximum number of entries kept in a `HashCache`."""
+
+_EVICT_INTERVAL = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    algorithm TEXT NOT NULL,
+    hexdigest TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime_ns, algorithm)
+);
+CREATE INDEX IF NOT EXISTS digests_last_used ON digests (last_used);
+"""
+
+def _signed64(number):
+    """Map an unsigned 64-bit integer into SQLite's signed INTEGER range."""
+    return number - (1 << 64) if number >= (1 << 63) else number
+
+def _stat_key(filestat):
+    """(dev, ino, size, mtime_ns) key of an ``os.stat_result``."""
+    return (_signed64(filestat.st_dev), _signed64(filestat.st_ino),
+            filestat.st_size, filestat.st_mtime_ns)
+
+def default_cache_path():
+    """Default location of the cache database.
+
+    The database is located at ``zmwangx/hashcache.sqlite`` within
+    ``$XDG_CACHE_HOME`` (``~/.cache`` if the environment variable is not
+    set).
+
+    Returns
+    -------
+    path : str
+
+    """
+    if "XDG_CACHE_HOME" in os.environ:
+        rootdir = os.environ["XDG_CACHE_HOME"]
+    else:
+        rootdir = os.path.expanduser("~/.cache")
+    return os.path.join(rootdir, "zmwangx", "hashcache.sqlite")
+
+
+class HashCache(object):
+
+    """Persistent digest cache backed by SQLite.
+
+    Instances are safe to share between threads (e.g., the worker
+    threads of `zmwangx.hash.hash_many`).
+
+    The number of entries is bounded by ``max_entries``; least recently
+    used entries are evicted periodically when new entries are added,
+    and when the cache is closed.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to the SQLite database, which is created if it doesn't
+        exist. Default is ``None``, in which case `default_cache_path`
+        is used.
+    max_entries : int, optional
+        Maximum number of entries to keep. Default is
+        ``DEFAULT_MAX_ENTRIES``.
+
+    Attributes
+    ----------
+    path : str
+        Path to the SQLite database.
+    max_entries : int
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> from zmwangx.hash import file_hash
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     path = os.path.join(tmpdir, "hello.txt")
+    ...     with open(path, "wb") as fileobj:
+    ...         written = fileobj.write(b"hello, world!\\n")
+    ...     with HashCache(os.path.join(tmpdir, "cache.sqlite")) as cache:
+    ...         file_hash(path, "md5", cache=cache)  # miss, stored
+    ...         cache.get(os.stat(path), "md5")  # hit
+    '910c8bc73110b0cd1bc5d2bcae782511'
+    '910c8bc73110b0cd1bc5d2bcae782511'
+
+    """
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        """Open (or create) the cache database."""
+        self.path = default_cache_path() if path is None else path
+        self.max_entries = max_entries
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._puts = 0
+        # autocommit mode; each statement is its own transaction
+        self._conn = sqlite3.connect(self.path, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, filestat, algorithm):
+        """Look up the cached digest of a file.
+
+        Parameters
+        ----------
+        filestat : os.stat_result
+            Result of ``os.stat`` or ``os.fstat`` on the file.
+        algorithm : str
+
+        Returns
+        -------
+        hexdigest : str or None
+            None is returned on a cache miss.
+
+        """
+        key = _stat_key(filestat) + (algorithm.lower(),)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hexdigest FROM digests WHERE dev=? AND ino=? AND size=? "
+                "AND mtime_ns=? AND algorithm=?", key).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE digests SET last_used=? WHERE dev=? AND ino=? AND size=? "
+                "AND mtime_ns=? AND algorithm=?", (time.time(),) + key)
+        return row[0]
+
+    def put(self, filestat, algorithm, hexdigest):
+        """Store the digest of a file.
+
+        Parameters
+        ----------
+        filestat : os.stat_result
+            Result of ``os.stat`` or ``os.fstat`` on the file, taken
+            before the file was hashed.
+        algorithm : str
+        hexdigest : str
+
+        """
+        key = _stat_key(filestat) + (algorithm.lower(),)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO digests (dev, ino, size, mtime_ns, "
+                "algorithm, hexdigest, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key + (hexdigest, time.time()))
+            self._puts += 1
+            if self._puts % _EVICT_INTERVAL == 0:
+                self._evict()
+
+    def invalidate(self, path=None):
+        """Remove cached digests.
+
+        Parameters
+        ----------
+        path : str, optional
+            If specified, only remove entries for this file (all
+            versions and algorithms); otherwise, remove all entries.
+            Nothing is removed if ``path`` cannot be stat'ed.
+
+        """
+        with self._lock:
+            if path is None:
+                self._conn.execute("DELETE FROM digests")
+                return
+            try:
+                filestat = os.stat(path)
+            except OSError:
+                return
+            self._conn.execute("DELETE FROM digests WHERE dev=? AND ino=?",
+                               _stat_key(filestat)[:2])
+
+    def evict(self):
+        """Evict least recently used entries in excess of `max_entries`."""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        """Evict entries; the caller must hold the lock."""
+        count, = self._conn.execute("SELECT COUNT(*) FROM digests").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM digests WHERE rowid IN (SELECT rowid FROM digests "
+                "ORDER BY last_used LIMIT ?)", (excess,))
+
+    def close(self):
+        """Evict excess entries and close the database."""
+        self.evict()
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        """Number of entries."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+"""Persistent on-disk cache of HTTP responses.
+
+Response bodies are stored in files, and indexed in an SQLite database
+along with their validators (ETag and Last-Modified). Fresh entries
+(younger than a configurable TTL) are served without a request; stale
+entries are revalidated with a conditional request (If-None-Match and
+If-Modified-Since), and served from the cache on 304 Not Modified. Pass
+an `HTTPCache` instance to `zmwangx.urlgrep.urlgrep` to skip downloading
+unchanged pages.
+
+"""
+
+import collections
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+DEFAULT_MAX_SIZE = 1 << 30
+"""Default maximum total size in bytes of bodies kept in an `HTTPCache`."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    final_url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL,
+    fetched REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+CachedResponse = collections.namedtuple("CachedResponse",
+                                        ["url", "content", "from_cache"])
+CachedResponse.__doc__ = """Response returned by `HTTPCache.fetch`.
+
+Attributes
+----------
+url : str
+    Final URL of the response, after redirection.
+content : bytes
+    Body of the response.
+from_cache : bool
+    Whether the body was served from the cache.
+
+"""
+
+def default_cache_dir():
+    """Default location of the cache.
+
+    The cache is located at ``zmwangx/httpcache`` within
+    ``$XDG_CACHE_HOME`` (``~/.cache`` if the environment variable is not
+    set).
+
+    Returns
+    -------
+    path : str
+
+    """
+    if "XDG_CACHE_HOME" in os.environ:
+        rootdir = os.environ["XDG_CACHE_HOME"]
+    else:
+        rootdir = os.path.expanduser("~/.cache")
+    return os.path.join(rootdir, "zmwangx", "httpcache")
+
+
+class HTTPCache(object):
+
+    """Persistent HTTP response cache backed by SQLite and files.
+
+    Only successful (200) responses to GET requests are stored, unless
+    they have ``Cache-Control: no-store``. Instances are safe to share
+    between threads.
+
+    The total size of stored bodies is bounded by ``max_size``; least
+    recently used entries are evicted when new entries are added.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to the cache directory, which is created if it doesn't
+        exist. Default is ``None``, in which case `default_cache_dir`
+        is used.
+    ttl : float, optional
+        Time in seconds during which a stored response is served without
+        revalidation. Default is 0, i.e., always revalidate.
+    max_size : int, optional
+        Maximum total size of stored bodies, in bytes. Default is
+        ``DEFAULT_MAX_SIZE``.
+
+    Attributes
+    ----------
+    path : str
+        Path to the cache directory.
+    ttl : float
+    max_size : int
+
+    """
+
+    def __init__(self, path=None, ttl=0, max_size=DEFAULT_MAX_SIZE):
+        """Open (or create) the cache."""
+        self.path = default_cache_dir() if path is None else path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._bodies = os.path.join(self.path, "bodies")
+        os.makedirs(self._bodies, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        # autocommit mode; each statement is its own transaction
+        self._conn = sqlite3.connect(os.path.join(self.path, "index.sqlite"),
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _body_path(self, url):
+        """Path to the stored body of a URL."""
+        return os.path.join(self._bodies,
+                            hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+    def _read_body(self, url):
+        """Read the stored body of a URL; None if missing."""
+        try:
+            with open(self._body_path(url), "rb") as fileobj:
+                return fileobj.read()
+        except FileNotFoundError:
+            return None
+
+    def _lookup(self, url):
+        """Look up the entry of a URL, with its body.
+
+        Returns
+        -------
+        entry : tuple or None
+            ``(final_url, etag, last_modified, fetched, body)``, or None
+            if there is no entry or the body is missing.
+
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT final_url, etag, last_modified, fetched FROM responses "
+                "WHERE url=?", (url,)).fetchone()
+        if row is None:
+            return None
+        body = self._read_body(url)
+        if body is None:
+            self.invalidate(url)
+            return None
+        return row + (body,)
+
+    def _touch(self, url, fetched=None):
+        """Update the last used (and optionally fetched) time of an entry."""
+        now = time.time()
+        with self._lock:
+            if fetched is None:
+                self._conn.execute("UPDATE responses SET last_used=? WHERE url=?",
+                                   (now, url))
+            else:
+                self._conn.execute(
+                    "UPDATE responses SET last_used=?, fetched=? WHERE url=?",
+                    (now, fetched, url))
+
+    def _store(self, url, response):
+        """Store a response."""
+        body = response.content
+        bodypath = self._body_path(url)
+        tmpfile = "%s.%d.tmp" % (bodypath, threading.get_ident())
+        with open(tmpfile, "wb") as fileobj:
+            fileobj.write(body)
+        os.replace(tmpfile, bodypath)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (url, final_url, etag, "
+                "last_modified, size, fetched, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, response.url, response.headers.get("ETag"),
+                 response.headers.get("Last-Modified"), len(body), now, now))
+            self._evict()
+
+    def fetch(self, url, session=None, headers=None):
+        """Retrieve a URL through the cache.
+
+        Parameters
+        ----------
+        url : str
+        session : requests.Session, optional
+            If not ``None``, make HTTP requests within this session.
+        headers : dict, optional
+            Additional request headers.
+
+        Returns
+        -------
+        response : CachedResponse
+
+        Raises
+        ------
+        requests.exceptions.RequestException
+            If requests fail to retrieve the URL.
+
+        """
+        entry = self._lookup(url)
+        request_headers = dict(headers) if headers is not None else {}
+        if entry is not None:
+            final_url, etag, last_modified, fetched, body = entry
+            if time.time() - fetched < self.ttl:
+                self._touch(url)
+                return CachedResponse(final_url, body, True)
+            if etag is not None:
+                request_headers["If-None-Match"] = etag
+            if last_modified is not None:
+                request_headers["If-Modified-Since"] = last_modified
+
+        get = requests.get if session is None else session.get
+        response = get(url, headers=request_headers)
+        if response.status_code == 304 and entry is not None:
+            self._touch(url, fetched=time.time())
+            return CachedResponse(final_url, body, True)
+        if (response.status_code == 200 and
+                "no-store" not in response.headers.get("Cache-Control", "")):
+            self._store(url, response)
+        return CachedResponse(response.url, response.content, False)
+
+    def invalidate(self, url=None):
+        """Remove stored responses.
+
+        Parameters
+        ----------
+        url : str, optional
+            If specified, only remove the entry of this URL; otherwise,
+            remove all entries.
+
+        """
+        with self._lock:
+            if url is None:
+                urls = [row[0] for row in
+                        self._conn.execute("SELECT url FROM responses")]
+            else:
+                urls = [url]
+            self._delete(urls)
+
+    def evict(self):
+        """Evict least recently used entries in excess of `max_size`."""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        """Evict entries; the caller must hold the lock."""
+        total, = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_size:
+            return
+        victims = []
+        for url, size in self._conn.execute(
+                "SELECT url, size FROM responses ORDER BY last_used"):
+            if total <= self.max_size:
+                break
+            victims.append(url)
+            total -= size
+        self._delete(victims)
+
+    def _delete(self, urls):
+        """Delete entries and their bodies; the caller must hold the lock."""
+        for url in urls:
+            self._conn.execute("DELETE FROM responses WHERE url=?", (url,))
+            try:
+                os.remove(self._body_path(url))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        """Number of entries."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
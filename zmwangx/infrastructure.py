@@ -3,11 +3,16 @@
 """Shared testing infrastructure."""
 
 from contextlib import contextmanager
+import hashlib
+import http.server
 import io
 import os
 import shutil
+import socketserver
 import sys
 import tempfile
+import threading
+import time
 
 
 class NormalizedStringIO(io.StringIO):
@@ -211,3 +216,75 @@ def change_home():
     for key in ["HOME", "XDG_CONFIG_HOME", "XDG_DATA_HOME", "XDG_CACHE_HOME"]:
         if saved_env_vars[key] is not None:
             os.environ[key] = saved_env_vars[key]
+
+@contextmanager
+def serve_pages(pages, delay=0):
+    """Single use context manager for serving pages over HTTP locally.
+
+    The server runs in a background thread, listening on a random port
+    of 127.0.0.1. Responses carry an ETag (the MD5 digest of the body),
+    and conditional requests with a matching If-None-Match are answered
+    with 304 Not Modified.
+
+    The context manager yields ``(base_url, requests_log)``, where
+    `requests_log` is a list of ``(path, headers)`` of requests received
+    so far.
+
+    Parameters
+    ----------
+    pages : dict
+        Mapping of paths (e.g., ``"/index.html"``) to either a bytes
+        body served as text/html, or a ``(content_type, body)``
+        tuple. The dict may be modified while the server is running;
+        paths not in the dict are answered with 404 Not Found.
+    delay : float or dict, optional
+        Seconds to wait before answering each request, or a mapping of
+        paths to such delays (0 for paths not in the mapping). Default
+        is 0.
+
+    """
+
+    requests_log = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        # pylint: disable=invalid-name,missing-docstring
+
+        def do_GET(self):
+            requests_log.append((self.path, dict(self.headers)))
+            wait = delay.get(self.path, 0) if isinstance(delay, dict) else delay
+            if wait:
+                time.sleep(wait)
+            if self.path not in pages:
+                self.send_error(404)
+                return
+            page = pages[self.path]
+            content_type, body = (("text/html", page) if isinstance(page, bytes)
+                                  else page)
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+
+    server = Server(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield "http://127.0.0.1:%d" % server.server_address[1], requests_log
+    finally:
+        server.shutdown()
+        server.server_close()
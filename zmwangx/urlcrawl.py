@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+
+"""Recursively crawl web pages for URLs.
+
+See `crawl`, or ``urlgrep --crawl`` on the command line.
+
+"""
+
+import collections
+import concurrent.futures
+import json
+import os
+import re
+import time
+import urllib.parse
+
+import requests
+
+import zmwangx.bloom
+from zmwangx.urlgrep import (  # pylint: disable=protected-access
+    _compile_extractors, _compile_pattern, _with_scheme, make_session, urlgrep)
+
+DEFAULT_CHECKPOINT_INTERVAL = 100
+"""Default number of pages crawled between saves of the state file."""
+
+CrawlResult = collections.namedtuple("CrawlResult",
+                                     ["url", "depth", "matching_urls", "error"])
+CrawlResult.__doc__ = """Result of crawling a page.
+
+Attributes
+----------
+url : str
+    URL of the page.
+depth : int
+    Number of links followed from a start URL to the page.
+matching_urls : list
+    Parsed absolute URLs on the page matching the pattern, or ``None``
+    if the page could not be retrieved or parsed.
+error : requests.exceptions.RequestException or ValueError
+    The error encountered when retrieving the page, or when parsing it
+    (e.g., a malformed URL), or ``None``.
+
+"""
+
+
+class _Frontier(object):
+
+    """URLs yet to be crawled, queued per host, and URLs ever queued.
+
+    URLs are deduplicated without their fragments, either exactly, with
+    a set, or approximately, with a `zmwangx.bloom.BloomFilter`. A false
+    positive of the latter means a page is not crawled. URLs added to
+    the set since the last `take_unsaved` are tracked, for incremental
+    checkpoints.
+
+    """
+
+    def __init__(self, bloom=None):
+        """Init."""
+        self._queues = collections.OrderedDict()
+        self._length = 0
+        self.seen = set() if bloom is None else None
+        self.bloom = bloom
+        self._unsaved = []
+
+    def mark_seen(self, url):
+        """Record a URL (without fragment) as queued.
+
+        Returns
+        -------
+        seen : bool
+            Whether the URL has been queued before.
+
+        """
+        if self.bloom is not None:
+            return self.bloom.add(url)
+        if url in self.seen:
+            return True
+        self.seen.add(url)
+        self._unsaved.append(url)
+        return False
+
+    def take_unsaved(self):
+        """URLs added to the exact set of seen URLs since the last call."""
+        unsaved, self._unsaved = self._unsaved, []
+        return unsaved
+
+    def add(self, url, depth):
+        """Queue a URL unless it has been queued before."""
+        url = urllib.parse.urldefrag(url)[0]
+        if not self.mark_seen(url):
+            self.restore(url, depth)
+
+    def restore(self, url, depth):
+        """Queue a URL (without fragment) recorded as queued already."""
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        self._queues.setdefault(host, collections.deque()).append((url, depth))
+        self._length += 1
+
+    def hosts(self):
+        """Hosts with queued URLs."""
+        return list(self._queues)
+
+    def pop(self, available):
+        """Dequeue a URL of the first host for which `available` is true.
+
+        Hosts take turns, so that a host with many queued URLs does not
+        starve the others.
+
+        Returns
+        -------
+        url, depth, host : str, int, str
+            Or None if no host is available.
+
+        """
+        for host, queue in self._queues.items():
+            if available(host):
+                url, depth = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(host)
+                else:
+                    del self._queues[host]
+                self._length -= 1
+                return url, depth, host
+        return None
+
+    def items(self):
+        """All queued ``(url, depth)`` pairs."""
+        return [item for queue in self._queues.values() for item in queue]
+
+    def __len__(self):
+        return self._length
+
+
+class _HostLimiter(object):
+
+    """Per-host limits on concurrent requests and on the request rate."""
+
+    def __init__(self, per_host, delay):
+        """Init."""
+        self.per_host = per_host
+        self.delay = delay
+        self._active = collections.Counter()
+        self._next_time = {}
+
+    def available(self, host, now):
+        """Whether a request to a host may start now."""
+        return (self._active[host] < self.per_host and
+                self._next_time.get(host, 0) <= now)
+
+    def start(self, host, now):
+        """Record the start of a request."""
+        self._active[host] += 1
+        self._next_time[host] = now + self.delay
+
+    def finish(self, host):
+        """Record the end of a request."""
+        self._active[host] -= 1
+        if not self._active[host]:
+            del self._active[host]
+
+    def wait_time(self, hosts, now):
+        """Time until a request to one of the hosts may start.
+
+        None is returned if all hosts are at their concurrency limits.
+
+        """
+        times = [self._next_time.get(host, 0) - now for host in hosts
+                 if self._active[host] < self.per_host]
+        return max(min(times), 0) if times else None
+
+def _fetch(url, session, selector, parser, extractors, deduplicate=True):
+    """Retrieve a page and parse all its URLs.
+
+    Documents that are not HTML according to their Content-Type are not
+    downloaded, and have no URLs.
+
+    """
+    response = session.get(url, stream=True)
+    try:
+        response.raise_for_status()
+        content_type = response.headers.get("content-type", "")
+        if content_type and "html" not in content_type.lower():
+            return []
+        return urlgrep(pattern="", content=response.content, base=response.url,
+                       selector=selector, parser=parser, extractors=extractors,
+                       deduplicate=deduplicate)
+    finally:
+        response.close()
+
+def _load_state(state):
+    """Load a crawl state file; None if missing or corrupt."""
+    try:
+        with open(state, encoding="utf-8") as fileobj:
+            saved = json.load(fileobj)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(saved, dict) or not isinstance(saved.get("frontier"), list):
+        return None
+    return saved
+
+def _load_seen(state):
+    """Load the journal of seen URLs of a crawl state file.
+
+    A trailing line cut short by an interruption is ignored.
+
+    """
+    try:
+        with open(state + ".seen", encoding="utf-8") as fileobj:
+            lines = fileobj.read().split("\n")
+    except FileNotFoundError:
+        return []
+    urls = []
+    # the last item is empty unless the last line is incomplete
+    for line in lines[:-1]:
+        try:
+            urls.append(json.loads(line))
+        except ValueError:
+            pass
+    return urls
+
+def _save_state(state, frontier, in_flight, hosts):
+    """Save a crawl state file (and its Bloom filter or seen URLs).
+
+    Pages being crawled are saved as queued, to be crawled again. The
+    state file and the Bloom filter are replaced atomically, while URLs
+    seen since the last save are appended to a journal (as JSON
+    strings, one per line), so that the cost of a save does not grow
+    with the number of URLs seen. The journal is appended to last: if a
+    save is interrupted, the URLs missing from it are either still
+    queued, or crawled and at worst crawled again.
+
+    """
+    if frontier.bloom is not None:
+        frontier.bloom.save(state + ".bloom")
+    saved = {
+        "hosts": sorted(hosts),
+        "frontier": ([[url, depth] for url, depth, _ in in_flight] +
+                     [[url, depth] for url, depth in frontier.items()]),
+        "bloom": frontier.bloom is not None,
+    }
+    tmpfile = state + ".tmp"
+    with open(tmpfile, "w", encoding="utf-8") as fileobj:
+        json.dump(saved, fileobj)
+    os.replace(tmpfile, state)
+    unsaved = frontier.take_unsaved()
+    if unsaved:
+        with open(state + ".seen", "a", encoding="utf-8") as fileobj:
+            fileobj.write("".join(json.dumps(url) + "\n" for url in unsaved))
+
+def _remove_state(state):
+    """Remove a crawl state file (and its Bloom filter and seen URLs)."""
+    for path in (state, state + ".bloom", state + ".seen"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def crawl(urls, pattern=None, follow=None, max_depth=1, jobs=4, per_host=2,
+          delay=0.0, state=None, bloom_capacity=None, bloom_error_rate=0.001,
+          selector=None, parser="auto", session=None,
+          checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, extractors=None,
+          deduplicate=True):
+    """Crawl web pages recursively, extracting URLs matching a pattern.
+
+    Pages are crawled breadth first (per host) from the start URLs, and
+    URLs matching `pattern` are extracted from each page as in
+    `zmwangx.urlgrep.urlgrep`. Links are followed up to `max_depth`
+    levels deep, if they are in scope: by default, links matching
+    `pattern` on the same hosts as the start URLs; or, if `follow` is
+    specified, links matching `follow`. Only ``http`` and ``https``
+    links are followed, and each page is crawled at most once.
+
+    Up to `jobs` pages are retrieved concurrently, but no more than
+    `per_host` from the same host, and requests to the same host are
+    spaced at least `delay` seconds apart.
+
+    If a `state` file is given, the state of the crawl (the queued
+    URLs) is saved there every `checkpoint_interval` pages and when the
+    crawl is interrupted, and the crawl resumes from it when called
+    again with the same state file (in which case `urls` are ignored).
+    Seen URLs are appended to a journal alongside the state file (with
+    a ``.seen`` suffix), so each save only writes the URLs seen since
+    the previous one. These files are removed once the crawl is
+    complete.
+
+    For very large crawls, the set of seen URLs can be replaced by a
+    Bloom filter (saved alongside the state file, with a ``.bloom``
+    suffix) by specifying `bloom_capacity`. Note that a false positive
+    means a page is not crawled. A state saved with a Bloom filter can
+    only be resumed with one.
+
+    Parameters
+    ----------
+    urls : list of str
+        Start URLs. "http://" is attached if the scheme is left out.
+    pattern : str or zmwangx.urlgrep.PatternSet, optional
+        See `zmwangx.urlgrep.urlgrep`. Default is
+        ``r"^(?!javascript:)"``.
+    follow : str, optional
+        Regex pattern of links to follow. See above for the default.
+    max_depth : int, optional
+        Maximum number of links followed from a start URL. 0 means only
+        crawling the start URLs. Default is 1.
+    jobs : int, optional
+        Maximum number of concurrent requests. Default is 4.
+    per_host : int, optional
+        Maximum number of concurrent requests to the same host. Default
+        is 2.
+    delay : float, optional
+        Minimum interval between requests to the same host, in
+        seconds. Default is 0.
+    state : str, optional
+        Path to the state file. Default is ``None``, i.e., the crawl is
+        not resumable.
+    bloom_capacity : int, optional
+        Expected number of URLs seen; see above. Default is ``None``,
+        i.e., deduplicate URLs exactly.
+    bloom_error_rate : float, optional
+        False positive rate of the Bloom filter. Default is 0.001.
+    selector : str, optional
+        See `zmwangx.urlgrep.urlgrep`. Only the selected parts of pages
+        are searched for URLs, including the URLs followed.
+    parser : str, optional
+        See `zmwangx.urlgrep.urlgrep`. Default is ``"auto"``.
+    session : requests.Session, optional
+        Default is ``None``, in which case a session is created with
+        `zmwangx.urlgrep.make_session`.
+    checkpoint_interval : int, optional
+        Default is ``DEFAULT_CHECKPOINT_INTERVAL``.
+    extractors : zmwangx.urlgrep.ExtractorSet or list, optional
+        See `zmwangx.urlgrep.urlgrep`. URLs found by the extractors are
+        followed too.
+    deduplicate : bool, optional
+        Whether to deduplicate the matching URLs of each page. See
+        `zmwangx.urlgrep.urlgrep`. Default is ``True``. Pages are
+        crawled at most once regardless.
+
+    Returns
+    -------
+    results : generator
+        Generator of `CrawlResult` named tuples, in the order pages are
+        crawled.
+
+    Raises
+    ------
+    ValueError
+        If there is neither a start URL nor a state file to resume from,
+        if the state file was saved with a Bloom filter but
+        `bloom_capacity` is not given (or the filter cannot be loaded),
+        if a numeric parameter is out of range, or if an extractor is
+        not registered.
+
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    if jobs < 1 or per_host < 1:
+        raise ValueError("jobs and per_host must be positive")
+    if delay < 0:
+        raise ValueError("delay must be nonnegative")
+    saved = _load_state(state) if state is not None else None
+    if not urls and saved is None:
+        raise ValueError("no start URL, and no state to resume from")
+
+    saved_bloom = saved is not None and saved.get("bloom")
+    if saved_bloom and bloom_capacity is None:
+        raise ValueError("the crawl state '%s' was saved with a Bloom filter, "
+                         "which is required to resume" % state)
+    bloom = None
+    if saved_bloom:
+        try:
+            bloom = zmwangx.bloom.BloomFilter.load(state + ".bloom")
+        except OSError as err:
+            raise ValueError("cannot load the Bloom filter of the crawl state "
+                             "'%s': %s" % (state, err.strerror))
+    elif bloom_capacity is not None:
+        bloom = zmwangx.bloom.BloomFilter(bloom_capacity, bloom_error_rate)
+    frontier = _Frontier(bloom)
+    if saved is not None:
+        hosts = set(saved.get("hosts") or [])
+        # URLs seen with a Bloom filter are in the filter; the journal
+        # only has those seen before switching to one, if any
+        for url in _load_seen(state):
+            frontier.mark_seen(url)
+        frontier.take_unsaved()  # already in the journal
+        for url, depth in saved["frontier"]:
+            frontier.mark_seen(url)
+            frontier.restore(url, depth)
+    else:
+        if state is not None:
+            _remove_state(state)  # corrupt, or leftovers of a stale crawl
+        urls = [_with_scheme(url) for url in urls]
+        hosts = {urllib.parse.urlsplit(url).netloc.lower() for url in urls}
+        for url in urls:
+            frontier.add(url, 0)
+
+    regex = _compile_pattern(pattern)
+    follow_regex = re.compile(follow) if follow is not None else None
+
+    def in_scope(link):
+        """Whether a link should be followed."""
+        link = urllib.parse.urldefrag(link)[0]
+        parsed = urllib.parse.urlsplit(link)
+        if parsed.scheme not in ("http", "https"):
+            return False
+        if follow_regex is not None:
+            return bool(follow_regex.search(link))
+        return bool(regex.search(link)) and parsed.netloc.lower() in hosts
+
+    return _crawl(frontier, hosts, regex, in_scope, max_depth, jobs,
+                  _HostLimiter(per_host, delay), state, selector, parser,
+                  session, checkpoint_interval, _compile_extractors(extractors),
+                  deduplicate)
+
+def _crawl(frontier, hosts, regex, in_scope, max_depth, jobs, limiter, state,
+           selector, parser, session, checkpoint_interval, extractors,
+           deduplicate):
+    """Generator behind `crawl`, which validates eagerly."""
+    # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+    own_session = session is None
+    if own_session:
+        session = make_session(jobs)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    in_flight = collections.OrderedDict()
+    crawled = 0
+    complete = False
+    try:
+        while True:
+            now = time.monotonic()
+            while len(in_flight) < jobs:
+                item = frontier.pop(lambda host: limiter.available(host, now))
+                if item is None:
+                    break
+                url, depth, host = item
+                limiter.start(host, now)
+                future = executor.submit(_fetch, url, session, selector, parser,
+                                         extractors, deduplicate)
+                in_flight[future] = (url, depth, host)
+
+            if not in_flight:
+                if not frontier:
+                    break
+                time.sleep(limiter.wait_time(frontier.hosts(), now))
+                continue
+
+            # with a free slot, wake up when a queued host becomes
+            # available; otherwise, only a completed page frees a slot
+            timeout = (limiter.wait_time(frontier.hosts(), now)
+                       if frontier and len(in_flight) < jobs else None)
+            done, _ = concurrent.futures.wait(
+                list(in_flight), timeout=timeout,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                url, depth, host = in_flight.pop(future)
+                limiter.finish(host)
+                try:
+                    links = future.result()
+                except (requests.exceptions.RequestException, ValueError) as err:
+                    # e.g., a malformed URL on the page; other pages go on
+                    yield CrawlResult(url, depth, None, err)
+                    continue
+                if depth < max_depth:
+                    for link in links:
+                        if in_scope(link):
+                            frontier.add(link, depth + 1)
+                yield CrawlResult(url, depth,
+                                  [link for link in links if regex.search(link)],
+                                  None)
+                crawled += 1
+                if state is not None and crawled % checkpoint_interval == 0:
+                    _save_state(state, frontier, in_flight.values(), hosts)
+        complete = True
+    finally:
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=True)
+        if own_session:
+            session.close()
+        if state is not None:
+            if complete:
+                _remove_state(state)
+            else:
+                _save_state(state, frontier, in_flight.values(), hosts)
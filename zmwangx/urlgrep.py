@@ -3,12 +3,24 @@
 """Extract URLs from HTML documents."""
 
 import argparse
+import codecs
+import collections
+import concurrent.futures
+import functools
+import html.parser
+import io
 import re
 import sys
+import threading
 import urllib.parse
 
 import bs4
 import requests
+import requests.adapters
+
+import zmwangx.bloom
+import zmwangx.hash
+import zmwangx.httpcache
 
 _TAG_ATTRS = {
     'a': {'href'},
@@ -46,12 +58,986 @@ The data are scraped from w3schools.com on 2015-05-09.
 
 """
 
+_URL_SCHEME = re.compile(r"^\w+://")
+
+ENCODING_SNIFF_SIZE = 1024
+"""Number of leading bytes searched for an encoding declaration.
+
+Used by `iter_urlgrep`; this is the limit in the HTML5 specification.
+
+"""
+
 # disguise as Microsoft Edge, because apparently some servers are not
 # thrilled to see python-requests in the UA string
 REQUEST_HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/42.0.2311.135 Safari/537.36 Edge/12.10240"}
 
+PARSERS = ("auto", "stream", "html.parser", "lxml", "html5lib")
+"""Parser backends recognized by `urlgrep`.
+
+* ``"stream"``: a streaming parser based on ``html.parser.HTMLParser``
+  that only looks at the tags in `_TAG_ATTRS`, without building a
+  tree. It does not support selectors.
+* ``"html.parser"``, ``"lxml"``, ``"html5lib"``: BeautifulSoup with the
+  respective tree builder. ``lxml`` and ``html5lib`` must be installed
+  separately, and they may repair malformed documents differently.
+* ``"auto"``: ``"stream"`` if there is no selector, and
+  ``"html.parser"`` otherwise, so that the results do not depend on
+  which libraries are installed.
+
+"""
+
+# constructs that do not survive being embedded in a combined pattern:
+# numbered backreferences (and conditionals), and global inline flags
+_UNCOMBINABLE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)")
+
+
+class PatternSet(object):
+
+    """A set of (optionally named) regex patterns, matched in one pass.
+
+    The patterns are combined into one alternation, which is used to
+    reject URLs matching none of the patterns with a single search.
+    Patterns that cannot be safely combined (those with numbered
+    backreferences or global inline flags like ``(?i)``) are searched
+    separately. Objects of this class can be used as the `pattern` of
+    `urlgrep`, in which case URLs matching any of the patterns match.
+
+    Parameters
+    ----------
+    patterns : list or dict
+        A list of patterns (each named by itself) or ``(name,
+        pattern)`` pairs, or a dict mapping names to patterns.
+
+    Attributes
+    ----------
+    names : list
+        Names of the rules, in order.
+
+    Raises
+    ------
+    re.error
+        If a pattern is invalid.
+
+    Examples
+    --------
+    >>> rules = PatternSet([("images", r"\\.(png|jpe?g)$"),
+    ...                     ("example", r"example\\.com")])
+    >>> rules.match("http://example.com/a.png")
+    ['images', 'example']
+    >>> rules.search("http://example.org/"), rules.match("http://example.org/")
+    (False, [])
+
+    """
+
+    def __init__(self, patterns):
+        """Init."""
+        if isinstance(patterns, dict):
+            items = list(patterns.items())
+        else:
+            items = [(pattern, pattern) if isinstance(pattern, str) else tuple(pattern)
+                     for pattern in patterns]
+        self.names = [name for name, _ in items]
+        self._rules = [(name, re.compile(pattern)) for name, pattern in items]
+        combinable = [pattern for _, pattern in items
+                      if not _UNCOMBINABLE.search(pattern)]
+        self._separate = [(name, re.compile(pattern)) for name, pattern in items
+                          if _UNCOMBINABLE.search(pattern)]
+        self._combined = None
+        if combinable:
+            try:
+                self._combined = re.compile("|".join("(?:%s)" % pattern
+                                                     for pattern in combinable))
+            except re.error:
+                # e.g., the same group name in different patterns
+                self._separate = self._rules
+
+    @classmethod
+    def from_file(cls, path):
+        """Load patterns from a file.
+
+        Each line of the file is either a pattern, or a name and a
+        pattern separated by a tab. Empty lines and lines starting with
+        ``#`` are ignored.
+
+        Parameters
+        ----------
+        path : str
+
+        Returns
+        -------
+        patternset : PatternSet
+
+        Raises
+        ------
+        OSError
+            If failed to read the file.
+        re.error
+            If a pattern is invalid.
+
+        """
+        items = []
+        with open(path, encoding="utf-8") as fileobj:
+            for line in fileobj:
+                line = line.rstrip("\r\n")
+                if not line or line.startswith("#"):
+                    continue
+                name, tab, pattern = line.partition("\t")
+                items.append((name, pattern) if tab else (line, line))
+        return cls(items)
+
+    def search(self, url):
+        """Whether a URL matches any of the patterns."""
+        if self._combined is not None and self._combined.search(url):
+            return True
+        return any(regex.search(url) for _, regex in self._separate)
+
+    def match(self, url):
+        """Names of the rules matching a URL, in order."""
+        if self._combined is not None and self._combined.search(url):
+            rules = self._rules
+        else:
+            rules = self._separate
+        return [name for name, regex in rules if regex.search(url)]
+
+    def __len__(self):
+        """Number of rules."""
+        return len(self._rules)
+
+def _compile_pattern(pattern):
+    """Compile the `pattern` argument of `urlgrep` and friends.
+
+    Returns
+    -------
+    regex : re.RegexObject or PatternSet
+        Either way, with a ``search`` method.
+
+    """
+    if pattern is None:
+        return re.compile(r"^(?!javascript:)")
+    if isinstance(pattern, str):
+        return re.compile(pattern)
+    if isinstance(pattern, (list, tuple, dict)):
+        return PatternSet(pattern)
+    return pattern
+
+def make_session(pool_size=10):
+    """Create a session suitable for concurrent requests.
+
+    The session sends ``REQUEST_HEADERS``, and keeps up to `pool_size`
+    connections alive per host, for up to `pool_size` hosts, so that
+    `pool_size` threads can share it without opening new connections
+    for every request.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Default is 10.
+
+    Returns
+    -------
+    session : requests.Session
+
+    """
+    session = requests.Session()
+    session.headers.update(REQUEST_HEADERS)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# printable ASCII except the characters that urllib.parse treats
+# specially (brackets for IPv6 hosts, backslash, and ";" for params)
+_PLAIN_URL = re.compile(r"[!-:<-Z^-~]*\Z")
+_SCHEME_PREFIX = re.compile(r"([A-Za-z][A-Za-z0-9+.-]*):")
+_DOT_SEGMENT = re.compile(r"(?:^|/)\.\.?(?:/|\Z)")
+
+
+class URLResolver(object):
+
+    """Resolve URLs against a fixed base URL.
+
+    ``URLResolver(base).resolve(url)`` is equivalent to
+    ``urllib.parse.urljoin(base, url)``, but the base URL is parsed only
+    once. Absolute URLs, network-path references (``//host/path``),
+    absolute paths and plain relative paths (without dot segments) are
+    resolved by string concatenation; anything else, e.g., ``../x``,
+    ``?query``, or URLs with unusual characters, falls back to
+    ``urljoin``.
+
+    Parameters
+    ----------
+    base : str
+        The base URL.
+
+    Examples
+    --------
+    >>> resolver = URLResolver("http://example.com/dir/page.html")
+    >>> resolver.resolve("other.html")
+    'http://example.com/dir/other.html'
+    >>> resolver.resolve("//cdn.example.com/app.js")
+    'http://cdn.example.com/app.js'
+    >>> resolver.resolve("../up.html")
+    'http://example.com/up.html'
+
+    """
+
+    def __init__(self, base):
+        """Init."""
+        self.base = base
+        # _prefix is None when the fast paths are unsafe for the base
+        self._scheme = self._prefix = self._dir = None
+        if not base or not _PLAIN_URL.match(base):
+            return
+        try:
+            scheme, netloc, path, _, _ = urllib.parse.urlsplit(base)
+        except ValueError:
+            return
+        if (not scheme or not netloc or
+                scheme not in urllib.parse.uses_relative or
+                scheme not in urllib.parse.uses_netloc):
+            return
+        self._scheme = scheme
+        self._prefix = "%s://%s" % (scheme, netloc)
+        if not path:
+            self._dir = "/"
+        elif "//" not in path and not _DOT_SEGMENT.search(path):
+            self._dir = path[:path.rfind("/") + 1]
+
+    def resolve(self, url):
+        """Resolve a URL.
+
+        Parameters
+        ----------
+        url : str
+
+        Returns
+        -------
+        url : str
+            The absolute URL.
+
+        """
+        # empty queries and fragments are dropped by urljoin
+        head = url.partition("#")[0]
+        if (self._prefix is None or not url or url[-1] == "#" or
+                head[-1:] == "?" or not _PLAIN_URL.match(url)):
+            return urllib.parse.urljoin(self.base, url)
+        path = head.partition("?")[0]
+
+        if url[0] == "/":
+            if url[1:2] == "/":
+                # network-path reference with a nonempty host
+                if url[2:3] not in ("", "/", "?", "#"):
+                    return "%s:%s" % (self._scheme, url)
+            elif "//" not in path and not _DOT_SEGMENT.search(path):
+                return self._prefix + url
+        elif url[0] not in ("?", "#"):
+            match = _SCHEME_PREFIX.match(url)
+            if match is not None:
+                scheme = match.group(1).lower()
+                rest = url[match.end():]
+                if (scheme != self._scheme or
+                        scheme not in urllib.parse.uses_relative):
+                    # older versions of urllib.parse take "host:80" as a
+                    # path with a port rather than a scheme
+                    if not rest.isdigit():
+                        return url
+                elif (url.startswith(self._scheme + "://") and
+                      rest[2:3] not in ("", "/", "?", "#")):
+                    return url
+            elif (self._dir is not None and "//" not in path and
+                  not _DOT_SEGMENT.search(path)):
+                return self._prefix + self._dir + url
+        return urllib.parse.urljoin(self.base, url)
+
+
+class Extractor(object):
+
+    """Source of URLs beyond the attributes in `_TAG_ATTRS`.
+
+    An extractor looks at certain attributes (of any tag), and/or the
+    text content of certain raw text elements (``<style>`` and
+    ``<script>``), and pulls raw, possibly relative URLs out of them.
+    Extractors are registered with `register_extractor`, and combined
+    with `ExtractorSet`.
+
+    Parameters
+    ----------
+    attributes : iterable of str, optional
+        Names of attributes to look at.
+    extract_attribute : callable, optional
+        Called as ``extract_attribute(tag, attribute, value, attrs)``
+        for each tag with one of the `attributes`, where `attrs` is the
+        dict of all attributes of the tag; returns an iterable of URLs.
+    text_tags : iterable of str, optional
+        Names of raw text elements to look at.
+    extract_text : callable, optional
+        Called as ``extract_text(tag, text)`` for each of the
+        `text_tags`; returns an iterable of URLs.
+
+    """
+
+    def __init__(self, attributes=(), extract_attribute=None, text_tags=(),
+                 extract_text=None):
+        """Init."""
+        self.attributes = tuple(attributes)
+        self.extract_attribute = extract_attribute
+        self.text_tags = tuple(text_tags)
+        self.extract_text = extract_text
+
+_SRCSET_URL = re.compile(r"[\s,]*(\S+)")
+_CSS_URL = re.compile(r"""url\(\s*(?:"([^"]*)"|'([^']*)'|([^)\s]*))\s*\)"""
+                      r"""|@import\s+(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+_REFRESH_URL = re.compile(r"\s*[\d.]*\s*[;,]?\s*(?:url\s*=\s*)?(.*)",
+                          re.IGNORECASE | re.DOTALL)
+
+def _srcset_urls(value):
+    """URLs of the image candidates in a ``srcset``."""
+    urls = []
+    position = 0
+    while True:
+        match = _SRCSET_URL.match(value, position)
+        if match is None:
+            return urls
+        url = match.group(1)
+        position = match.end()
+        if url.endswith(","):
+            url = url.rstrip(",")
+        else:
+            # skip the descriptors
+            comma = value.find(",", position)
+            position = len(value) if comma == -1 else comma + 1
+        if url:
+            urls.append(url)
+
+def _css_urls(css):
+    """URLs in ``url()`` and ``@import`` of a stylesheet."""
+    urls = []
+    for groups in _CSS_URL.findall(css):
+        url = "".join(groups).strip()
+        if url:
+            urls.append(url)
+    return urls
+
+def _extract_srcset(tag, attribute, value, attrs):
+    """``srcset`` of ``<img>`` and ``<source>``."""
+    # pylint: disable=unused-argument
+    return _srcset_urls(value) if tag in ("img", "source") else ()
+
+def _extract_style_attribute(tag, attribute, value, attrs):
+    """URLs in a ``style`` attribute."""
+    # pylint: disable=unused-argument
+    return _css_urls(value)
+
+def _extract_style_text(tag, text):
+    """URLs in a ``<style>`` element."""
+    # pylint: disable=unused-argument
+    return _css_urls(text)
+
+def _extract_meta_refresh(tag, attribute, value, attrs):
+    """URL of ``<meta http-equiv="refresh" content="0; url=...">``."""
+    # pylint: disable=unused-argument
+    if tag != "meta" or (attrs.get("http-equiv") or "").lower() != "refresh":
+        return ()
+    url = _REFRESH_URL.match(value).group(1).strip()
+    if url[:1] in ("'", '"'):
+        url = url[1:].partition(url[0])[0]
+    return (url,) if url else ()
+
+def _extract_data_src(tag, attribute, value, attrs):
+    """Lazy loading attributes, e.g., ``data-src``."""
+    # pylint: disable=unused-argument
+    if attribute == "data-srcset":
+        return _srcset_urls(value)
+    return (value,) if value else ()
+
+EXTRACTORS = collections.OrderedDict([
+    ("srcset", Extractor(attributes=["srcset"], extract_attribute=_extract_srcset)),
+    ("css", Extractor(attributes=["style"], extract_attribute=_extract_style_attribute,
+                      text_tags=["style"], extract_text=_extract_style_text)),
+    ("meta-refresh", Extractor(attributes=["content"],
+                               extract_attribute=_extract_meta_refresh)),
+    ("data-src", Extractor(attributes=["data-src", "data-original", "data-lazy-src",
+                                       "data-srcset"],
+                           extract_attribute=_extract_data_src)),
+])
+"""Registered extractors by name, in the order they are applied.
+
+* ``"srcset"``: image candidates in ``srcset`` of ``<img>`` and
+  ``<source>``.
+* ``"css"``: ``url()`` and ``@import`` in ``style`` attributes and
+  ``<style>`` elements.
+* ``"meta-refresh"``: the URL of ``<meta http-equiv="refresh">``.
+* ``"data-src"``: lazy loading attributes ``data-src``,
+  ``data-original``, ``data-lazy-src`` and ``data-srcset``.
+
+"""
+
+def register_extractor(name, extractor):
+    """Register an extractor, replacing any extractor of the same name.
+
+    Parameters
+    ----------
+    name : str
+    extractor : Extractor
+
+    """
+    EXTRACTORS[name] = extractor
+
+
+class ExtractorSet(object):
+
+    """Registered extractors, compiled for a single pass over documents.
+
+    The extractors are looked up once, and indexed by the attributes and
+    tags they look at, so that each tag of a document is handed to the
+    relevant extractors only, during the same pass that collects URLs in
+    `_TAG_ATTRS`. Objects of this class (or the names to construct one
+    from) can be used as the `extractors` of `urlgrep`.
+
+    Parameters
+    ----------
+    names : iterable of str or str, optional
+        Names of registered extractors (see `EXTRACTORS`), or a string
+        of comma separated names, or ``"all"``. Default is ``"all"``.
+
+    Attributes
+    ----------
+    names : tuple
+        Names of the extractors, in order.
+
+    Raises
+    ------
+    ValueError
+        If an extractor is not registered.
+
+    Examples
+    --------
+    >>> urlgrep(content='<img src="a.png" srcset="b.png 2x, c.png 3x">',
+    ...         base="example.com", extractors=ExtractorSet(["srcset"]))
+    ['http://example.com/a.png', 'http://example.com/b.png', 'http://example.com/c.png']
+
+    """
+
+    def __init__(self, names="all"):
+        """Init."""
+        if isinstance(names, str):
+            names = list(EXTRACTORS) if names == "all" else names.split(",")
+        self.names = tuple(names)
+        self._by_attribute = {}
+        self._by_text_tag = {}
+        for name in self.names:
+            if name not in EXTRACTORS:
+                raise ValueError("unrecognized extractor '%s'" % name)
+            extractor = EXTRACTORS[name]
+            for attribute in extractor.attributes:
+                self._by_attribute.setdefault(attribute, []).append(
+                    extractor.extract_attribute)
+            for tag in extractor.text_tags:
+                self._by_text_tag.setdefault(tag, []).append(extractor.extract_text)
+
+    def has_text(self, tag):
+        """Whether the text content of a tag is looked at."""
+        return tag in self._by_text_tag
+
+    def tag_entries(self, tag, attrs):
+        """Extract ``(tag, attribute, url)`` tuples from attributes.
+
+        URLs are not resolved. `attrs` is a dict of attributes.
+
+        """
+        entries = []
+        by_attribute = self._by_attribute
+        for attribute, value in attrs.items():
+            extracts = by_attribute.get(attribute)
+            if extracts is not None:
+                for extract in extracts:
+                    entries.extend((tag, attribute, url)
+                                   for url in extract(tag, attribute, value, attrs))
+        return entries
+
+    def text_entries(self, tag, text):
+        """Extract ``(tag, None, url)`` tuples from text content.
+
+        URLs are not resolved.
+
+        """
+        entries = []
+        for extract in self._by_text_tag.get(tag, ()):
+            entries.extend((tag, None, url) for url in extract(tag, text))
+        return entries
+
+def _compile_extractors(extractors):
+    """Compile the `extractors` argument of `urlgrep` and friends."""
+    if extractors is None or isinstance(extractors, ExtractorSet):
+        return extractors
+    return ExtractorSet(extractors)
+
+
+# tags closed as soon as they are opened by BeautifulSoup's tree builders
+_VOID_TAGS = frozenset(bs4.builder.HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS)
+
+
+class _StreamParser(html.parser.HTMLParser):
+
+    """HTML parser collecting URLs in `_TAG_ATTRS`, without a tree.
+
+    The results agree with those from the tree built by BeautifulSoup's
+    ``html.parser`` builder, in particular when it comes to the base URL
+    (the first ``<base>`` within the first ``<head>``): until the base
+    URL is settled, the stack of open tags is tracked the way the tree
+    builder does (an end tag closes the most recent open tag of the same
+    name, and all tags opened after it; unmatched end tags are ignored),
+    so that the end of ``<head>`` is found in malformed documents too.
+
+    The one divergence is that the base URL is settled no later than
+    the start of ``<body>``, as in browsers, whereas the tree builder
+    also honors a ``<base>`` after ``<body>`` if ``<head>`` is still
+    open (e.g., never closed), or if ``<head>`` only starts after
+    ``<body>``.
+
+    URLs are held back until the base URL is settled, then resolved;
+    retrieve them with `pop`.
+
+    Parameters
+    ----------
+    base : str
+        Base URL in absence of a ``<base>`` tag.
+    extractors : ExtractorSet, optional
+        Additional extractors applied to each tag.
+
+    """
+
+    _BEFORE_HEAD, _IN_HEAD, _SETTLED = range(3)
+
+    def __init__(self, base, extractors=None):
+        """Init."""
+        super().__init__(convert_charrefs=True)
+        self.base = base
+        self.extractors = extractors
+        self._state = self._BEFORE_HEAD
+        # open tags before the base URL is settled, and the position of
+        # the first <head> among them
+        self._open = []
+        self._head_index = None
+        self._pending = []
+        self._resolved = []
+        # raw text element looked at by the extractors, and its text
+        self._text_tag = None
+        self._text = []
+
+    def _settle(self, base=None):
+        """Settle the base URL, and resolve URLs held back."""
+        if self._state == self._SETTLED:
+            return
+        self._state = self._SETTLED
+        self._open = []
+        if base is not None:
+            self.base = base
+        self._resolve = URLResolver(self.base).resolve
+        self._resolved.extend((tag, attribute, self._resolve(value))
+                              for tag, attribute, value in self._pending)
+        self._pending = []
+
+    def _collect(self, entries):
+        """Resolve entries, or hold them back until the base is settled."""
+        if self._state == self._SETTLED:
+            resolve = self._resolve
+            self._resolved.extend((tag, attribute, resolve(value))
+                                  for tag, attribute, value in entries)
+        else:
+            self._pending.extend(entries)
+
+    def handle_starttag(self, tag, attrs):
+        """Collect URLs of a start tag."""
+        if self._state != self._SETTLED:
+            if tag == "head" and self._state == self._BEFORE_HEAD:
+                self._state = self._IN_HEAD
+                self._head_index = len(self._open)
+            elif tag == "base" and self._state == self._IN_HEAD:
+                for name, value in reversed(attrs):
+                    if name == "href":
+                        self._settle(value if value is not None else "")
+                        break
+                else:
+                    self._settle()
+            elif tag == "body":
+                self._settle()
+            if self._state != self._SETTLED and tag not in _VOID_TAGS:
+                self._open.append(tag)
+
+        attributes = _TAG_ATTRS.get(tag)
+        if attributes is None and self.extractors is None:
+            return
+        # with duplicate attributes, the last one wins
+        attrs = {name: value if value is not None else "" for name, value in attrs}
+        if attributes is not None:
+            self._collect([(tag, attribute, attrs[attribute])
+                           for attribute in attributes if attribute in attrs])
+        if self.extractors is not None:
+            self._collect(self.extractors.tag_entries(tag, attrs))
+            if self.extractors.has_text(tag):
+                self._flush_text()
+                self._text_tag = tag
+
+    def handle_data(self, data):
+        """Collect the text of a raw text element for the extractors."""
+        if self._text_tag is not None:
+            self._text.append(data)
+
+    def _flush_text(self):
+        """Hand the collected text to the extractors."""
+        if self._text_tag is not None:
+            self._collect(self.extractors.text_entries(self._text_tag,
+                                                       "".join(self._text)))
+            self._text_tag = None
+            self._text = []
+
+    def handle_endtag(self, tag):
+        """Settle the base URL at the end of ``<head>``."""
+        if tag == self._text_tag:
+            self._flush_text()
+        if self._state != self._SETTLED and tag in self._open:
+            index = len(self._open) - 1 - self._open[::-1].index(tag)
+            del self._open[index:]
+            if self._state == self._IN_HEAD and index <= self._head_index:
+                self._settle()
+
+    def close(self):
+        """Process remaining data, and settle the base URL."""
+        super().close()
+        self._flush_text()
+        self._settle()
+
+    def pop(self):
+        """Retrieve and forget the URLs resolved so far.
+
+        Returns
+        -------
+        urls : list
+            List of ``(tag, attribute, url)`` tuples.
+
+        """
+        resolved = self._resolved
+        self._resolved = []
+        return resolved
+
+def _select_parser(parser, selector):
+    """Resolve the ``"auto"`` parser, and check the combination."""
+    if parser not in PARSERS:
+        raise ValueError("unrecognized parser '%s'" % parser)
+    if parser == "auto":
+        if selector is None:
+            return "stream"
+        return "html.parser"
+    if parser == "stream" and selector is not None:
+        raise ValueError("the stream parser does not support selectors")
+    return parser
+
+def _stream_urls(content, base, extractors=None):
+    """Extract ``(tag, attribute, url)`` tuples with `_StreamParser`."""
+    if isinstance(content, bytes):
+        # same encoding detection as BeautifulSoup
+        content = bs4.UnicodeDammit(content, is_html=True).unicode_markup
+    parser = _StreamParser(base, extractors)
+    parser.feed(content)
+    parser.close()
+    return parser.pop()
+
+def _make_soup(content, base, parser):
+    """Parse a document with BeautifulSoup.
+
+    Returns
+    -------
+    soup, base : bs4.BeautifulSoup, str
+        The base URL may be modified by the HTML ``<base>`` tag.
+
+    """
+    soup = bs4.BeautifulSoup(content, parser)
+
+    # base URL might be modified by the HTML <base> tag, which must
+    # reside inside <head>
+    if soup.head and soup.head.base and "href" in soup.head.base.attrs:
+        base = soup.head.base["href"]
+    return soup, base
+
+def _soup_urls(soup, base, selector, extractors=None):
+    """Extract ``(tag, attribute, url)`` tuples from a soup."""
+    # select part of the soup with the optional selector
+    selections = [soup] if selector is None else soup.select(selector)
+
+    resolve = URLResolver(base).resolve
+    urls = []
+    for selection in selections:
+        for tag in selection.descendants:
+            attributes = _TAG_ATTRS.get(tag.name)
+            if attributes is not None:
+                for attribute in attributes:
+                    if attribute in tag.attrs:
+                        urls.append((tag.name, attribute, resolve(tag[attribute])))
+            if extractors is not None and tag.name is not None:
+                entries = extractors.tag_entries(tag.name, tag.attrs)
+                if extractors.has_text(tag.name):
+                    entries += extractors.text_entries(
+                        tag.name, "".join(child for child in tag.children
+                                          if isinstance(child, bs4.NavigableString)))
+                urls.extend((name, attribute, resolve(value))
+                            for name, attribute, value in entries)
+    return urls
+
+
+class DocumentIndex(object):
+
+    """Parsed HTML document, for answering many queries cheaply.
+
+    The document is parsed at most once per kind of query: URLs of the
+    whole document are extracted and resolved once, and ``(tag,
+    attribute, url)`` tuples are kept in `entries`; the tree for selector
+    queries is built at most once (unless the parser is ``"stream"``,
+    which does not support selectors), and results are kept for each
+    selector.
+
+    Parameters
+    ----------
+    content : bytes or str
+        An HTML document.
+    base : str, optional
+        Base URL; see `urlgrep`.
+    parser : str, optional
+        Parser backend, one of `PARSERS`. Default is ``"auto"``.
+    extractors : ExtractorSet or list, optional
+        Additional extractors; see `urlgrep`.
+
+    Attributes
+    ----------
+    base : str
+        Base URL, in absence of a ``<base>`` tag.
+    parser : str
+    extractors : ExtractorSet or None
+
+    Examples
+    --------
+    >>> index = DocumentIndex(b'<a href="a.png"></a><p><a href="b.html"></a></p>',
+    ...                       base="example.com")
+    >>> index.query(r"\\.png$")
+    ['http://example.com/a.png']
+    >>> index.query(selector="p")
+    ['http://example.com/b.html']
+    >>> index.entries
+    [('a', 'href', 'http://example.com/a.png'), ('a', 'href', 'http://example.com/b.html')]
+
+    """
+
+    def __init__(self, content, base=None, parser="auto", extractors=None):
+        """Init."""
+        if parser not in PARSERS:
+            raise ValueError("unrecognized parser '%s'" % parser)
+        self.base = _with_scheme("localhost" if base is None else base)
+        self.parser = parser
+        self.extractors = _compile_extractors(extractors)
+        self._content = content
+        self._entries = None
+        self._soup = None
+        self._soup_base = None
+        self._selections = {}
+        self._lock = threading.Lock()
+
+    def _soup_entries(self, selector):
+        """Entries of a selection; the caller must hold the lock."""
+        if self._soup is None:
+            # the tree parser for selectors (fails for "stream")
+            tree_parser = _select_parser(self.parser, selector="*")
+            self._soup, self._soup_base = _make_soup(self._content, self.base,
+                                                     tree_parser)
+        return _soup_urls(self._soup, self._soup_base, selector, self.extractors)
+
+    @property
+    def entries(self):
+        """List of ``(tag, attribute, url)`` tuples of the whole document."""
+        with self._lock:
+            if self._entries is None:
+                if _select_parser(self.parser, None) == "stream":
+                    self._entries = _stream_urls(self._content, self.base,
+                                                 self.extractors)
+                else:
+                    self._entries = self._soup_entries(None)
+            return self._entries
+
+    def selection_entries(self, selector):
+        """List of ``(tag, attribute, url)`` tuples within a selection.
+
+        Parameters
+        ----------
+        selector : str
+            CSS selector; see `urlgrep`.
+
+        Raises
+        ------
+        ValueError
+            If the parser is ``"stream"``.
+
+        """
+        with self._lock:
+            if selector not in self._selections:
+                self._selections[selector] = self._soup_entries(selector)
+            return self._selections[selector]
+
+    def query(self, pattern=None, selector=None, deduplicate=True):
+        """Extract URLs matching a pattern.
+
+        Parameters
+        ----------
+        pattern, selector, deduplicate
+            See `urlgrep`.
+
+        Returns
+        -------
+        matching_urls : list
+
+        """
+        regex = _compile_pattern(pattern)
+        entries = (self.entries if selector is None
+                   else self.selection_entries(selector))
+        matching_urls = [parsed_url for _, _, parsed_url in entries
+                         if regex.search(parsed_url)]
+
+        if deduplicate:
+            seen = set()
+            seen_add = seen.add
+            matching_urls = [url for url in matching_urls
+                             if not (url in seen or seen_add(url))]
+
+        return matching_urls
+
+
+class DocumentIndexCache(object):
+
+    """LRU cache of `DocumentIndex` objects, keyed by content digest.
+
+    Documents are identified by the SHA-1 digest of their content
+    (computed with `zmwangx.hash.file_hash`), the base URL, the parser
+    and the extractors, so the cache can be shared between documents from different
+    sources. Instances are safe to share between threads.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of documents kept. Default is 32.
+
+    Examples
+    --------
+    >>> cache = DocumentIndexCache()
+    >>> cache.get(b'<a href="a">') is cache.get(b'<a href="a">')
+    True
+    >>> len(cache)
+    1
+
+    """
+
+    def __init__(self, maxsize=32):
+        """Init."""
+        self.maxsize = maxsize
+        self._indexes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, content, base=None, parser="auto", extractors=None):
+        """Get the index of a document, creating it on a miss.
+
+        Parameters
+        ----------
+        content, base, parser, extractors
+            See `DocumentIndex`.
+
+        Returns
+        -------
+        index : DocumentIndex
+
+        """
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        extractors = _compile_extractors(extractors)
+        # str and bytes documents are decoded differently
+        key = (zmwangx.hash.file_hash(io.BytesIO(data)), isinstance(content, str),
+               _with_scheme("localhost" if base is None else base), parser,
+               extractors.names if extractors is not None else None)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        index = DocumentIndex(content, base, parser, extractors)
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.maxsize:
+                self._indexes.popitem(last=False)
+        return index
+
+    def clear(self):
+        """Remove all documents."""
+        with self._lock:
+            self._indexes.clear()
+
+    def __len__(self):
+        """Number of documents."""
+        with self._lock:
+            return len(self._indexes)
+
+def _with_scheme(url):
+    """Attach "http://" to a URL without a scheme."""
+    return url if _URL_SCHEME.match(url) else "http://%s" % url
+
+def _read_chunks(fileobj, chunk_size):
+    """Read a binary or text file object in chunks."""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def _decoded_chunks(chunks, encoding=None):
+    """Incrementally decode chunks of an HTML document.
+
+    The encoding is, in order of precedence: the one indicated by a byte
+    order mark, `encoding` (e.g., from the Content-Type header), the one
+    declared within the first ``ENCODING_SNIFF_SIZE`` bytes, and UTF-8.
+    Undecodable bytes are replaced. Chunks that are already ``str`` are
+    passed through.
+
+    """
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            yield chunk
+            yield from chunks
+            return
+        head += chunk
+        if len(head) >= ENCODING_SNIFF_SIZE:
+            break
+
+    head, bom_encoding = bs4.dammit.EncodingDetector.strip_byte_order_mark(head)
+    candidates = [
+        bom_encoding,
+        encoding,
+        bs4.dammit.EncodingDetector.find_declared_encoding(
+            head[:ENCODING_SNIFF_SIZE], is_html=True),
+        "utf-8",
+    ]
+    for candidate in candidates:
+        try:
+            decoder = codecs.getincrementaldecoder(candidate)(errors="replace")
+            break
+        except (LookupError, TypeError):
+            continue
+
+    yield decoder.decode(head)
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
 def urlgrep(pattern=None, content=None, filepath=None, url=None,
-            selector=None, base=None, deduplicate=True, session=None):
+            selector=None, base=None, deduplicate=True, session=None,
+            parser="auto", cache=None, index_cache=None, extractors=None):
     """Extract URLs matching a pattern from an HTML document.
 
     The HTML document is either passed in full as a string (the
@@ -81,10 +1067,17 @@ def urlgrep(pattern=None, content=None, filepath=None, url=None,
     scheme". You may supply an empty string if you want to include
     ``javascript:``.
 
+    By default, URLs are only taken from the attributes in `_TAG_ATTRS`.
+    More URLs, e.g., those in ``srcset`` or in stylesheets, are found by
+    the `extractors` (see `EXTRACTORS`), which are applied in the same
+    pass over the document.
+
     Parameters
     ----------
-    pattern : str, optional
-        Regex pattern to match parsed URLs against. Default is
+    pattern : str or PatternSet, optional
+        Regex pattern to match parsed URLs against, or a `PatternSet`
+        (or a list or dict to construct one from), in which case URLs
+        matching any of the patterns match. Default is
         ``r"^(?!javascript:)"``.
     content : bytes or str, optional
         An HTML document.
@@ -107,6 +1100,18 @@ def urlgrep(pattern=None, content=None, filepath=None, url=None,
     session : requests.Session, optional
         If not ``None``, make HTTP requests within this session. Default
         is ``None``.
+    parser : str, optional
+        Parser backend, one of `PARSERS`. Default is ``"auto"``.
+    cache : zmwangx.httpcache.HTTPCache, optional
+        If not ``None``, retrieve `url` through this HTTP cache. Default
+        is ``None``.
+    index_cache : DocumentIndexCache, optional
+        If not ``None``, reuse the parsed document from this cache if
+        the same document has been seen. Default is ``None``.
+    extractors : ExtractorSet or list, optional
+        Additional extractors, or their names (or ``"all"``) to
+        construct an `ExtractorSet` from. Pass an `ExtractorSet` to
+        avoid compiling it for each document. Default is ``None``.
 
     Returns
     -------
@@ -116,7 +1121,9 @@ def urlgrep(pattern=None, content=None, filepath=None, url=None,
     Raises
     ------
     ValueError
-        If content, filepath and url are all None.
+        If content, filepath and url are all None, if the parser is not
+        recognized or does not support the selector, or if an extractor
+        is not registered.
     OSError
         If failed to open the specified file.
     requests.exceptions.RequestException
@@ -126,11 +1133,9 @@ def urlgrep(pattern=None, content=None, filepath=None, url=None,
 
     # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
 
-    urlscheme = re.compile(r"^\w+://")
-
-    base = "localhost" if base is None else base
-    if not urlscheme.match(base):
-        base = "http://%s" % base
+    parser = _select_parser(parser, selector)
+    extractors = _compile_extractors(extractors)
+    base = _with_scheme("localhost" if base is None else base)
 
     if content is not None:
         pass
@@ -138,9 +1143,11 @@ def urlgrep(pattern=None, content=None, filepath=None, url=None,
         with open(filepath, mode='rb') as fileobj:
             content = fileobj.read()
     elif url is not None:
-        if not urlscheme.match(url):
-            url = "http://%s" % url
-        if session is None:
+        url = _with_scheme(url)
+        if cache is not None:
+            request = cache.fetch(url, session=session,
+                                  headers=REQUEST_HEADERS if session is None else None)
+        elif session is None:
             request = requests.get(url, headers=REQUEST_HEADERS)
         else:
             request = session.get(url)
@@ -149,36 +1156,236 @@ def urlgrep(pattern=None, content=None, filepath=None, url=None,
     else:
         raise ValueError("content, filepath and url cannot all be None")
 
-    regex = (re.compile(pattern) if pattern is not None
-             else re.compile(r"^(?!javascript:)"))
+    if index_cache is not None:
+        index = index_cache.get(content, base, parser, extractors)
+    else:
+        index = DocumentIndex(content, base, parser, extractors)
+    return index.query(pattern, selector, deduplicate)
 
-    soup = bs4.BeautifulSoup(content, "html.parser")
+def iter_urlgrep(pattern=None, content=None, filepath=None, url=None,
+                 fileobj=None, base=None, deduplicate=True, session=None,
+                 chunk_size=65536, extractors=None):
+    """Extract URLs matching a pattern from an HTML document, lazily.
 
-    # base URL might be modified by the HTML <base> tag, which must
-    # reside inside <head>
-    if soup.head and soup.head.base and "href" in soup.head.base.attrs:
-        base = soup.head.base["href"]
+    This is the streaming counterpart of `urlgrep` (with the
+    ``"stream"`` parser, hence no selector): the document is read and
+    parsed in chunks, and matching URLs are generated as soon as they
+    are parsed, so that memory usage does not grow with the size of the
+    document [#]_, and results from a remote document are available
+    before it is fully downloaded.
 
-    # select part of the soup with the optional selector
-    selections = [soup] if selector is None else soup.select(selector)
+    The sources of the document and the other parameters are the same
+    as in `urlgrep`, with the addition of `fileobj`, which is only used
+    if `content`, `filepath` and `url` are all None.
 
-    matching_urls = []
-    for selection in selections:
-        for tag in selection.descendants:
-            if tag.name in _TAG_ATTRS:
-                for attribute in _TAG_ATTRS[tag.name]:
-                    if attribute in tag.attrs:
-                        parsed_url = urllib.parse.urljoin(base, tag[attribute])
-                        if regex.search(parsed_url):
-                            matching_urls.append(parsed_url)
+    Byte streams are decoded according to the byte order mark, the
+    charset in the Content-Type header (for `url`), or the encoding
+    declared at the beginning of the document, in that order; failing
+    all of the above, UTF-8 is assumed. This may differ from the
+    encoding detected by `urlgrep` for undeclared, non-UTF-8 documents.
 
-    if deduplicate:
-        seen = set()
-        seen_add = seen.add
-        matching_urls = [url for url in matching_urls
-                         if not (url in seen or seen_add(url))]
+    .. [#] Except for the set of seen URLs when `deduplicate` is
+       ``True``, and URLs held back until the base URL is settled,
+       which only happens at the end of a document without ``<head>``
+       or ``<body>``.
+
+    Parameters
+    ----------
+    fileobj : file object, optional
+        A file object in binary or text mode.
+    chunk_size : int, optional
+        Size of chunks to read and parse at a time. Default is 65536.
+
+    Returns
+    -------
+    matching_urls : generator
+        Generator of parsed absolute URLs matching the given pattern.
+
+    Raises
+    ------
+    ValueError
+        If content, filepath, url and fileobj are all None, or if an
+        extractor is not registered.
+    OSError
+        If failed to open or read the specified file.
+    requests.exceptions.RequestException
+        If requests fail to retrieve the URL specified.
+
+    Examples
+    --------
+    >>> import io
+    >>> stream = io.BytesIO(b'<a href="/foo">foo</a><a href="bar">bar</a>')
+    >>> for url in iter_urlgrep(fileobj=stream, base="example.com/a/",
+    ...                         chunk_size=16):
+    ...     print(url)
+    http://example.com/foo
+    http://example.com/a/bar
+
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    if content is None and filepath is None and url is None and fileobj is None:
+        raise ValueError("content, filepath, url and fileobj cannot all be None")
+    regex = _compile_pattern(pattern)
+    return _iter_urlgrep(regex, content, filepath, url, fileobj,
+                         _with_scheme("localhost" if base is None else base),
+                         deduplicate, session, chunk_size,
+                         _compile_extractors(extractors))
+
+def _iter_urlgrep(regex, content, filepath, url, fileobj, base, deduplicate,
+                  session, chunk_size, extractors):
+    """Generator behind `iter_urlgrep`, which validates eagerly."""
+    # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+    encoding = None
+    response = None
+    if content is not None:
+        chunks = [content]
+    elif filepath is not None:
+        fileobj = open(filepath, mode='rb')
+        chunks = _read_chunks(fileobj, chunk_size)
+    elif url is not None:
+        url = _with_scheme(url)
+        if session is None:
+            response = requests.get(url, headers=REQUEST_HEADERS, stream=True)
+        else:
+            response = session.get(url, stream=True)
+        base = response.url
+        # response.encoding defaults to ISO-8859-1 for text/* types,
+        # which is only trusted if explicitly specified
+        if "charset" in response.headers.get("content-type", "").lower():
+            encoding = response.encoding
+        chunks = response.iter_content(chunk_size)
+    else:
+        chunks = _read_chunks(fileobj, chunk_size)
+
+    parser = _StreamParser(base, extractors)
+    seen = set()
+    seen_add = seen.add
+
+    def matching(entries):
+        """Filter and optionally deduplicate parsed entries."""
+        for _, _, parsed_url in entries:
+            if regex.search(parsed_url):
+                if deduplicate:
+                    if parsed_url in seen:
+                        continue
+                    seen_add(parsed_url)
+                yield parsed_url
+
+    try:
+        for text in _decoded_chunks(chunks, encoding):
+            parser.feed(text)
+            yield from matching(parser.pop())
+        parser.close()
+        yield from matching(parser.pop())
+    finally:
+        if filepath is not None:
+            fileobj.close()
+        if response is not None:
+            response.close()
+
+def _unseen(urls, seen):
+    """Filter out URLs in `seen` (a set or a Bloom filter), adding the rest."""
+    if isinstance(seen, zmwangx.bloom.BloomFilter):
+        for url in urls:
+            if not seen.add(url):
+                yield url
+    else:
+        for url in urls:
+            if url not in seen:
+                seen.add(url)
+                yield url
 
-    return matching_urls
+def _print_matching_urls(source, matching_urls, verbose, rules=None, seen=None):
+    """Print matching URLs from a source, optionally with a header.
+
+    `matching_urls` may be a generator, in which case URLs are printed
+    as they are generated. If `rules` (a `PatternSet`) is given, the
+    names of the rules matching each URL are printed after it. If `seen`
+    (a set or a Bloom filter) is given, URLs in it are skipped, and
+    printed URLs are added to it; a source left without URLs then prints
+    nothing at all, rather than an empty line.
+
+    """
+    if seen is not None:
+        matching_urls = _unseen(matching_urls, seen)
+    printed = False
+    for matching_url in matching_urls:
+        if verbose and not printed:
+            sys.stderr.write("# from '%s':\n" % source)
+            sys.stderr.flush()
+        if rules is not None:
+            print("%s\t%s" % (matching_url, ",".join(rules.match(matching_url))))
+        else:
+            print(matching_url)
+        printed = True
+    if not printed and seen is None:
+        print()
+    sys.stdout.flush()
+
+def _urlgrep_url(url, **kwargs):
+    """Call `urlgrep` on a URL, capturing request errors.
+
+    Returns
+    -------
+    url, matching_urls, error : str, list, Exception
+
+    """
+    try:
+        return url, urlgrep(url=url, **kwargs), None
+    except requests.exceptions.RequestException as err:
+        return url, None, err
+
+def _urlgrep_file(filepath, streaming=False, **kwargs):
+    """Call `urlgrep` on a local file, capturing OS errors.
+
+    If `streaming` is true, `iter_urlgrep` is called instead, without
+    the ``selector`` and ``parser`` keyword arguments. Either way, the
+    result is a list, so that this can be called in worker processes.
+
+    Returns
+    -------
+    filepath, matching_urls, error : str, list, Exception
+
+    """
+    try:
+        if streaming:
+            kwargs.pop("selector", None)
+            kwargs.pop("parser", None)
+            return filepath, list(iter_urlgrep(filepath=filepath, **kwargs)), None
+        return filepath, urlgrep(filepath=filepath, **kwargs), None
+    except OSError as err:
+        return filepath, None, err
+
+def _crawl(args, urls, pattern, backend, rules, extractors, seen):
+    """CLI interface of the crawl mode."""
+    import zmwangx.urlcrawl  # not at the top level to avoid a circular import
+    returncode = 0
+    try:
+        results = zmwangx.urlcrawl.crawl(
+            urls, pattern=pattern, follow=args.follow,
+            max_depth=args.crawl, jobs=max(args.jobs, 1),
+            per_host=args.per_host, delay=args.delay, state=args.state,
+            bloom_capacity=args.bloom, selector=args.selector, parser=backend,
+            extractors=extractors, deduplicate=not args.preserve_duplicates)
+        for result in results:
+            if result.error is None:
+                matching_urls = result.matching_urls
+                if seen is not None:
+                    matching_urls = list(_unseen(matching_urls, seen))
+                if matching_urls:
+                    _print_matching_urls(result.url, matching_urls,
+                                         args.verbose, rules)
+            else:
+                sys.stderr.write("error: failed to get '%s'\n" % result.url)
+                sys.stderr.write("error: %s\n" % str(result.error))
+                sys.stderr.flush()
+                returncode = 1
+    except ValueError as err:
+        sys.stderr.write("error: %s\n" % str(err))
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    return returncode
 
 def main():
     """CLI interface."""
@@ -202,8 +1409,92 @@ def main():
                         the scheme is left out.""")
     parser.add_argument("-p", "--pattern",
                         help="""Regexp to match against.""")
+    parser.add_argument("-P", "--pattern-file", metavar="FILE",
+                        help="""File of regexps to match against, one
+                        per line, optionally named (NAME<tab>REGEXP);
+                        URLs matching any of them match. Empty lines and
+                        lines starting with "#" are ignored.""")
+    parser.add_argument("--show-rules", action="store_true",
+                        help="""With --pattern-file, print the names of
+                        the matching regexps after each URL, separated
+                        by a tab.""")
+    parser.add_argument("--parser", choices=PARSERS, default="auto",
+                        help="""Parser backend; default is "auto", i.e.,
+                        the streaming parser without a selector, and
+                        html.parser with one (see
+                        zmwangx.urlgrep.PARSERS).""")
+    parser.add_argument("-x", "--extract", metavar="NAMES",
+                        help="""Also extract URLs with these extractors,
+                        comma separated, or "all": %s (see
+                        zmwangx.urlgrep.EXTRACTORS).""" % ", ".join(EXTRACTORS))
     parser.add_argument("-d", "--preserve-duplicates", action="store_true",
                         help="""Do not deduplicate URLs within a document.""")
+    parser.add_argument("--global-dedupe", choices=["exact", "approx"],
+                        help="""Deduplicate URLs across all documents,
+                        printing each URL only once: "exact" remembers
+                        printed URLs in memory; "approx" remembers them
+                        in a Bloom filter of bounded size (see
+                        --dedupe-capacity), at the cost of occasionally
+                        dropping a URL never printed before.""")
+    parser.add_argument("--dedupe-capacity", metavar="N", type=int,
+                        default=10000000,
+                        help="""With --global-dedupe approx, the expected
+                        number of unique URLs; the Bloom filter takes
+                        about 1.8 bytes per URL at the default error
+                        rate. Default is 10000000.""")
+    parser.add_argument("--dedupe-error-rate", metavar="RATE", type=float,
+                        default=0.001,
+                        help="""With --global-dedupe approx, the rate of
+                        URLs wrongly dropped, as long as no more than
+                        --dedupe-capacity unique URLs are seen. Default
+                        is 0.001.""")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="""Number of URLs to fetch and parse
+                        concurrently, over a shared pool of keep-alive
+                        connections; also the number of processes
+                        parsing files in parallel (results are still
+                        printed in order). Default is 1.""")
+    parser.add_argument("--order", choices=["input", "completion"],
+                        default="input",
+                        help="""Order of output for URLs: "input" (default)
+                        prints results in the order the URLs are given;
+                        "completion" prints results as soon as they are
+                        available. Only relevant with --jobs.""")
+    parser.add_argument("--cache", action="store_true",
+                        help="""Retrieve URLs through the persistent HTTP
+                        cache (see zmwangx.httpcache); unchanged pages
+                        are not downloaded again.""")
+    parser.add_argument("--cache-ttl", metavar="SECONDS", type=float, default=0,
+                        help="""Serve cached pages younger than this
+                        without revalidation. Default is 0.""")
+    parser.add_argument("--crawl", metavar="DEPTH", type=int,
+                        help="""Crawl recursively from the URLs, following
+                        links up to DEPTH levels deep: by default, links
+                        matching the pattern on the same hosts; see
+                        also --follow. Matching URLs are printed for
+                        each page crawled. See zmwangx.urlcrawl.""")
+    parser.add_argument("--follow", metavar="PATTERN",
+                        help="""When crawling, follow links matching
+                        this regexp instead.""")
+    parser.add_argument("--per-host", type=int, default=2,
+                        help="""When crawling, maximum number of
+                        concurrent requests to the same host. Default
+                        is 2.""")
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="""When crawling, minimum interval between
+                        requests to the same host, in seconds. Default
+                        is 0.""")
+    parser.add_argument("--state", metavar="FILE",
+                        help="""When crawling, save the state of the
+                        crawl to FILE when interrupted, and resume from
+                        it if it exists. Removed once the crawl is
+                        complete.""")
+    parser.add_argument("--bloom", metavar="CAPACITY", type=int,
+                        help="""When crawling, remember crawled URLs in
+                        a Bloom filter for this many URLs (with a false
+                        positive rate of 0.001), instead of exactly. A
+                        state saved with --bloom must be resumed with
+                        it.""")
     parser.add_argument("-v", "--verbose", action="store_true",
                         help="""Print additional information to stderr.""")
     parser.add_argument("filepaths", metavar="FILE", nargs="*",
@@ -214,60 +1505,138 @@ def main():
     filepaths = args.filepaths
     base = args.base
     pattern = args.pattern
+    rules = None
+    if args.pattern_file is not None:
+        if pattern is not None:
+            parser.error("--pattern and --pattern-file are mutually exclusive")
+        try:
+            pattern = PatternSet.from_file(args.pattern_file)
+        except (OSError, re.error) as err:
+            sys.stderr.write("error: failed to load '%s'\n" % args.pattern_file)
+            sys.stderr.write("error: %s\n" % str(err))
+            return 1
+        if args.show_rules:
+            rules = pattern
+    extractors = None
+    if args.extract is not None:
+        try:
+            extractors = ExtractorSet(args.extract)
+        except ValueError as err:
+            parser.error(str(err))
     deduplicate = not args.preserve_duplicates
+    seen = None
+    if args.global_dedupe == "exact":
+        seen = set()
+    elif args.global_dedupe == "approx":
+        try:
+            seen = zmwangx.bloom.BloomFilter(args.dedupe_capacity,
+                                             args.dedupe_error_rate)
+        except ValueError as err:
+            parser.error(str(err))
+    jobs = max(args.jobs, 1)
+    backend = args.parser
+    if backend == "stream" and selector is not None:
+        parser.error("the stream parser does not support selectors")
     # verbose if --verbose specified and sources more than one
     verbose = len(urls) + len(filepaths) >= 2 if args.verbose else False
 
+    if args.crawl is not None:
+        if filepaths:
+            parser.error("--crawl only applies to URLs")
+        if not urls and args.state is None:
+            parser.error("--crawl requires URLs or --state")
+        return _crawl(args, urls, pattern, backend, rules, extractors, seen)
+
+    # without a selector, local documents are streamed
+    streaming = selector is None and backend in ("auto", "stream")
+
     returncode = 0
     if not urls and not filepaths:
-        content = sys.stdin.read()
-        matching_urls = urlgrep(pattern=pattern,
-                                content=content,
-                                selector=selector,
-                                base=base,
-                                deduplicate=deduplicate)
-        print('\n'.join(matching_urls))
-        sys.stdout.flush()
+        if streaming:
+            matching_urls = iter_urlgrep(pattern=pattern,
+                                         fileobj=sys.stdin,
+                                         base=base,
+                                         deduplicate=deduplicate,
+                                         extractors=extractors)
+        else:
+            matching_urls = urlgrep(pattern=pattern,
+                                    content=sys.stdin.read(),
+                                    selector=selector,
+                                    base=base,
+                                    deduplicate=deduplicate,
+                                    parser=backend,
+                                    extractors=extractors)
+        _print_matching_urls(None, matching_urls, False, rules, seen)
     else:
-        for url in urls:
+        if urls:
+            session = make_session(jobs)
+            cache = (zmwangx.httpcache.HTTPCache(ttl=args.cache_ttl)
+                     if args.cache else None)
+            kwargs = dict(pattern=pattern, selector=selector,
+                          deduplicate=deduplicate, session=session,
+                          parser=backend, cache=cache, extractors=extractors)
             try:
-                matching_urls = urlgrep(pattern=pattern,
-                                        url=url,
-                                        selector=selector,
-                                        deduplicate=deduplicate)
-
-                if verbose and matching_urls:
-                    sys.stderr.write("# from '%s':\n" % url)
-                    sys.stderr.flush()
+                with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                    futures = [executor.submit(_urlgrep_url, url, **kwargs)
+                               for url in urls]
+                    if args.order == "completion":
+                        futures = concurrent.futures.as_completed(futures)
+                    for future in futures:
+                        url, matching_urls, err = future.result()
+                        if err is None:
+                            _print_matching_urls(url, matching_urls, verbose, rules,
+                                                 seen)
+                        else:
+                            sys.stderr.write("error: failed to get '%s'\n" % url)
+                            sys.stderr.write("error: %s\n" % str(err))
+                            sys.stderr.flush()
+                            returncode = 1
+            finally:
+                if cache is not None:
+                    cache.close()
 
-                print('\n'.join(matching_urls))
-                sys.stdout.flush()
-
-            except requests.exceptions.RequestException as err:
-                sys.stderr.write("error: failed to get '%s'\n" % url)
-                sys.stderr.write("error: %s\n" % str(err))
-                sys.stderr.flush()
-                returncode = 1
+        if jobs > 1 and len(filepaths) > 1:
+            worker = functools.partial(_urlgrep_file, streaming=streaming,
+                                       pattern=pattern, selector=selector,
+                                       base=base, deduplicate=deduplicate,
+                                       parser=backend, extractors=extractors)
+            # batches of files, small enough to balance the load
+            chunksize = min(max(len(filepaths) // (jobs * 16), 1), 256)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                for filepath, matching_urls, err in executor.map(
+                        worker, filepaths, chunksize=chunksize):
+                    if err is None:
+                        _print_matching_urls(filepath, matching_urls, verbose,
+                                             rules, seen)
+                    else:
+                        sys.stderr.write("error: failed to open '%s'\n" % filepath)
+                        sys.stderr.write("error: %s\n" % str(err))
+                        sys.stderr.flush()
+                        returncode = 1
+        else:
+            for filepath in filepaths:
+                try:
+                    if streaming:
+                        matching_urls = iter_urlgrep(pattern=pattern,
+                                                     filepath=filepath,
+                                                     base=base,
+                                                     deduplicate=deduplicate,
+                                                     extractors=extractors)
+                    else:
+                        matching_urls = urlgrep(pattern=pattern,
+                                                filepath=filepath,
+                                                selector=selector,
+                                                base=base,
+                                                deduplicate=deduplicate,
+                                                parser=backend,
+                                                extractors=extractors)
+                    _print_matching_urls(filepath, matching_urls, verbose, rules,
+                                         seen)
 
-        for filepath in filepaths:
-            try:
-                matching_urls = urlgrep(pattern=pattern,
-                                        filepath=filepath,
-                                        selector=selector,
-                                        base=base,
-                                        deduplicate=deduplicate)
-
-                if verbose and matching_urls:
-                    sys.stderr.write("# from '%s':\n" % filepath)
+                except OSError as err:
+                    sys.stderr.write("error: failed to open '%s'\n" % filepath)
+                    sys.stderr.write("error: %s\n" % str(err))
                     sys.stderr.flush()
-
-                print('\n'.join(matching_urls))
-                sys.stdout.flush()
-
-            except OSError as err:
-                sys.stderr.write("error: failed to open '%s'\n" % filepath)
-                sys.stderr.write("error: %s\n" % str(err))
-                sys.stderr.flush()
-                returncode = 1
+                    returncode = 1
 
     return returncode